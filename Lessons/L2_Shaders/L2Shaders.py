@@ -9,12 +9,26 @@ from PySide6.QtOpenGLWidgets import QOpenGLWidget
 from PySide6.QtWidgets import QApplication, QMainWindow
 from loguru import logger
 
-from shader_util import Shader
+from capture import FrameRecorder
+from gl_calls import gl_calls
+from gl_state import gl_state
+from profiler import FrameProfiler
+from render_queue import RenderQueue
+from shader_reload import ShaderReloader
+from shader_util import Shader, compile_shaders
+from vertex_layout import VertexLayout
 
 VERT_SHADER_PATH = "vertex_shader.glsl"
 FRAG_SHADER_PATH = "fragment_shader.glsl"
 FRAG_SHADER2_PATH = "fragment_shader2.glsl"
 
+# Render queue passes
+FILL_PASS = 0
+OUTLINE_PASS = 1
+
+# One vertex: position and color, matching the locations in vertex_shader.glsl
+VERTEX_LAYOUT = VertexLayout(np.dtype([("aPos", np.float32, 3), ("aColor", np.float32, 3)]))
+
 
 class GLWidget(QOpenGLWidget):
 
@@ -22,8 +36,19 @@ class GLWidget(QOpenGLWidget):
         super().__init__()
         # self.shader_program = None
         self.VAO = None
+        self.VBO = None
+        self.EBO = None
         self.shader = None
         self.shader_outline = None
+        self.render_queue = RenderQueue()
+        self.shader_reloader = ShaderReloader(self)
+        # R toggles recording the animation as a PNG sequence
+        self.recorder = FrameRecorder("recording/L2_{frame:05d}.png")
+        # P logs the CPU/GPU frame timings and writes them as a Chrome trace
+        self.profiler = FrameProfiler()
+        # GL_CALL_PROFILE=1 counts and times every GL call, reported with P as well
+        if gl_calls.enabled:
+            gl_calls.install()
 
         self.wire_toggle = False
         self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
@@ -45,11 +70,23 @@ class GLWidget(QOpenGLWidget):
         if event.key() == Qt.Key.Key_1:
             self.wire_toggle = True
             self.update()
+        elif event.key() == Qt.Key.Key_R and not event.isAutoRepeat():
+            self.recorder.toggle()
+        elif event.key() == Qt.Key.Key_P and not event.isAutoRepeat():
+            logger.info(f"Frame timings in ms:\n{self.profiler.report()}")
+            self.profiler.export_chrome_trace("L2_trace.json")
+            if gl_calls.installed:
+                logger.info(f"GL calls:\n{gl_calls.report()}")
 
     def init_shaders(self):
         """Initialize the shaders"""
-        self.shader = Shader(VERT_SHADER_PATH, FRAG_SHADER_PATH, __file__)
-        self.shader_outline = Shader(VERT_SHADER_PATH, FRAG_SHADER2_PATH, __file__)
+        # Submit both programs before waiting on either so the driver can compile them in parallel
+        futures = compile_shaders([(VERT_SHADER_PATH, FRAG_SHADER_PATH),
+                                   (VERT_SHADER_PATH, FRAG_SHADER2_PATH)], __file__)
+        self.shader, self.shader_outline = (future.result() for future in futures)
+        # Rebuild the programs whenever one of their GLSL files is saved
+        self.shader_reloader.watch(self.shader)
+        self.shader_reloader.watch(self.shader_outline)
 
     def initialize_geometry(self):
         """Initialize the geometry"""
@@ -67,38 +104,22 @@ class GLWidget(QOpenGLWidget):
             3, 4, 5  # Triangle 2
         ], dtype=np.uint32)
 
-        self.VAO = glGenVertexArrays(1)
-        VBO = glGenBuffers(1)
-        EBO = glGenBuffers(1)
-
-        glBindVertexArray(self.VAO)
-
-        glBindBuffer(GL_ARRAY_BUFFER, VBO)
-        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
-
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, EBO)
-        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
-
-        stride = 6 * ctypes.sizeof(GLfloat)
-        # Vertex attribute
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, stride, None)
-        glEnableVertexAttribArray(0)
-        # Color attribute
-        offset = ctypes.c_void_p(3 * ctypes.sizeof(GLfloat))
-        glVertexAttribPointer(1, 3, GL_FLOAT, GL_FALSE, stride, offset)
-        glEnableVertexAttribArray(1)
-
-        glBindBuffer(GL_ARRAY_BUFFER, 0)
-        glBindVertexArray(0)
+        # Buffers and attribute pointers are derived from the vertex layout
+        self.VAO, self.VBO, self.EBO = VERTEX_LAYOUT.create_vao(vertices, indices)
 
     def initializeGL(self):
         super().initializeGL()
+        gl_state.make_current(self.context())
+        self.context().aboutToBeDestroyed.connect(self.cleanup)
         # glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
         # glEnable(GL_BLEND)
         # Init the shaders first
         self.init_shaders()
         # Init the geometry
         self.initialize_geometry()
+        # Filled geometry first, then the outlines on top
+        self.render_queue.add_pass(FILL_PASS, setup=lambda: gl_state.polygon_mode(GL_FILL))
+        self.render_queue.add_pass(OUTLINE_PASS, setup=lambda: gl_state.polygon_mode(GL_LINE))
 
         # Draw in wireframe
         # glPolygonMode(GL_FRONT_AND_BACK, GL_LINE)
@@ -107,40 +128,70 @@ class GLWidget(QOpenGLWidget):
         max_vertex_attributes = glGetIntegerv(GL_MAX_VERTEX_ATTRIBS)
         logger.info(f"Max Vertex Attributes: {max_vertex_attributes}")
 
+    def cleanup(self):
+        """Free the geometry while the context still exists"""
+        self.makeCurrent()
+        gl_state.make_current(self.context())
+        self.recorder.stop()
+        self.profiler.delete()
+        for shader in (self.shader, self.shader_outline):
+            self.shader_reloader.unwatch(shader)
+            shader.delete()
+        gl_state.delete_vertex_arrays([self.VAO])
+        glDeleteBuffers(2, [self.VBO, self.EBO])
+        self.doneCurrent()
+
     def resizeGL(self, w, h):
         super().resizeGL(w, h)
+        # Qt recreated the framebuffer object, which resets texture and framebuffer bindings behind the cache's back
+        gl_state.make_current(self.context())
+        gl_state.invalidate()
         glViewport(0, 0, w, h)
 
     def paintGL(self):
         super().paintGL()
-        self.shader: Shader
-        self.shader_outline: Shader
-        # Fill the viewport with this color
-        glClearColor(0.3, 0.1, 0.5, 1.0)
-        glClear(GL_COLOR_BUFFER_BIT)
-
-        # Render our geometry
-        time_val = time.time()
-        self.last_time = time_val
-        col_value = abs(math.sin(time_val))
-
-        self.shader.use()
-        vec_4f = (1 / col_value, col_value, 1 - col_value, 1.0)
-        self.shader.set_vec4f("factor", vec_4f)
-        self.shader.set_float("alpha", abs(math.sin(time_val)))
-
-        glBindVertexArray(self.VAO)
-
-        glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
-        glDrawElements(GL_TRIANGLES, 6, GL_UNSIGNED_INT, None)
-
-        # Draw triangles Outline
-        if self.wire_toggle:
-            self.shader_outline.use()
+        gl_state.make_current(self.context())
+        self.profiler.begin_frame()
+        try:
+            self.shader: Shader
+            self.shader_outline: Shader
+            with self.profiler.scope("update"):
+                self.shader_reloader.update()
+            # Fill the viewport with this color
+            gl_state.clear_color(0.3, 0.1, 0.5, 1.0)
+            glClear(GL_COLOR_BUFFER_BIT)
+
+            # Render our geometry
+            time_val = time.time()
+            self.last_time = time_val
+            col_value = abs(math.sin(time_val))
+
             vec_4f = (1 / col_value, col_value, 1 - col_value, 1.0)
-            self.shader_outline.set_vec4f("factor", vec_4f)
-            glPolygonMode(GL_FRONT_AND_BACK, GL_LINE)
-            glDrawElements(GL_TRIANGLES, 6, GL_UNSIGNED_INT, None)
+            alpha = abs(math.sin(time_val))
+
+            def set_uniforms(shader: Shader):
+                shader.set_vec4f("factor", vec_4f)
+                if shader is self.shader:
+                    shader.set_float("alpha", alpha)
+
+            # Draws are sorted by pass and state before they are issued
+            self.render_queue.begin()
+            self.render_queue.submit(self.shader, self.VAO, 6, render_pass=FILL_PASS, uniforms=set_uniforms)
+
+            # Draw triangles Outline
+            if self.wire_toggle:
+                self.render_queue.submit(self.shader_outline, self.VAO, 6, render_pass=OUTLINE_PASS,
+                                         uniforms=set_uniforms)
+            with self.profiler.scope("draw"):
+                self.render_queue.execute()
+
+            # Reads the frame back asynchronously, encoding happens on worker processes
+            ratio = self.devicePixelRatio()
+            with self.profiler.scope("capture"):
+                self.recorder.update(int(self.width() * ratio), int(self.height() * ratio))
+        finally:
+            self.profiler.end_frame()
+            gl_calls.end_frame()
 
 
 if __name__ == "__main__":
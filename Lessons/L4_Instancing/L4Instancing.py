@@ -0,0 +1,174 @@
+import sys
+import time
+
+import numpy as np
+from OpenGL.GL import *
+from PySide6.QtCore import QTimer, Qt
+from PySide6.QtGui import QImage
+from PySide6.QtOpenGLWidgets import QOpenGLWidget
+from PySide6.QtWidgets import QApplication, QMainWindow
+from loguru import logger
+
+from gl_state import gl_state
+from instanced_renderer import InstancedRenderer
+from shader_reload import ShaderReloader
+from shader_util import Shader
+from util import q_image_view
+from vertex_layout import VertexLayout
+
+VERT_SHADER_PATH = "vertex_shader.glsl"
+FRAG_SHADER_PATH = "fragment_shader.glsl"
+TEXTURE_PATH = "../L3_Textures/img.jpg"
+
+# Number of quads per side of the grid
+GRID_SIZE = 100
+
+# One vertex of the quad: position and texture coordinates
+VERTEX_LAYOUT = VertexLayout(np.dtype([("aPos", np.float32, 3), ("aTexCoord", np.float32, 2)]))
+
+
+class GLWidget(QOpenGLWidget):
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.shader = None
+        self.quads = None
+        self.texture = None
+        self.shader_reloader = ShaderReloader(self)
+
+        self.wire_toggle = False
+        self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
+
+        self.repaint_timer = QTimer()
+        self.repaint_timer.setInterval(1000 // 60)  # Limit update to 60 fps
+        self.repaint_timer.timeout.connect(self.update)
+        self.repaint_timer.start()
+
+        self.last_time = None
+
+    def keyReleaseEvent(self, event):
+        super().keyReleaseEvent(event)
+        self.wire_toggle = False
+        self.update()
+
+    def keyPressEvent(self, event):
+        super().keyPressEvent(event)
+        if event.key() == Qt.Key.Key_1:
+            self.wire_toggle = True
+            self.update()
+
+    def init_shaders(self):
+        """Initialize the shaders"""
+        self.shader = Shader(VERT_SHADER_PATH, FRAG_SHADER_PATH, __file__)
+        self.shader_reloader.watch(self.shader)
+
+    def initialize_geometry(self):
+        """Initialize the geometry"""
+        length = 0.5
+        vertices = np.array([
+            # positions          # texture coordinates (t flipped, the image is uploaded top row first)
+            length,  length, 0.0,    1.0, 0.0,  # top right
+            length, -length, 0.0,    1.0, 1.0,  # bottom right
+           -length, -length, 0.0,    0.0, 1.0,  # bottom left
+           -length,  length, 0.0,    0.0, 0.0   # top left
+        ], dtype=np.float32)
+
+        indices = np.array([
+            0, 1, 3,  # Triangle 1
+            1, 2, 3  # Triangle 2
+        ], dtype=np.uint32)
+
+        # Every quad of the grid is an instance of the same mesh, drawn with a single call
+        self.quads = InstancedRenderer(vertices, indices, VERTEX_LAYOUT, capacity=GRID_SIZE * GRID_SIZE)
+        quads = self.quads.add(GRID_SIZE * GRID_SIZE)
+        cells = np.arange(GRID_SIZE * GRID_SIZE)
+        self.centers = (np.stack([cells % GRID_SIZE, cells // GRID_SIZE], axis=1) + 0.5) / GRID_SIZE * 2 - 1
+        quads["tint"][:, :3] = np.random.default_rng(0).uniform(0.5, 1.0, (len(cells), 3))
+        # Alternate between the two texture layers like a checkerboard
+        quads["layer"] = (cells % GRID_SIZE + cells // GRID_SIZE) % 2
+
+        # Texture array with the image and its negative as layers
+        image = QImage(TEXTURE_PATH)
+        if image.isNull():
+            # Paths are relative to the working directory, like the texture of L3
+            logger.error(f"Could not load '{TEXTURE_PATH}'")
+            image = QImage(1, 1, QImage.Format.Format_RGBA8888)
+            image.fill(Qt.GlobalColor.white)
+        image = image.convertToFormat(QImage.Format.Format_RGBA8888)
+        pixels = q_image_view(image)
+        negative = pixels.copy()
+        negative[..., :3] = 255 - negative[..., :3]
+        layers = np.stack([pixels, negative])
+
+        self.texture = glGenTextures(1)
+        gl_state.bind_texture(GL_TEXTURE_2D_ARRAY, self.texture)
+        glTexImage3D(GL_TEXTURE_2D_ARRAY, 0, GL_RGBA8, image.width(), image.height(), len(layers), 0,
+                     GL_RGBA, GL_UNSIGNED_BYTE, layers)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glGenerateMipmap(GL_TEXTURE_2D_ARRAY)
+
+    def animate_quads(self, time_val: float):
+        """Spin every quad, rewriting all transforms in one vectorized step"""
+        quads = self.quads.instances[:self.quads.count]
+        angles = time_val + self.centers[:, 0] * 3.0
+        scale = 0.8 / GRID_SIZE * (1.5 + np.sin(time_val * 2.0 + self.centers[:, 1] * 4.0) * 0.5)
+        cos, sin = np.cos(angles) * scale, np.sin(angles) * scale
+        # GLSL reads each row of the numpy matrix as a column, so this is the transposed model matrix
+        transforms = quads["transform"]
+        transforms[:, 0, 0], transforms[:, 0, 1] = cos, sin
+        transforms[:, 1, 0], transforms[:, 1, 1] = -sin, cos
+        transforms[:, 3, :2] = self.centers
+        self.quads.mark_dirty()
+
+    def initializeGL(self):
+        super().initializeGL()
+        gl_state.make_current(self.context())
+        # Init the shaders first
+        self.init_shaders()
+        # Init the geometry
+        self.initialize_geometry()
+
+        logger.info(f"Drawing {self.quads.count} quads per frame")
+
+    def resizeGL(self, w, h):
+        super().resizeGL(w, h)
+        # Qt recreated the framebuffer object, which resets texture and framebuffer bindings behind the cache's back
+        gl_state.make_current(self.context())
+        gl_state.invalidate()
+        glViewport(0, 0, w, h)
+
+    def paintGL(self):
+        super().paintGL()
+        gl_state.make_current(self.context())
+        self.shader: Shader
+        self.shader_reloader.update()
+        # Fill the viewport with this color
+        gl_state.clear_color(0.3, 0.1, 0.5, 1.0)
+        glClear(GL_COLOR_BUFFER_BIT)
+
+        # Render our geometry
+        time_val = time.time()
+        self.last_time = time_val
+        self.animate_quads(time_val)
+
+        self.shader.use()
+        self.shader.set_int("ourTextures", 0)
+        gl_state.bind_texture(GL_TEXTURE_2D_ARRAY, self.texture)
+
+        gl_state.polygon_mode(GL_LINE if self.wire_toggle else GL_FILL)
+        self.quads.draw()
+
+
+if __name__ == "__main__":
+    app = QApplication(sys.argv)
+    window = QMainWindow()
+    window.setWindowTitle("OpenGL With Qt")
+    screen_geometry = window.screen().geometry()
+    desired_geometry = (800, 600)
+    window.setGeometry((screen_geometry.width() - desired_geometry[0]) // 2,
+                       (screen_geometry.height() - desired_geometry[1]) // 2,
+                       *desired_geometry)
+    window.setCentralWidget(GLWidget())
+    window.show()
+    sys.exit(app.exec())
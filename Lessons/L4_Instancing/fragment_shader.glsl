@@ -0,0 +1,14 @@
+#version 330 core
+
+out vec4 FragColor;
+
+in vec2 TexCoord;
+in vec4 Tint;
+flat in float Layer;
+
+uniform sampler2DArray ourTextures;
+
+void main()
+{
+    FragColor = texture(ourTextures, vec3(TexCoord, Layer)) * Tint;
+}
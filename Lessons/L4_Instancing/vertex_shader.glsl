@@ -0,0 +1,19 @@
+#version 330 core
+layout (location = 0) in vec3 aPos;
+layout (location = 1) in vec2 aTexCoord;
+// Per instance attributes, a mat4 takes the four locations 2 to 5
+layout (location = 2) in mat4 aTransform;
+layout (location = 6) in vec4 aTint;
+layout (location = 7) in float aLayer;
+
+out vec2 TexCoord;
+out vec4 Tint;
+flat out float Layer;
+
+void main()
+{
+    gl_Position = aTransform * vec4(aPos, 1.0);
+    TexCoord = aTexCoord;
+    Tint = aTint;
+    Layer = aLayer;
+}
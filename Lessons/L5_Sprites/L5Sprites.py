@@ -0,0 +1,143 @@
+import sys
+import time
+
+import numpy as np
+from OpenGL.GL import *
+from PySide6.QtCore import QTimer, Qt
+from PySide6.QtGui import QImage
+from PySide6.QtOpenGLWidgets import QOpenGLWidget
+from PySide6.QtWidgets import QApplication, QMainWindow
+from loguru import logger
+
+from gl_state import gl_state
+from shader_reload import ShaderReloader
+from shader_util import Shader
+from sprite_batcher import SpriteBatcher, TextureAtlas
+
+VERT_SHADER_PATH = "vertex_shader.glsl"
+FRAG_SHADER_PATH = "fragment_shader.glsl"
+TEXTURE_PATH = "../L3_Textures/img.jpg"
+
+SPRITE_COUNT = 2000
+# Lower this to see the sprites spread over several pages (and draw calls)
+ATLAS_PAGE_SIZE = 1024
+
+
+class GLWidget(QOpenGLWidget):
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.shader = None
+        self.atlas = None
+        self.batcher = None
+        self.regions = []
+        self.shader_reloader = ShaderReloader(self)
+
+        self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
+
+        self.repaint_timer = QTimer()
+        self.repaint_timer.setInterval(1000 // 60)  # Limit update to 60 fps
+        self.repaint_timer.timeout.connect(self.update)
+        self.repaint_timer.start()
+
+        self.last_report = 0.0
+
+    def init_shaders(self):
+        """Initialize the shaders"""
+        self.shader = Shader(VERT_SHADER_PATH, FRAG_SHADER_PATH, __file__)
+        self.shader_reloader.watch(self.shader)
+
+    def initialize_sprites(self):
+        """Pack tiles of the L3 texture of varying sizes into the atlas and scatter sprites using them"""
+        image = QImage(TEXTURE_PATH)
+        if image.isNull():
+            # Paths are relative to the working directory, like the texture of L3
+            logger.error(f"Could not load '{TEXTURE_PATH}'")
+            image = QImage(256, 256, QImage.Format.Format_RGBA8888)
+            image.fill(Qt.GlobalColor.white)
+
+        self.atlas = TextureAtlas(ATLAS_PAGE_SIZE)
+        rng = np.random.default_rng(0)
+        for index in range(64):
+            width, height = rng.integers(16, min(image.width(), image.height()) // 2, 2)
+            x = int(rng.integers(0, image.width() - width))
+            y = int(rng.integers(0, image.height() - height))
+            self.regions.append(self.atlas.add(f"tile{index}", image.copy(x, y, int(width), int(height))))
+        logger.info(f"Packed {len(self.regions)} images into {len(self.atlas.pages)} atlas pages, "
+                    f"{self.atlas.efficiency:.0%} efficient")
+
+        self.batcher = SpriteBatcher(self.atlas, self.shader, capacity=SPRITE_COUNT)
+        self.sprite_regions = rng.integers(0, len(self.regions), SPRITE_COUNT)
+        self.positions = rng.uniform(0.0, 1.0, (SPRITE_COUNT, 2))
+        self.velocities = rng.uniform(-0.2, 0.2, (SPRITE_COUNT, 2))
+        self.colors = rng.integers(128, 256, (SPRITE_COUNT, 4))
+        self.colors[:, 3] = 255
+
+    def initializeGL(self):
+        super().initializeGL()
+        gl_state.make_current(self.context())
+        # Init the shaders first
+        self.init_shaders()
+        # Init the sprites
+        self.initialize_sprites()
+
+        gl_state.set_enabled(GL_BLEND)
+        gl_state.blend_func(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+
+    def resizeGL(self, w, h):
+        super().resizeGL(w, h)
+        # Qt recreated the framebuffer object, which resets texture and framebuffer bindings behind the cache's back
+        gl_state.make_current(self.context())
+        gl_state.invalidate()
+        glViewport(0, 0, w, h)
+
+    def paintGL(self):
+        super().paintGL()
+        gl_state.make_current(self.context())
+        self.shader: Shader
+        self.shader_reloader.update()
+        # Fill the viewport with this color
+        gl_state.clear_color(0.3, 0.1, 0.5, 1.0)
+        glClear(GL_COLOR_BUFFER_BIT)
+
+        # Bounce the sprites around the unit square
+        self.positions += self.velocities / 60
+        outside = (self.positions < 0.0) | (self.positions > 1.0)
+        self.velocities[outside] *= -1
+        np.clip(self.positions, 0.0, 1.0, out=self.positions)
+
+        # Pixel space projection, transposed as GLSL reads the rows of the numpy matrix as columns
+        width, height = self.width(), self.height()
+        projection = np.identity(4, dtype=np.float32)
+        projection[0, 0], projection[1, 1] = 2.0 / width, 2.0 / height
+        projection[3, :2] = -1.0
+
+        self.shader.use()
+        self.shader.set_int("atlas", 0)
+        self.shader.set_mat4fv("projection", projection)
+
+        self.batcher.begin()
+        for region_index, (x, y), color in zip(self.sprite_regions.tolist(), self.positions.tolist(),
+                                               self.colors.tolist()):
+            region = self.regions[region_index]
+            self.batcher.draw(region, x * width - region.width / 2, y * height - region.height / 2, color=color)
+        self.batcher.end()
+
+        now = time.time()
+        if now - self.last_report > 1.0:
+            self.last_report = now
+            logger.info(f"{self.batcher.sprite_count} sprites in {self.batcher.draw_calls} draw calls")
+
+
+if __name__ == "__main__":
+    app = QApplication(sys.argv)
+    window = QMainWindow()
+    window.setWindowTitle("OpenGL With Qt")
+    screen_geometry = window.screen().geometry()
+    desired_geometry = (800, 600)
+    window.setGeometry((screen_geometry.width() - desired_geometry[0]) // 2,
+                       (screen_geometry.height() - desired_geometry[1]) // 2,
+                       *desired_geometry)
+    window.setCentralWidget(GLWidget())
+    window.show()
+    sys.exit(app.exec())
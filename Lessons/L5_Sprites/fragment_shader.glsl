@@ -0,0 +1,13 @@
+#version 330 core
+
+out vec4 FragColor;
+
+in vec2 TexCoord;
+in vec4 Color;
+
+uniform sampler2D atlas;
+
+void main()
+{
+    FragColor = texture(atlas, TexCoord) * Color;
+}
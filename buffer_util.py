@@ -0,0 +1,398 @@
+import bisect
+import ctypes
+import math
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from OpenGL.GL import *
+
+
+def map_address(pointer) -> int:
+    """
+    Normalizes the pointer returned by glMapBufferRange, which PyOpenGL hands out as int or ctypes pointer.
+
+    Args:
+    pointer: The mapped pointer.
+
+    Returns:
+    int: The address.
+    """
+    if isinstance(pointer, int):
+        return pointer
+    return ctypes.cast(pointer, ctypes.c_void_p).value
+
+
+def create_persistent_buffer(target: int, size: int) -> Tuple[int, np.ndarray]:
+    """
+    Creates an immutable buffer (glBufferStorage) that stays mapped persistently and coherently for writing.
+
+    Args:
+    target (int): The binding target used to create the buffer.
+    size (int): Size in bytes.
+
+    Returns:
+    Tuple[int, np.ndarray]: The buffer and a uint8 array over its mapped memory.
+    """
+    flags = GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT
+    buffer = glGenBuffers(1)
+    glBindBuffer(target, buffer)
+    glBufferStorage(target, size, None, flags)
+    address = map_address(glMapBufferRange(target, 0, size, flags))
+    glBindBuffer(target, 0)
+    return buffer, np.ctypeslib.as_array((ctypes.c_ubyte * size).from_address(address))
+
+
+class PersistentRingBuffer:
+    """
+    A buffer split into segments that stays persistently and coherently mapped (glBufferStorage, GL 4.4 or
+    ARB_buffer_storage), exposed to Python as a numpy array.
+
+    Each frame writes into one segment between begin() and end(). end() places a fence, and begin() only hands the
+    segment out again once the GPU has passed that fence, so regions still being read are never overwritten and the
+    driver never has to synchronize implicitly.
+    """
+
+    def __init__(self, target: int, segment_size: int, segments: int = 3):
+        """
+        Args:
+        target (int): The binding target the buffer is used with, e.g. GL_PIXEL_UNPACK_BUFFER.
+        segment_size (int): Size of one segment in bytes.
+        segments (int): Number of segments, i.e. how many frames the GPU may lag behind.
+        """
+        self.target = target
+        self.segment_size = segment_size
+        self.segments = segments
+        self.size = segment_size * segments
+
+        self.buffer, self.memory = create_persistent_buffer(target, self.size)
+
+        self.fences = [None] * segments
+        self.index = 0
+
+    @staticmethod
+    def supported() -> bool:
+        """
+        Returns whether the current context provides glBufferStorage.
+        """
+        return bool(glBufferStorage)
+
+    @property
+    def offset(self) -> int:
+        """
+        Byte offset of the current segment in the buffer.
+        """
+        return self.index * self.segment_size
+
+    def begin(self) -> Optional[np.ndarray]:
+        """
+        Returns the current segment for writing, or None if the GPU is still reading it. Never blocks.
+        """
+        fence = self.fences[self.index]
+        if fence is not None:
+            if glClientWaitSync(fence, 0, 0) not in (GL_ALREADY_SIGNALED, GL_CONDITION_SATISFIED):
+                return None
+            glDeleteSync(fence)
+            self.fences[self.index] = None
+        return self.memory[self.offset:self.offset + self.segment_size]
+
+    def end(self):
+        """
+        Fences the commands reading the current segment and moves on to the next one.
+        """
+        self.fences[self.index] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        self.index = (self.index + 1) % self.segments
+
+    def delete(self):
+        """
+        Unmaps and deletes the buffer and its fences.
+        """
+        for fence in self.fences:
+            if fence is not None:
+                glDeleteSync(fence)
+        self.fences = [None] * self.segments
+        self.memory = None
+        glBindBuffer(self.target, self.buffer)
+        glUnmapBuffer(self.target)
+        glBindBuffer(self.target, 0)
+        glDeleteBuffers(1, [self.buffer])
+
+
+class StreamingBuffer:
+    """
+    A persistently and coherently mapped buffer (see create_persistent_buffer) handing out variable sized regions in
+    ring order, for geometry rewritten every frame such as particles and lines.
+
+    allocate() returns a numpy view straight into the mapped memory, so the data is written once and never
+    reallocated or copied by glBufferData. end_frame() fences the regions allocated since the previous call. When
+    the ring wraps around onto regions of a frame the GPU may still be reading, allocate() waits on that frame's
+    fence first, so regions are never overwritten while in use. Size the buffer for about three frames of data and
+    `stalls` stays at zero.
+    """
+
+    def __init__(self, target: int = GL_ARRAY_BUFFER, size: int = 16 << 20):
+        """
+        Args:
+        target (int): The binding target the buffer is used with, e.g. GL_ARRAY_BUFFER.
+        size (int): Size of the ring in bytes.
+        """
+        self.target = target
+        self.size = size
+        self.buffer, self.memory = create_persistent_buffer(target, size)
+        self.head = 0
+        # (start, stop) byte ranges allocated in the current frame
+        self.current: List[List[int]] = []
+        # (fence, ranges) of the frames submitted and possibly still read by the GPU, oldest first
+        self.pending = deque()
+        self.stalls = 0
+
+    @staticmethod
+    def supported() -> bool:
+        """
+        Returns whether the current context provides glBufferStorage.
+        """
+        return bool(glBufferStorage)
+
+    @staticmethod
+    def _overlaps(ranges: List[List[int]], start: int, stop: int) -> bool:
+        return any(range_start < stop and start < range_stop for range_start, range_stop in ranges)
+
+    def allocate(self, count: int, dtype: np.dtype = np.uint8,
+                 alignment: Optional[int] = None) -> Tuple[int, np.ndarray]:
+        """
+        Allocates a region for this frame.
+
+        Args:
+        count (int): Number of elements.
+        dtype (np.dtype): Element type, e.g. a vertex dtype.
+        alignment (Optional[int]): Alignment of the region start in bytes, defaults to the least common multiple of
+        the element size and 4. The offset is then 4 byte aligned and a whole number of elements, so
+        `offset // dtype.itemsize` is usable as base vertex.
+
+        Returns:
+        Tuple[int, np.ndarray]: The byte offset of the region in the buffer and a (count,) array of dtype over it.
+        """
+        dtype = np.dtype(dtype)
+        nbytes = count * dtype.itemsize
+        if alignment is None:
+            alignment = math.lcm(dtype.itemsize, 4)
+        if nbytes > self.size:
+            raise ValueError(f"Cannot allocate {nbytes} bytes from a {self.size} byte streaming buffer")
+
+        start = -(-self.head // alignment) * alignment
+        if start + nbytes > self.size:
+            start = 0
+        stop = start + nbytes
+        if self._overlaps(self.current, start, stop):
+            raise RuntimeError(f"The allocations of one frame exceed the {self.size} byte streaming buffer")
+        # Fences signal in order, so waiting on the newest frame in the way also retires every older frame
+        in_the_way = [index for index, (_, ranges) in enumerate(self.pending) if self._overlaps(ranges, start, stop)]
+        if in_the_way:
+            fence = self.pending[in_the_way[-1]][0]
+            if glClientWaitSync(fence, 0, 0) not in (GL_ALREADY_SIGNALED, GL_CONDITION_SATISFIED):
+                self.stalls += 1
+                while glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1_000_000_000) == GL_TIMEOUT_EXPIRED:
+                    pass
+            for _ in range(in_the_way[-1] + 1):
+                glDeleteSync(self.pending.popleft()[0])
+
+        if self.current and self.current[-1][1] == start:
+            self.current[-1][1] = stop
+        else:
+            self.current.append([start, stop])
+        self.head = stop
+        return start, self.memory[start:stop].view(dtype)
+
+    def end_frame(self):
+        """
+        Fences the regions allocated since the last call. Call after the draws reading them were issued.
+        """
+        if not self.current:
+            return
+        self.pending.append((glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0), self.current))
+        self.current = []
+
+    def delete(self):
+        """
+        Unmaps and deletes the buffer and its fences.
+        """
+        for fence, _ in self.pending:
+            glDeleteSync(fence)
+        self.pending.clear()
+        self.memory = None
+        glBindBuffer(self.target, self.buffer)
+        glUnmapBuffer(self.target)
+        glBindBuffer(self.target, 0)
+        glDeleteBuffers(1, [self.buffer])
+
+
+class BufferArena:
+    """
+    Suballocates one large buffer, so many meshes share a few buffer objects instead of owning one each.
+
+    Free space is kept in a free list searched best fit (the smallest block that is large enough), and freed blocks
+    merge with free neighbours. Sizes and offsets are multiples of `granularity`: with the vertex stride as
+    granularity every offset is a whole number of vertices. When no block fits the buffer doubles, and compact()
+    moves the live blocks together to undo fragmentation. Both copy on the GPU with glCopyBufferSubData and replace
+    the buffer object, which bumps `generation` so users can rebind it.
+    """
+
+    def __init__(self, size: int = 4 << 20, granularity: int = 16, usage: int = GL_STATIC_DRAW):
+        """
+        Args:
+        size (int): Initial size in bytes, rounded up to the granularity.
+        granularity (int): Size and alignment unit of the blocks in bytes.
+        usage (int): Buffer usage hint.
+        """
+        self.granularity = granularity
+        self.usage = usage
+        self.size = self._round(size)
+        self.buffer = self._create_buffer(self.size)
+        # Offset -> size of the allocated and the free blocks
+        self.allocations = {}
+        self.free_blocks = {0: self.size} if self.size else {}
+        # (size, offset) of the free blocks, sorted for the best fit search
+        self.free_sizes = [(self.size, 0)] if self.size else []
+        self.used_bytes = 0
+        self.generation = 0
+
+    def _round(self, size: int) -> int:
+        return -(-size // self.granularity) * self.granularity
+
+    def _create_buffer(self, size: int) -> int:
+        buffer = glGenBuffers(1)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, buffer)
+        glBufferData(GL_COPY_WRITE_BUFFER, size, None, self.usage)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+        return buffer
+
+    def _add_free(self, offset: int, size: int):
+        """
+        Adds a free block, merging it with the free blocks right before and after it.
+        """
+        following = self.free_blocks.pop(offset + size, None)
+        if following is not None:
+            self.free_sizes.remove((following, offset + size))
+            size += following
+        for previous_offset, previous_size in self.free_blocks.items():
+            if previous_offset + previous_size == offset:
+                self.free_sizes.remove((previous_size, previous_offset))
+                del self.free_blocks[previous_offset]
+                offset, size = previous_offset, previous_size + size
+                break
+        self.free_blocks[offset] = size
+        bisect.insort(self.free_sizes, (size, offset))
+
+    def _replace_buffer(self, size: int, moves: List[Tuple[int, int, int]]):
+        """
+        Creates a new buffer, copies (source offset, destination offset, size) ranges into it and deletes the old one.
+        """
+        buffer = self._create_buffer(size)
+        glBindBuffer(GL_COPY_READ_BUFFER, self.buffer)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, buffer)
+        for source, destination, length in moves:
+            glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, source, destination, length)
+        glBindBuffer(GL_COPY_READ_BUFFER, 0)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+        glDeleteBuffers(1, [self.buffer])
+        self.buffer = buffer
+        self.size = size
+        self.generation += 1
+
+    def allocate(self, nbytes: int) -> int:
+        """
+        Reserves a block, growing the buffer if no free block is large enough.
+
+        Args:
+        nbytes (int): Size in bytes, rounded up to the granularity.
+
+        Returns:
+        int: Byte offset of the block in the buffer.
+        """
+        size = self._round(max(nbytes, 1))
+        index = bisect.bisect_left(self.free_sizes, (size, -1))
+        if index == len(self.free_sizes):
+            old_size = self.size
+            self._replace_buffer(max(old_size * 2, old_size + size),
+                                 [(offset, offset, length) for offset, length in self.allocations.items()])
+            self._add_free(old_size, self.size - old_size)
+            index = bisect.bisect_left(self.free_sizes, (size, -1))
+
+        block_size, offset = self.free_sizes.pop(index)
+        del self.free_blocks[offset]
+        if block_size > size:
+            self._add_free(offset + size, block_size - size)
+        self.allocations[offset] = size
+        self.used_bytes += size
+        return offset
+
+    def free(self, offset: int):
+        """
+        Returns a block to the free list.
+
+        Args:
+        offset (int): Offset returned by allocate().
+        """
+        size = self.allocations.pop(offset)
+        self.used_bytes -= size
+        self._add_free(offset, size)
+
+    def write(self, offset: int, data: np.ndarray):
+        """
+        Uploads data into an allocated block.
+
+        Args:
+        offset (int): Offset of the block.
+        data (np.ndarray): The data, at most the block size.
+        """
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.buffer)
+        glBufferSubData(GL_COPY_WRITE_BUFFER, offset, data.nbytes, data)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+
+    def compact(self) -> Dict[int, int]:
+        """
+        Moves the allocated blocks to the start of a new buffer in offset order, leaving one free block at the end.
+
+        Returns:
+        Dict[int, int]: Old offset -> new offset of every block that moved.
+        """
+        moves = []
+        destination = 0
+        for offset, size in sorted(self.allocations.items()):
+            moves.append((offset, destination, size))
+            destination += size
+        self._replace_buffer(self.size, moves)
+
+        self.allocations = {destination: size for _, destination, size in moves}
+        self.free_blocks = {}
+        self.free_sizes = []
+        if self.size > self.used_bytes:
+            self._add_free(self.used_bytes, self.size - self.used_bytes)
+        return {source: destination for source, destination, _ in moves if source != destination}
+
+    @property
+    def free_bytes(self) -> int:
+        return self.size - self.used_bytes
+
+    @property
+    def occupancy(self) -> float:
+        """
+        Fraction of the buffer allocated.
+        """
+        return self.used_bytes / self.size if self.size else 0.0
+
+    @property
+    def fragmentation(self) -> float:
+        """
+        Share of the free space outside the largest free block: 0 when all free space is one block, close to 1 when
+        it is scattered in small holes.
+        """
+        if not self.free_sizes:
+            return 0.0
+        return 1.0 - self.free_sizes[-1][0] / self.free_bytes
+
+    def delete(self):
+        """
+        Deletes the buffer.
+        """
+        glDeleteBuffers(1, [self.buffer])
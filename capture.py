@@ -0,0 +1,368 @@
+import ctypes
+import multiprocessing
+import os
+import queue
+import subprocess
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import List, Optional, Set, Tuple
+
+import numpy as np
+from OpenGL.GL import *
+from loguru import logger
+
+from buffer_util import map_address
+from util import numpy_to_q_image
+
+
+class FrameReadback:
+    """
+    Reads the framebuffer back without stalling the pipeline: glReadPixels writes into a ring of pixel pack buffers
+    and returns immediately, and each buffer is only mapped `depth - 1` frames later, when the GPU has long finished
+    the copy. With the default depth of 3, frame N - 2 is mapped while frame N renders.
+
+    Frames come out as (height, width, 4) RGBA uint8 arrays with the bottom row first, as glReadPixels writes them
+    (and util.q_image_to_numpy returns them). util.numpy_to_q_image turns them into QImages.
+    """
+
+    def __init__(self, depth: int = 3):
+        """
+        Args:
+        depth (int): Number of pixel pack buffers, i.e. frames in flight before a frame is returned.
+        """
+        self.depth = depth
+        self.buffers = list(glGenBuffers(depth)) if depth > 1 else [glGenBuffers(1)]
+        # Per buffer: (frame number, width, height, fence) of the pending read, or None
+        self.pending: List[Optional[tuple]] = [None] * depth
+        self.sizes = [0] * depth
+        self.index = 0
+        self.frame = 0
+        self.stalls = 0
+
+    def _collect(self, index: int) -> Optional[Tuple[int, np.ndarray]]:
+        """
+        Maps a buffer and copies its frame out, waiting for the copy only if the GPU has not finished it yet.
+        """
+        pending = self.pending[index]
+        if pending is None:
+            return None
+        self.pending[index] = None
+        frame, width, height, fence = pending
+        if glClientWaitSync(fence, 0, 0) not in (GL_ALREADY_SIGNALED, GL_CONDITION_SATISFIED):
+            self.stalls += 1
+            while glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1_000_000_000) == GL_TIMEOUT_EXPIRED:
+                pass
+        glDeleteSync(fence)
+
+        size = width * height * 4
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.buffers[index])
+        address = map_address(glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, size, GL_MAP_READ_BIT))
+        # One copy out of the mapping, which is gone after glUnmapBuffer
+        pixels = np.ctypeslib.as_array((ctypes.c_ubyte * size).from_address(address)).reshape(height, width, 4).copy()
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        return frame, pixels
+
+    def read(self, width: int, height: int, x: int = 0, y: int = 0) -> Optional[Tuple[int, np.ndarray]]:
+        """
+        Starts reading a rectangle of the bound read framebuffer and returns the frame read depth - 1 calls earlier.
+        Call at the end of paintGL.
+
+        Args:
+        width (int): Width of the rectangle, e.g. the framebuffer width.
+        height (int): Height of the rectangle.
+        x (int): Left edge.
+        y (int): Bottom edge.
+
+        Returns:
+        Optional[Tuple[int, np.ndarray]]: The frame number (counting read() calls) and pixels of the oldest frame in
+        flight, None while the ring is still filling up.
+        """
+        index = self.index
+        size = width * height * 4
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.buffers[index])
+        if self.sizes[index] != size:
+            glBufferData(GL_PIXEL_PACK_BUFFER, size, None, GL_STREAM_READ)
+            self.sizes[index] = size
+        glReadPixels(x, y, width, height, GL_RGBA, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.pending[index] = (self.frame, width, height, glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0))
+
+        self.frame += 1
+        # The next buffer holds the oldest frame in flight, taking it out frees the buffer for the next read
+        self.index = (index + 1) % self.depth
+        return self._collect(self.index)
+
+    def flush(self) -> List[Tuple[int, np.ndarray]]:
+        """
+        Returns every frame still in flight, oldest first, waiting for them if needed. Call after the last read().
+        """
+        frames = []
+        for offset in range(self.depth):
+            frame = self._collect((self.index + offset) % self.depth)
+            if frame is not None:
+                frames.append(frame)
+        return frames
+
+    def delete(self):
+        """
+        Deletes the buffers and fences, dropping the frames in flight.
+        """
+        for pending in self.pending:
+            if pending is not None:
+                glDeleteSync(pending[3])
+        self.pending = [None] * self.depth
+        glDeleteBuffers(len(self.buffers), self.buffers)
+
+
+def _write_png(path: str, pixels: np.ndarray):
+    """
+    Encodes one frame on a worker process.
+    """
+    if not numpy_to_q_image(pixels).save(path, "PNG"):
+        raise OSError(f"Could not write '{path}'")
+
+
+class FrameEncoder:
+    """
+    Writes captured frames (see FrameReadback) off the render thread, either as a PNG sequence encoded by a process
+    pool or as raw frames piped into a local ffmpeg binary by a writer thread.
+
+    Both stages are bounded by `max_pending` frames. submit() never blocks by default: when the encoder falls
+    behind, the frame is dropped and counted in `dropped`, so paintGL keeps its frame rate and the recording shows
+    where frames were lost instead of the whole app stuttering.
+    """
+
+    def __init__(self, output: str, width: int, height: int, fps: int = 60, max_pending: int = 8,
+                 workers: Optional[int] = None, ffmpeg: str = "ffmpeg", block: bool = False):
+        """
+        Args:
+        output (str): A path pattern ending in .png, formatted with the frame number (e.g. "out/{frame:05d}.png"),
+        or a video path handed to ffmpeg (e.g. "out.mp4").
+        width (int): Frame width.
+        height (int): Frame height.
+        fps (int): Frame rate of the video.
+        max_pending (int): Frames queued or being encoded before submit() drops frames.
+        workers (Optional[int]): PNG encoding processes, defaults to the CPU count.
+        ffmpeg (str): The ffmpeg executable.
+        block (bool): Make submit() wait for room instead of dropping frames, for offline rendering.
+        """
+        self.output = output
+        self.width = width
+        self.height = height
+        self.max_pending = max_pending
+        self.block = block
+        self.submitted = 0
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+        # Set by the writer thread when ffmpeg stopped accepting frames
+        self.failed = False
+
+        directory = os.path.dirname(os.path.abspath(output))
+        os.makedirs(directory, exist_ok=True)
+        self.executor = None
+        self.futures: Set[Future] = set()
+        self.process = None
+        self.frames = None
+        self.writer = None
+        if output.lower().endswith(".png"):
+            # Spawned rather than forked, a fork would copy the render thread's GL and Qt state into the workers
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            # Frames arrive bottom row first, vflip puts them upright
+            command = [ffmpeg, "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgba",
+                       "-s", f"{width}x{height}", "-r", str(fps), "-i", "-", "-vf", "vflip",
+                       "-pix_fmt", "yuv420p", output]
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+            self.frames = queue.Queue(maxsize=max_pending)
+            self.writer = threading.Thread(target=self._write_frames, name="frame-encoder", daemon=True)
+            self.writer.start()
+
+    def _write_frames(self):
+        """
+        Feeds queued frames to ffmpeg until the None sentinel. Pipe writes release the GIL. After ffmpeg exits, e.g.
+        on a bad codec or output path, frames are still taken off the queue and discarded, so it never fills up and
+        close() can always queue the sentinel.
+        """
+        while True:
+            pixels = self.frames.get()
+            if pixels is None:
+                break
+            if self.failed:
+                continue
+            try:
+                self.process.stdin.write(pixels.tobytes())
+                self.written += 1
+            except OSError as error:
+                self.errors += 1
+                self.failed = True
+                logger.error(f"ffmpeg stopped accepting frames (exit code {self.process.poll()}): {error}")
+
+    def _reap(self):
+        """
+        Collects finished PNG encodes.
+        """
+        for future in [future for future in self.futures if future.done()]:
+            self.futures.discard(future)
+            if future.exception() is not None:
+                self.errors += 1
+                logger.error(f"Could not encode frame: {future.exception()}")
+            else:
+                self.written += 1
+
+    def submit(self, frame: int, pixels: np.ndarray) -> bool:
+        """
+        Queues a frame for encoding.
+
+        Args:
+        frame (int): The frame number, used in PNG file names.
+        pixels (np.ndarray): (height, width, 4) RGBA pixels, bottom row first. Not modified, and not used after
+        submit() returns for PNG output.
+
+        Returns:
+        bool: Whether the frame was queued, False if it was dropped.
+        """
+        if pixels.shape != (self.height, self.width, 4):
+            raise ValueError(f"Frame of shape {pixels.shape} does not match the {self.width}x{self.height} encoder")
+        self.submitted += 1
+        if self.executor is not None:
+            self._reap()
+            while self.block and len(self.futures) >= self.max_pending:
+                # Failed encodes are counted by _reap() rather than raised into the render loop
+                wait(self.futures, return_when=FIRST_COMPLETED)
+                self._reap()
+            if len(self.futures) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self.futures.add(self.executor.submit(_write_png, self.output.format(frame=frame), pixels))
+            return True
+        if self.failed:
+            self.dropped += 1
+            return False
+        try:
+            self.frames.put(pixels, block=self.block)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def close(self):
+        """
+        Waits until every queued frame is written and stops the workers.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self._reap()
+            self.executor = None
+        if self.process is not None:
+            # The writer always drains the queue, the timeout only guards against ffmpeg hanging on a write
+            try:
+                self.frames.put(None, timeout=10)
+                self.writer.join(timeout=10)
+            except queue.Full:
+                logger.error("ffmpeg stopped reading frames, abandoning the recording")
+            if self.writer.is_alive():
+                self.process.kill()
+            try:
+                self.process.stdin.close()
+            except OSError:
+                # Flushing into a pipe ffmpeg already closed
+                pass
+            self.process.wait()
+            self.process = None
+        logger.info(f"Recorded {self.written} of {self.submitted} frames to '{self.output}'"
+                    + (f", dropped {self.dropped}" if self.dropped else ""))
+
+
+class FrameRecorder:
+    """
+    Records a widget's frames: asynchronous readback into a FrameEncoder. toggle() starts or stops recording, e.g.
+    from a key press, and update() at the end of paintGL applies it and captures the frame, so every GL call happens
+    with the widget's context current.
+
+    Each start, by toggle() or by a framebuffer size change, begins a new segment. PNG frames keep counting across
+    segments, and video segments after the first are written next to the output with a _1, _2, ... suffix, so no
+    segment overwrites an earlier one.
+    """
+
+    def __init__(self, output: str, fps: int = 60, **encoder_options):
+        """
+        Args:
+        output (str): Output passed to FrameEncoder.
+        fps (int): Frame rate of a video output.
+        **encoder_options: Further FrameEncoder arguments.
+        """
+        self.output = output
+        self.fps = fps
+        self.encoder_options = encoder_options
+        self.requested = False
+        self.readback = None
+        self.encoder = None
+        # Frames read in earlier segments, added to the frame numbers of the current one
+        self.frame_offset = 0
+        self.segments = 0
+
+    @property
+    def recording(self) -> bool:
+        return self.encoder is not None
+
+    def toggle(self):
+        """
+        Starts recording on the next update() if not recording, stops it otherwise.
+        """
+        self.requested = not self.requested
+
+    def _segment_output(self) -> str:
+        if self.output.lower().endswith(".png") or not self.segments:
+            return self.output
+        root, extension = os.path.splitext(self.output)
+        return f"{root}_{self.segments}{extension}"
+
+    def _start(self, width: int, height: int) -> bool:
+        output = self._segment_output()
+        try:
+            self.encoder = FrameEncoder(output, width, height, self.fps, **self.encoder_options)
+        except OSError as error:
+            # e.g. no ffmpeg binary, retrying every frame would fail the same way
+            logger.error(f"Could not start recording to '{output}': {error}")
+            self.requested = False
+            return False
+        self.readback = FrameReadback()
+        self.segments += 1
+        logger.info(f"Recording {width}x{height} frames to '{output}' from frame {self.frame_offset}")
+        return True
+
+    def update(self, width: int, height: int):
+        """
+        Starts or stops recording as toggled and captures the bound framebuffer while recording. The frame from two
+        updates ago is handed to the encoder. Recording restarts when the framebuffer size changes.
+
+        Args:
+        width (int): Framebuffer width in pixels.
+        height (int): Framebuffer height in pixels.
+        """
+        if self.recording and (not self.requested or (width, height) != (self.encoder.width, self.encoder.height)):
+            self.stop()
+        if not self.requested:
+            return
+        if not self.recording and not self._start(width, height):
+            return
+        result = self.readback.read(width, height)
+        if result is not None:
+            frame, pixels = result
+            self.encoder.submit(self.frame_offset + frame, pixels)
+
+    def stop(self):
+        """
+        Encodes the frames still in flight and finishes the output. Call with the GL context current.
+        """
+        if not self.recording:
+            return
+        for frame, pixels in self.readback.flush():
+            self.encoder.submit(self.frame_offset + frame, pixels)
+        self.frame_offset += self.readback.frame
+        self.readback.delete()
+        self.encoder.close()
+        self.readback = None
+        self.encoder = None
@@ -0,0 +1,177 @@
+import os
+import sys
+import time
+from types import ModuleType
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import OpenGL
+import OpenGL.GL
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class _TimedCall:
+    """
+    Counts and times the calls of a GL function into its [calls, nanoseconds] entry. Its truthiness is that of the
+    function, so capability checks like `if glBufferStorage:` still see PyOpenGL's null entry points as missing.
+    """
+
+    __slots__ = ("__wrapped_gl__", "entry", "__name__")
+
+    def __init__(self, function, entry: List[int]):
+        self.__wrapped_gl__ = function
+        self.entry = entry
+        self.__name__ = getattr(function, "__name__", type(function).__name__)
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return self.__wrapped_gl__(*args, **kwargs)
+        finally:
+            self.entry[1] += time.perf_counter_ns() - start
+            self.entry[0] += 1
+
+    def __bool__(self) -> bool:
+        return bool(self.__wrapped_gl__)
+
+    def __repr__(self) -> str:
+        return f"<timed {self.__wrapped_gl__!r}>"
+
+
+class GLCallCounter:
+    """
+    Opt-in instrumentation of the OpenGL.GL functions called by this repo's modules: counts the calls of every GL
+    entry point and the Python side time spent in them (PyOpenGL's argument conversion and error checking plus the
+    driver call), to find the calls worth batching or caching.
+
+    install() replaces the GL functions in the namespaces of the given modules (they import them with
+    `from OpenGL.GL import *`, so patching OpenGL.GL itself would not reach them) by timing wrappers, uninstall()
+    restores them. Modules imported after install() are not instrumented. Each wrapper adds two perf_counter_ns
+    calls, a fraction of a microsecond, to the time it measures.
+
+    Call end_frame() once per frame, report() lists the entry points by total time with their per frame averages.
+    Setting the GL_CALL_PROFILE environment variable enables it in the lessons.
+    """
+
+    def __init__(self):
+        self.enabled = os.environ.get("GL_CALL_PROFILE", "") != ""
+        # (module, name) -> the original function
+        self.originals: Dict[Tuple[ModuleType, str], object] = {}
+        # Entry point -> [calls, nanoseconds] of the current frame, mutated in place by the wrappers
+        self.current: Dict[str, List[int]] = {}
+        # Entry point -> [calls, nanoseconds] of the finished frames
+        self.totals: Dict[str, List[int]] = {}
+        self.frames = 0
+
+    @property
+    def installed(self) -> bool:
+        return bool(self.originals)
+
+    def _wrap(self, name: str, function) -> "_TimedCall":
+        entry = self.current.get(name)
+        if entry is None:
+            entry = self.current[name] = [0, 0]
+        return _TimedCall(function, entry)
+
+    @staticmethod
+    def _repo_modules() -> List[ModuleType]:
+        modules = []
+        for module in list(sys.modules.values()):
+            path = getattr(module, "__file__", None)
+            if path and os.path.abspath(path).startswith(REPO_ROOT + os.sep) and module.__name__ != __name__:
+                modules.append(module)
+        return modules
+
+    def install(self, modules: Optional[Iterable[ModuleType]] = None) -> int:
+        """
+        Instruments the GL functions in the namespaces of modules. Installing again instruments modules imported
+        since.
+
+        Args:
+        modules (Optional[Iterable[ModuleType]]): The modules, defaults to every loaded module of this repo, which
+        includes the running lesson.
+
+        Returns:
+        int: Number of functions instrumented by this call.
+        """
+        count = 0
+        for module in self._repo_modules() if modules is None else modules:
+            namespace = vars(module)
+            for name, value in list(namespace.items()):
+                if not name.startswith("gl") or (module, name) in self.originals:
+                    continue
+                # Only the GL functions themselves, not helpers or wrappers that happen to be named gl*
+                if not callable(value) or value is not getattr(OpenGL.GL, name, None):
+                    continue
+                self.originals[(module, name)] = value
+                namespace[name] = self._wrap(name, value)
+                count += 1
+        return count
+
+    def uninstall(self):
+        """
+        Restores the original GL functions.
+        """
+        for (module, name), function in self.originals.items():
+            if getattr(getattr(module, name, None), "__wrapped_gl__", None) is function:
+                setattr(module, name, function)
+        self.originals = {}
+
+    def end_frame(self):
+        """
+        Adds the calls of the current frame to the totals. Does nothing unless installed.
+        """
+        if not self.originals:
+            return
+        for name, entry in self.current.items():
+            if entry[0]:
+                total = self.totals.get(name)
+                if total is None:
+                    total = self.totals[name] = [0, 0]
+                total[0] += entry[0]
+                total[1] += entry[1]
+                entry[0] = entry[1] = 0
+        self.frames += 1
+
+    def reset(self):
+        """
+        Forgets the totals.
+        """
+        for entry in self.current.values():
+            entry[0] = entry[1] = 0
+        self.totals = {}
+        self.frames = 0
+
+    def top(self, count: int = 15) -> List[Tuple[str, int, int]]:
+        """
+        Returns the entry points with the most total time.
+
+        Args:
+        count (int): Number of entry points.
+
+        Returns:
+        List[Tuple[str, int, int]]: (name, calls, nanoseconds) over all finished frames, slowest first.
+        """
+        ranked = sorted(self.totals.items(), key=lambda item: item[1][1], reverse=True)
+        return [(name, calls, nanoseconds) for name, (calls, nanoseconds) in ranked[:count]]
+
+    def report(self, count: int = 15) -> str:
+        """
+        Returns a table of the slowest entry points with their calls and time per frame.
+
+        Args:
+        count (int): Number of entry points listed.
+        """
+        frames = max(self.frames, 1)
+        total = sum(nanoseconds for _, nanoseconds in self.totals.values())
+        calls = sum(entry_calls for entry_calls, _ in self.totals.values())
+        lines = [f"{calls / frames:.1f} GL calls and {total / frames / 1e6:.3f} ms per frame over {self.frames} "
+                 f"frames, OpenGL.ERROR_CHECKING={OpenGL.ERROR_CHECKING}",
+                 f"{'entry point':<40} {'calls/frame':>12} {'ms/frame':>9} {'us/call':>8} {'share':>6}"]
+        for name, entry_calls, nanoseconds in self.top(count):
+            lines.append(f"{name:<40} {entry_calls / frames:12.1f} {nanoseconds / frames / 1e6:9.3f} "
+                         f"{nanoseconds / entry_calls / 1e3:8.2f} {nanoseconds / max(total, 1):6.1%}")
+        return "\n".join(lines)
+
+
+gl_calls = GLCallCounter()
@@ -0,0 +1,261 @@
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+from OpenGL.GL import *
+from loguru import logger
+
+# Texture target -> the glGet query returning the texture bound to it on the active unit
+TEXTURE_BINDING_QUERIES = {
+    GL_TEXTURE_1D: GL_TEXTURE_BINDING_1D,
+    GL_TEXTURE_2D: GL_TEXTURE_BINDING_2D,
+    GL_TEXTURE_3D: GL_TEXTURE_BINDING_3D,
+    GL_TEXTURE_2D_ARRAY: GL_TEXTURE_BINDING_2D_ARRAY,
+    GL_TEXTURE_CUBE_MAP: GL_TEXTURE_BINDING_CUBE_MAP,
+}
+
+
+class _ContextState:
+    """The bindings and modes last set through GLStateCache in one context, None while unknown."""
+
+    def __init__(self):
+        self.program = None
+        self.vertex_array = None
+        self.active_texture = None
+        # (unit, target) -> texture
+        self.textures: Dict[Tuple[int, int], int] = {}
+        self.polygon_mode = None
+        self.clear_color = None
+        self.blend_func = None
+        # Capability -> enabled
+        self.capabilities: Dict[int, bool] = {}
+
+
+class GLStateCache:
+    """
+    Remembers the program, VAO, texture bindings and a few fixed function modes of each context and only forwards
+    calls that change them. Every skipped call saves the PyOpenGL wrapper overhead of the call.
+
+    The cache only knows about state changed through it, so code binding or deleting these objects has to go through
+    it too (the helpers of this repo do). Call make_current() at the start of paintGL: the state of every context is
+    tracked separately. With `validate` enabled, every call cross-checks the cached value against glGet* and logs
+    and repairs any difference, which finds code changing state behind the cache's back.
+    """
+
+    def __init__(self, validate: bool = False):
+        """
+        Args:
+        validate (bool): Check the cached state against the driver on every call. Slow, for debugging only.
+        """
+        self.validate = validate
+        # Context (e.g. QOpenGLWidget.context()) -> its state
+        self.contexts: Dict[object, _ContextState] = {}
+        # The context passed to the last make_current(), None before the first call
+        self.context = None
+        self.state = _ContextState()
+        self.calls_issued = 0
+        self.calls_skipped = 0
+        self.mismatches = 0
+
+    def make_current(self, context):
+        """
+        Switches to the cached state of a context. Call whenever a different context becomes current.
+
+        Args:
+        context: Any hashable identifying the context, e.g. QOpenGLWidget.context().
+        """
+        state = self.contexts.get(context)
+        if state is None:
+            state = self.contexts[context] = _ContextState()
+        self.context = context
+        self.state = state
+
+    def invalidate(self):
+        """
+        Forgets the state of the current context, e.g. after foreign code (a Qt painter) changed it.
+        """
+        self.state.__init__()
+
+    def reset_counters(self):
+        """
+        Resets the issued, skipped and mismatch counters.
+        """
+        self.calls_issued = 0
+        self.calls_skipped = 0
+        self.mismatches = 0
+
+    def _changed(self, cached, value) -> bool:
+        """
+        Counts a call as issued when the value differs from the cached one and as skipped otherwise.
+        """
+        if cached == value:
+            self.calls_skipped += 1
+            return False
+        self.calls_issued += 1
+        return True
+
+    def _check(self, name: str, cached, actual) -> bool:
+        """
+        Logs a difference between the cached and the actual state.
+
+        Returns:
+        bool: Whether they match.
+        """
+        if cached is None or cached == actual:
+            return True
+        self.mismatches += 1
+        logger.error(f"GL state cache out of sync: {name} is {actual}, cached {cached}")
+        return False
+
+    def use_program(self, program: int):
+        """
+        glUseProgram, skipped when the program is already in use.
+
+        Args:
+        program (int): The program, 0 for none.
+        """
+        program = int(program)
+        if self.validate and not self._check("program", self.state.program, glGetIntegerv(GL_CURRENT_PROGRAM)):
+            self.state.program = None
+        if self._changed(self.state.program, program):
+            glUseProgram(program)
+            self.state.program = program
+
+    def bind_vertex_array(self, vertex_array: int):
+        """
+        glBindVertexArray, skipped when the VAO is already bound.
+
+        Args:
+        vertex_array (int): The VAO, 0 for none.
+        """
+        vertex_array = int(vertex_array)
+        if self.validate and not self._check("vertex array", self.state.vertex_array,
+                                             glGetIntegerv(GL_VERTEX_ARRAY_BINDING)):
+            self.state.vertex_array = None
+        if self._changed(self.state.vertex_array, vertex_array):
+            glBindVertexArray(vertex_array)
+            self.state.vertex_array = vertex_array
+
+    def active_texture(self, unit: int):
+        """
+        glActiveTexture, skipped when the unit is already active.
+
+        Args:
+        unit (int): The texture unit index, 0 for GL_TEXTURE0.
+        """
+        if self.validate and not self._check("active texture unit", self.state.active_texture,
+                                             glGetIntegerv(GL_ACTIVE_TEXTURE) - GL_TEXTURE0):
+            self.state.active_texture = None
+        if self._changed(self.state.active_texture, unit):
+            glActiveTexture(GL_TEXTURE0 + unit)
+            self.state.active_texture = unit
+
+    def bind_texture(self, target: int, texture: int, unit: int = 0):
+        """
+        glBindTexture on a texture unit, skipped when the texture is already bound there.
+
+        Args:
+        target (int): The texture target, e.g. GL_TEXTURE_2D.
+        texture (int): The texture, 0 for none.
+        unit (int): The texture unit index, made active if needed.
+        """
+        self.active_texture(unit)
+        key = (unit, int(target))
+        texture = int(texture)
+        if self.validate and target in TEXTURE_BINDING_QUERIES and not self._check(
+                f"texture unit {unit} target {target}", self.state.textures.get(key),
+                glGetIntegerv(TEXTURE_BINDING_QUERIES[target])):
+            self.state.textures.pop(key)
+        if self._changed(self.state.textures.get(key), texture):
+            glBindTexture(target, texture)
+            self.state.textures[key] = texture
+
+    def polygon_mode(self, mode: int):
+        """
+        glPolygonMode for front and back faces, skipped when the mode is already set.
+
+        Args:
+        mode (int): GL_FILL, GL_LINE or GL_POINT.
+        """
+        mode = int(mode)
+        if self.validate and not self._check("polygon mode", self.state.polygon_mode,
+                                             int(np.ravel(glGetIntegerv(GL_POLYGON_MODE))[0])):
+            self.state.polygon_mode = None
+        if self._changed(self.state.polygon_mode, mode):
+            glPolygonMode(GL_FRONT_AND_BACK, mode)
+            self.state.polygon_mode = mode
+
+    def clear_color(self, red: float, green: float, blue: float, alpha: float):
+        """
+        glClearColor, skipped when the color is already set.
+        """
+        color = (float(red), float(green), float(blue), float(alpha))
+        if self.validate and self.state.clear_color is not None:
+            # The driver stores the color as float32, compare at that precision
+            actual = np.asarray(glGetFloatv(GL_COLOR_CLEAR_VALUE), dtype=np.float32).reshape(-1)
+            if not np.array_equal(actual, np.float32(self.state.clear_color)):
+                self._check("clear color", self.state.clear_color, tuple(actual.tolist()))
+                self.state.clear_color = None
+        if self._changed(self.state.clear_color, color):
+            glClearColor(*color)
+            self.state.clear_color = color
+
+    def blend_func(self, source: int, destination: int):
+        """
+        glBlendFunc, skipped when the factors are already set.
+
+        Args:
+        source (int): Source factor, e.g. GL_SRC_ALPHA.
+        destination (int): Destination factor, e.g. GL_ONE_MINUS_SRC_ALPHA.
+        """
+        factors = (int(source), int(destination))
+        if self.validate and not self._check("blend func", self.state.blend_func,
+                                             (glGetIntegerv(GL_BLEND_SRC_RGB), glGetIntegerv(GL_BLEND_DST_RGB))):
+            self.state.blend_func = None
+        if self._changed(self.state.blend_func, factors):
+            glBlendFunc(*factors)
+            self.state.blend_func = factors
+
+    def set_enabled(self, capability: int, enabled: bool = True):
+        """
+        glEnable or glDisable, skipped when the capability already is in that state.
+
+        Args:
+        capability (int): The capability, e.g. GL_BLEND.
+        enabled (bool): Enable or disable it.
+        """
+        capability = int(capability)
+        if self.validate and not self._check(f"capability {capability}", self.state.capabilities.get(capability),
+                                             bool(glIsEnabled(capability))):
+            self.state.capabilities.pop(capability)
+        if self._changed(self.state.capabilities.get(capability), enabled):
+            (glEnable if enabled else glDisable)(capability)
+            self.state.capabilities[capability] = enabled
+
+    def delete_textures(self, textures: Iterable[int]):
+        """
+        glDeleteTextures, also forgetting the bindings the deleted textures are removed from.
+
+        Args:
+        textures (Iterable[int]): The textures.
+        """
+        textures = [int(texture) for texture in textures]
+        glDeleteTextures(len(textures), textures)
+        deleted = set(textures)
+        for key, texture in self.state.textures.items():
+            if texture in deleted:
+                self.state.textures[key] = 0
+
+    def delete_vertex_arrays(self, vertex_arrays: Iterable[int]):
+        """
+        glDeleteVertexArrays, resetting the cached binding if the bound VAO is deleted.
+
+        Args:
+        vertex_arrays (Iterable[int]): The VAOs.
+        """
+        vertex_arrays = [int(vertex_array) for vertex_array in vertex_arrays]
+        glDeleteVertexArrays(len(vertex_arrays), vertex_arrays)
+        if self.state.vertex_array in vertex_arrays:
+            self.state.vertex_array = 0
+
+
+gl_state = GLStateCache()
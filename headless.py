@@ -0,0 +1,335 @@
+"""
+Renders a lesson without a display: the lesson's GLWidget runs its initializeGL/paintGL into a framebuffer object,
+and every frame is read back and saved.
+
+    python headless.py Lessons/L3_Textures/L3Textures.py --frames 60 --output out/frame_{frame:04d}.png
+
+Two backends create the OpenGL context:
+
+- qt: the QOpenGLWidget itself on Qt's "offscreen" platform. That platform creates its contexts through GLX, so it
+  needs an X server ($DISPLAY, e.g. Xvfb). The default when $DISPLAY is set.
+- egl: a core profile context on Mesa's surfaceless EGL platform (EGL_MESA_platform_surfaceless), created through
+  PyOpenGL, which needs no window system, /dev/dri or /dev/fb0 at all. The widget is never shown, its context(),
+  makeCurrent() and doneCurrent() are redirected to that context and framebuffer object. The default without
+  $DISPLAY. Qt itself cannot render there: eglfs aborts without a framebuffer device and offscreen has no EGL
+  support. Verified with Mesa 22.3.6 llvmpipe on a node without any GPU or display.
+
+`--software` forces the llvmpipe rasterizer on CPU-only servers. Every run is a separate process with its own
+context, so jobs can run in parallel.
+"""
+import argparse
+import ctypes
+import importlib.util
+import os
+import sys
+import time
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+from PySide6.QtCore import QObject, Qt, Signal
+from PySide6.QtGui import QImage
+from PySide6.QtOpenGLWidgets import QOpenGLWidget
+from PySide6.QtWidgets import QApplication
+from loguru import logger
+
+import util
+
+# OpenGL is imported lazily: PyOpenGL picks its platform (GLX or EGL) from PYOPENGL_PLATFORM on first import
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+BACKENDS = ("qt", "egl")
+EGL_PLATFORM_SURFACELESS_MESA = 0x31DD
+
+
+def default_backend() -> str:
+    """
+    Returns the backend that works here: qt (GLX through Qt's offscreen platform) when an X server is available,
+    egl (surfaceless) otherwise.
+    """
+    return "qt" if os.environ.get("DISPLAY") else "egl"
+
+
+def configure_environment(backend: str = "qt", platform: str = "offscreen", software: bool = False):
+    """
+    Selects the Qt platform plugin, PyOpenGL's platform and the Mesa driver. Has to run before the QApplication is
+    created and before anything imports OpenGL, both read these variables once.
+
+    Args:
+    backend (str): qt or egl, see the module docstring.
+    platform (str): Qt platform plugin. With the egl backend Qt only provides the widgets, not the context.
+    software (bool): Force Mesa's llvmpipe software rasterizer.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+    os.environ["QT_QPA_PLATFORM"] = platform
+    if backend == "egl":
+        if "OpenGL" in sys.modules and os.environ.get("PYOPENGL_PLATFORM") != "egl":
+            raise RuntimeError("The egl backend has to be configured before OpenGL is imported")
+        os.environ["PYOPENGL_PLATFORM"] = "egl"
+        os.environ["EGL_PLATFORM"] = "surfaceless"
+    if software:
+        os.environ["LIBGL_ALWAYS_SOFTWARE"] = "1"
+        os.environ["GALLIUM_DRIVER"] = "llvmpipe"
+
+
+class SurfacelessContext:
+    """
+    An OpenGL core profile context on Mesa's surfaceless EGL platform, rendering into a framebuffer object with an
+    RGBA8 color and a depth/stencil renderbuffer. Requires PYOPENGL_PLATFORM=egl (configure_environment).
+    """
+
+    def __init__(self, width: int, height: int, version: Tuple[int, int] = (3, 3)):
+        """
+        Args:
+        width (int): Framebuffer width in pixels.
+        height (int): Framebuffer height in pixels.
+        version (Tuple[int, int]): Requested OpenGL version.
+        """
+        from OpenGL import EGL
+        from OpenGL.EGL.EXT.platform_base import eglGetPlatformDisplayEXT
+
+        self.width = width
+        self.height = height
+        self.framebuffer = None
+        self.display = eglGetPlatformDisplayEXT(EGL_PLATFORM_SURFACELESS_MESA, EGL.EGL_DEFAULT_DISPLAY, None)
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not self.display or not EGL.eglInitialize(self.display, ctypes.pointer(major), ctypes.pointer(minor)):
+            raise RuntimeError("Could not initialize the surfaceless EGL display (EGL_MESA_platform_surfaceless)")
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        config_attributes = (EGL.EGLint * 5)(EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                                              EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT, EGL.EGL_NONE)
+        config, count = EGL.EGLConfig(), EGL.EGLint()
+        if not EGL.eglChooseConfig(self.display, config_attributes, ctypes.pointer(config), 1, ctypes.pointer(count)) \
+                or not count.value:
+            raise RuntimeError("No EGL config supports desktop OpenGL")
+        context_attributes = (EGL.EGLint * 7)(EGL.EGL_CONTEXT_MAJOR_VERSION, version[0],
+                                               EGL.EGL_CONTEXT_MINOR_VERSION, version[1],
+                                               EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK,
+                                               EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT, EGL.EGL_NONE)
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, context_attributes)
+        if not self.context:
+            raise RuntimeError(f"Could not create an OpenGL {version[0]}.{version[1]} core context")
+        self.make_current()
+
+        from OpenGL.GL import (GL_COLOR_ATTACHMENT0, GL_DEPTH24_STENCIL8, GL_DEPTH_STENCIL_ATTACHMENT, GL_FRAMEBUFFER,
+                               GL_FRAMEBUFFER_COMPLETE, GL_RENDERBUFFER, GL_RGBA8, glBindRenderbuffer,
+                               glCheckFramebufferStatus, glFramebufferRenderbuffer, glGenFramebuffers,
+                               glGenRenderbuffers, glRenderbufferStorage)
+        self.framebuffer = int(glGenFramebuffers(1))
+        self.renderbuffers = [int(renderbuffer) for renderbuffer in np.ravel(glGenRenderbuffers(2))]
+        # Binds the framebuffer object
+        self.make_current()
+        attachments = ((GL_RGBA8, GL_COLOR_ATTACHMENT0), (GL_DEPTH24_STENCIL8, GL_DEPTH_STENCIL_ATTACHMENT))
+        for renderbuffer, (internal_format, attachment) in zip(self.renderbuffers, attachments):
+            glBindRenderbuffer(GL_RENDERBUFFER, renderbuffer)
+            glRenderbufferStorage(GL_RENDERBUFFER, internal_format, width, height)
+            glFramebufferRenderbuffer(GL_FRAMEBUFFER, attachment, GL_RENDERBUFFER, renderbuffer)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError("The framebuffer object is incomplete")
+
+    def make_current(self):
+        """
+        Makes the context current without any surface and binds the framebuffer object once it exists.
+        """
+        from OpenGL import EGL
+        from OpenGL.GL import GL_FRAMEBUFFER, glBindFramebuffer
+
+        if not EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, self.context):
+            raise RuntimeError("Could not make the surfaceless EGL context current")
+        if self.framebuffer is not None:
+            glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+
+    def done_current(self):
+        from OpenGL import EGL
+
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+
+    def read(self) -> QImage:
+        """
+        Waits for the rendering and returns the framebuffer object's color buffer. The context has to be current.
+        """
+        from OpenGL.GL import GL_PACK_ALIGNMENT, GL_RGBA, GL_UNSIGNED_BYTE, glPixelStorei, glReadPixels
+
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        pixels = glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE)
+        return util.numpy_to_q_image(np.frombuffer(pixels, dtype=np.uint8).reshape(self.height, self.width, 4))
+
+    def delete(self):
+        """
+        Deletes the framebuffer object and destroys the context.
+        """
+        from OpenGL import EGL
+        from OpenGL.GL import glDeleteFramebuffers, glDeleteRenderbuffers
+
+        self.make_current()
+        glDeleteFramebuffers(1, [self.framebuffer])
+        glDeleteRenderbuffers(len(self.renderbuffers), self.renderbuffers)
+        self.done_current()
+        EGL.eglDestroyContext(self.display, self.context)
+        EGL.eglTerminate(self.display)
+
+
+class _ContextHandle(QObject):
+    """
+    Stands in for the QOpenGLContext a QOpenGLWidget.context() returns: a hashable key for gl_state and the
+    aboutToBeDestroyed signal the lessons free their GL objects on.
+    """
+
+    aboutToBeDestroyed = Signal()
+
+
+class SurfacelessWidgetHost:
+    """
+    Drives a QOpenGLWidget on a SurfacelessContext instead of its own context: the widget is never shown, its
+    context(), makeCurrent(), doneCurrent() and defaultFramebufferObject() are redirected to the EGL context and its
+    framebuffer object, and grab() runs initializeGL/resizeGL once and then paintGL, like grabFramebuffer().
+    """
+
+    def __init__(self, widget: QOpenGLWidget):
+        """
+        Args:
+        widget (QOpenGLWidget): The widget, already sized.
+        """
+        self.widget = widget
+        self.gl = SurfacelessContext(widget.width(), widget.height())
+        self.handle = _ContextHandle()
+        self.initialized = False
+        # Instance attributes shadow the QOpenGLWidget methods for the lesson's Python code
+        widget.context = lambda: self.handle
+        widget.makeCurrent = self.gl.make_current
+        widget.doneCurrent = self.gl.done_current
+        widget.defaultFramebufferObject = lambda: self.gl.framebuffer
+
+    def grab(self) -> QImage:
+        """
+        Renders a frame and returns it.
+        """
+        self.gl.make_current()
+        if not self.initialized:
+            self.widget.initializeGL()
+            self.widget.resizeGL(self.gl.width, self.gl.height)
+            self.initialized = True
+        self.widget.paintGL()
+        return self.gl.read()
+
+    def close(self):
+        """
+        Lets the widget free its GL objects, as on context destruction, then destroys the context.
+        """
+        if self.initialized:
+            self.handle.aboutToBeDestroyed.emit()
+        self.gl.delete()
+
+
+def load_widget_class(lesson_path: str):
+    """
+    Imports a lesson module by path and returns its GLWidget class.
+
+    Args:
+    lesson_path (str): Path of the lesson's .py file.
+    """
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    name = os.path.splitext(os.path.basename(lesson_path))[0]
+    spec = importlib.util.spec_from_file_location(name, lesson_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.GLWidget
+
+
+def render_frames(widget: QOpenGLWidget, frames: int, on_frame: Callable[[int, QImage], None],
+                  texture_timeout: float = 30.0, grab: Optional[Callable[[], QImage]] = None):
+    """
+    Renders frames of a widget that is not shown on screen. Each frame runs paintGL once.
+
+    Args:
+    widget (QOpenGLWidget): The widget, already sized.
+    frames (int): Number of frames.
+    on_frame (Callable[[int, QImage], None]): Receives the frame number and the rendered image.
+    texture_timeout (float): Seconds to wait for the textures requested from texture_cache before frame 0.
+    grab (Optional[Callable[[], QImage]]): Renders and returns a frame, e.g. SurfacelessWidgetHost.grab. Defaults
+    to the widget's own grabFramebuffer() on its Qt context.
+    """
+    from texture_util import texture_cache
+
+    # Frames are driven by the loop below, not by the lesson's repaint timer
+    timer = getattr(widget, "repaint_timer", None)
+    if timer is not None:
+        timer.stop()
+    if grab is None:
+        # Creates the native window and the context without mapping anything
+        widget.setAttribute(Qt.WidgetAttribute.WA_DontShowOnScreen)
+        widget.show()
+        # grabFramebuffer runs paintGL into the widget's FBO and reads it back
+        grab = widget.grabFramebuffer
+    QApplication.processEvents()
+
+    def render() -> QImage:
+        image = grab()
+        if image.isNull():
+            raise RuntimeError("Rendering failed, no OpenGL context could be created on this platform")
+        return image
+
+    # Textures are decoded on worker threads and uploaded by paintGL over several frames (texture_cache.update), so
+    # render unsaved frames until they are resident. Otherwise the first frames would show the placeholder. The
+    # first one runs initializeGL, which requests them.
+    render()
+    deadline = time.monotonic() + texture_timeout
+    while texture_cache.streamer is not None and texture_cache.streamer.busy:
+        if time.monotonic() > deadline:
+            logger.warning(f"Textures still loading after {texture_timeout} s, rendering anyway")
+            break
+        render()
+        QApplication.processEvents()
+
+    for frame in range(frames):
+        on_frame(frame, render())
+        QApplication.processEvents()
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Render a lesson offscreen and save its frames.")
+    parser.add_argument("lesson", help="Path of the lesson module, which defines GLWidget")
+    parser.add_argument("--frames", type=int, default=1, help="Number of frames to render")
+    parser.add_argument("--size", default="800x600", help="Framebuffer size as WIDTHxHEIGHT")
+    parser.add_argument("--output", default="frame_{frame:04d}.png",
+                        help="Output path pattern, formatted with the frame number")
+    parser.add_argument("--backend", choices=BACKENDS, help="Context creation, defaults to qt with $DISPLAY and "
+                                                                 "egl (surfaceless) without")
+    parser.add_argument("--platform", default="offscreen", help="Qt platform plugin")
+    parser.add_argument("--software", action="store_true", help="Force the Mesa llvmpipe software rasterizer")
+    args = parser.parse_args(argv)
+
+    width, height = (int(value) for value in args.size.lower().split("x"))
+    lesson_path = os.path.abspath(args.lesson)
+    output = os.path.abspath(args.output)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+
+    backend = args.backend or default_backend()
+    configure_environment(backend, args.platform, args.software)
+    app = QApplication([sys.argv[0]])
+    # Lessons load their files relative to the working directory, like when run from their folder
+    os.chdir(os.path.dirname(lesson_path))
+    widget = load_widget_class(lesson_path)()
+    widget.resize(width, height)
+    host = SurfacelessWidgetHost(widget) if backend == "egl" else None
+
+    def save(frame: int, image: QImage):
+        path = output.format(frame=frame)
+        if not image.save(path):
+            raise OSError(f"Could not write '{path}'")
+
+    try:
+        render_frames(widget, args.frames, save, grab=host.grab if host is not None else None)
+    finally:
+        if host is not None:
+            host.close()
+    logger.info(f"Rendered {args.frames} frames of '{args.lesson}' to '{args.output}' ({backend} backend)")
+    widget.close()
+    app.quit()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+import ctypes
+from typing import List, Optional
+
+import numpy as np
+from OpenGL.GL import *
+
+from buffer_util import BufferArena
+from gl_state import gl_state
+from instanced_renderer import INSTANCE_DTYPE
+from vertex_layout import VertexLayout
+
+# The layout glMultiDrawElementsIndirect reads from GL_DRAW_INDIRECT_BUFFER
+DRAW_ELEMENTS_INDIRECT_COMMAND = np.dtype([("count", np.uint32), ("instance_count", np.uint32),
+                                           ("first_index", np.uint32), ("base_vertex", np.int32),
+                                           ("base_instance", np.uint32)])
+
+
+class MeshRange:
+    """Where a mesh lives in a MeshArena. Updated in place when the arena is compacted."""
+
+    __slots__ = ("first_index", "index_count", "base_vertex", "vertex_count")
+
+    def __init__(self, first_index: int, index_count: int, base_vertex: int, vertex_count: int):
+        self.first_index = first_index
+        self.index_count = index_count
+        self.base_vertex = base_vertex
+        self.vertex_count = vertex_count
+
+    def __repr__(self) -> str:
+        return (f"MeshRange(first_index={self.first_index}, index_count={self.index_count}, "
+                f"base_vertex={self.base_vertex}, vertex_count={self.vertex_count})")
+
+
+class MeshArena:
+    """
+    Many meshes of the same vertex layout carved out of one vertex and one uint32 index BufferArena, so they can all
+    be drawn through a single VAO. Indices stay relative to their mesh and are offset with a base vertex.
+
+    Meshes can be freed, and compact() removes the holes they leave. Growing and compacting replace the buffer
+    objects, which bumps `generation` so users can rebuild their VAOs and draw commands.
+    """
+
+    def __init__(self, vertex_layout: VertexLayout, vertex_capacity: int = 1 << 16, index_capacity: int = 1 << 18):
+        """
+        Args:
+        vertex_layout (VertexLayout): Layout of every vertex in the arena.
+        vertex_capacity (int): Initial number of vertices.
+        index_capacity (int): Initial number of indices.
+        """
+        self.vertex_layout = vertex_layout
+        # Allocating whole vertices keeps every vertex offset a valid base vertex
+        self.vertices = BufferArena(vertex_capacity * vertex_layout.stride, vertex_layout.stride)
+        self.indices = BufferArena(index_capacity * 4, 4)
+        self.meshes: List[MeshRange] = []
+
+    @property
+    def vertex_buffer(self) -> int:
+        return self.vertices.buffer
+
+    @property
+    def index_buffer(self) -> int:
+        return self.indices.buffer
+
+    @property
+    def generation(self) -> int:
+        return self.vertices.generation + self.indices.generation
+
+    def add(self, vertices: np.ndarray, indices: np.ndarray) -> MeshRange:
+        """
+        Uploads a mesh into free space of the arena.
+
+        Args:
+        vertices (np.ndarray): Vertex data of the arena's layout.
+        indices (np.ndarray): Element indices, relative to the first vertex of the mesh.
+
+        Returns:
+        MeshRange: The range to draw the mesh with.
+        """
+        vertices = np.ascontiguousarray(vertices)
+        indices = np.ascontiguousarray(indices, dtype=np.uint32)
+        stride = self.vertex_layout.stride
+        if vertices.nbytes % stride:
+            raise ValueError(f"Vertex data of {vertices.nbytes} bytes is not a multiple of the {stride} byte stride")
+
+        vertex_offset = self.vertices.allocate(vertices.nbytes)
+        index_offset = self.indices.allocate(indices.nbytes)
+        self.vertices.write(vertex_offset, vertices)
+        self.indices.write(index_offset, indices)
+
+        mesh = MeshRange(index_offset // 4, len(indices), vertex_offset // stride, vertices.nbytes // stride)
+        self.meshes.append(mesh)
+        return mesh
+
+    def free(self, mesh: MeshRange):
+        """
+        Releases the space of a mesh. Draws must no longer use it.
+
+        Args:
+        mesh (MeshRange): A mesh returned by add().
+        """
+        self.meshes.remove(mesh)
+        self.vertices.free(mesh.base_vertex * self.vertex_layout.stride)
+        self.indices.free(mesh.first_index * 4)
+
+    def compact(self):
+        """
+        Moves the meshes together in both buffers and updates their ranges.
+        """
+        stride = self.vertex_layout.stride
+        vertex_moves = self.vertices.compact()
+        index_moves = self.indices.compact()
+        for mesh in self.meshes:
+            mesh.base_vertex = vertex_moves.get(mesh.base_vertex * stride, mesh.base_vertex * stride) // stride
+            mesh.first_index = index_moves.get(mesh.first_index * 4, mesh.first_index * 4) // 4
+
+    @property
+    def fragmentation(self) -> float:
+        """
+        The larger fragmentation of the two buffers, see BufferArena.fragmentation.
+        """
+        return max(self.vertices.fragmentation, self.indices.fragmentation)
+
+    def delete(self):
+        """
+        Deletes the buffers.
+        """
+        self.vertices.delete()
+        self.indices.delete()
+
+
+class IndirectRenderer:
+    """
+    Draws every object of a scene whose meshes share a MeshArena with one glMultiDrawElementsIndirect call
+    (GL 4.3 or ARB_multi_draw_indirect).
+
+    Each add() appends one DrawElementsIndirectCommand to a numpy structured array and the per instance attributes
+    of its instances to `instances`. A command's base instance points at its first instance record, so per object
+    transforms reach the shader as instance attributes (divisor 1) without any uniform calls. The command buffer is
+    only rebuilt when objects are added or removed or the arena compacts: a static scene uploads it once and every
+    frame costs the same few GL calls regardless of the object count.
+
+    Requires GL 3.3. Without multi draw indirect (GL 4.3 or ARB_multi_draw_indirect), draw() issues one
+    glDrawElementsInstancedBaseVertexBaseInstance call per command (GL 4.2 or ARB_base_instance). Without base
+    instance support either, each command re-points the instance attributes at its first record and draws with
+    glDrawElementsInstancedBaseVertex.
+    """
+
+    def __init__(self, arena: MeshArena, instance_dtype: np.dtype = INSTANCE_DTYPE,
+                 first_instance_location: Optional[int] = None):
+        """
+        Args:
+        arena (MeshArena): Arena holding the meshes of the scene.
+        instance_dtype (np.dtype): Structured dtype of the per instance attributes.
+        first_instance_location (Optional[int]): Location of the first instance attribute, defaults to the one after
+        the last vertex attribute.
+        """
+        self.arena = arena
+        if first_instance_location is None:
+            first_instance_location = max(attribute.location for attribute in arena.vertex_layout.attributes) + 1
+        self.instance_layout = VertexLayout(instance_dtype,
+                                            locations={instance_dtype.names[0]: first_instance_location})
+        self.commands = np.zeros(0, dtype=DRAW_ELEMENTS_INDIRECT_COMMAND)
+        # Mesh of each command, to refresh the commands after the arena compacted
+        self.meshes: List[MeshRange] = []
+        self.instances = np.zeros(0, dtype=instance_dtype)
+        self.commands_dirty = False
+        self.instances_dirty = False
+        self.command_uploads = 0
+
+        self.command_buffer = glGenBuffers(1)
+        self.instance_buffer = glGenBuffers(1)
+        self.instance_capacity = 0
+        self.vao = None
+        self.vao_generation = None
+
+    @staticmethod
+    def supported() -> bool:
+        """
+        Returns whether the current context provides glMultiDrawElementsIndirect.
+        """
+        return bool(glMultiDrawElementsIndirect)
+
+    def add(self, mesh: MeshRange, count: int = 1) -> int:
+        """
+        Adds an object drawing a mesh count times, initialized to an identity transform, white tint and layer 0.
+
+        Args:
+        mesh (MeshRange): A mesh of the arena.
+        count (int): Number of instances of the mesh.
+
+        Returns:
+        int: Index of the object's command. Its instances are
+        `instances[commands["base_instance"][index]:][:count]`, see instances_of().
+        """
+        command = np.zeros(1, dtype=DRAW_ELEMENTS_INDIRECT_COMMAND)
+        command["count"] = mesh.index_count
+        command["instance_count"] = count
+        command["first_index"] = mesh.first_index
+        command["base_vertex"] = mesh.base_vertex
+        command["base_instance"] = len(self.instances)
+        self.commands = np.concatenate([self.commands, command])
+        self.meshes.append(mesh)
+
+        new = np.zeros(count, dtype=self.instances.dtype)
+        if "transform" in new.dtype.names:
+            new["transform"] = np.eye(4, dtype=np.float32)
+        if "tint" in new.dtype.names:
+            new["tint"] = 1.0
+        self.instances = np.concatenate([self.instances, new])
+        self.commands_dirty = self.instances_dirty = True
+        return len(self.commands) - 1
+
+    def instances_of(self, index: int) -> np.ndarray:
+        """
+        Returns a view of the instance records of an object. Call mark_dirty() after writing to it.
+
+        Args:
+        index (int): The object's command index.
+        """
+        start = int(self.commands["base_instance"][index])
+        return self.instances[start:start + int(self.commands["instance_count"][index])]
+
+    def remove(self, index: int):
+        """
+        Removes an object. Its instance records stay in place until clear(), only the command goes away.
+
+        Args:
+        index (int): The object's command index, indices of later objects shift down by one.
+        """
+        self.commands = np.delete(self.commands, index)
+        del self.meshes[index]
+        self.commands_dirty = True
+
+    def clear(self):
+        """
+        Removes every object.
+        """
+        self.commands = np.zeros(0, dtype=DRAW_ELEMENTS_INDIRECT_COMMAND)
+        self.meshes = []
+        self.instances = np.zeros(0, dtype=self.instances.dtype)
+        self.commands_dirty = self.instances_dirty = True
+
+    def mark_dirty(self):
+        """
+        Marks the instance records for upload after writing to `instances`.
+        """
+        self.instances_dirty = True
+
+    def _build_vao(self):
+        if self.vao is not None:
+            gl_state.delete_vertex_arrays([self.vao])
+        self.vao = glGenVertexArrays(1)
+        gl_state.bind_vertex_array(self.vao)
+        self.arena.vertex_layout.bind_attributes(self.arena.vertex_buffer)
+        self.instance_layout.bind_attributes(self.instance_buffer, divisor=1)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.arena.index_buffer)
+        gl_state.bind_vertex_array(0)
+        self.vao_generation = self.arena.generation
+
+    def flush(self):
+        """
+        Uploads the command buffer if objects were added or removed and the instance records if they changed.
+        """
+        if self.vao_generation != self.arena.generation:
+            # The arena grew or compacted, so the buffers and possibly the mesh ranges changed
+            self.commands["first_index"] = [mesh.first_index for mesh in self.meshes]
+            self.commands["base_vertex"] = [mesh.base_vertex for mesh in self.meshes]
+            self.commands_dirty = True
+            self._build_vao()
+        if self.instances_dirty:
+            glBindBuffer(GL_ARRAY_BUFFER, self.instance_buffer)
+            if len(self.instances) > self.instance_capacity:
+                self.instance_capacity = max(len(self.instances), self.instance_capacity * 2)
+                glBufferData(GL_ARRAY_BUFFER, self.instance_capacity * self.instances.dtype.itemsize, None,
+                             GL_DYNAMIC_DRAW)
+            if len(self.instances):
+                glBufferSubData(GL_ARRAY_BUFFER, 0, self.instances.nbytes, self.instances)
+            self.instances_dirty = False
+        if self.commands_dirty:
+            glBindBuffer(GL_DRAW_INDIRECT_BUFFER, self.command_buffer)
+            glBufferData(GL_DRAW_INDIRECT_BUFFER, self.commands.nbytes, self.commands if len(self.commands) else None,
+                         GL_STATIC_DRAW)
+            glBindBuffer(GL_DRAW_INDIRECT_BUFFER, 0)
+            self.commands_dirty = False
+            self.command_uploads += 1
+
+    def draw(self, mode: int = GL_TRIANGLES):
+        """
+        Uploads pending changes and draws every object with the bound program in one call.
+
+        Args:
+        mode (int): Primitive type.
+        """
+        if not len(self.commands):
+            return
+        self.flush()
+        gl_state.bind_vertex_array(self.vao)
+        if self.supported():
+            glBindBuffer(GL_DRAW_INDIRECT_BUFFER, self.command_buffer)
+            glMultiDrawElementsIndirect(mode, GL_UNSIGNED_INT, None, len(self.commands), 0)
+            glBindBuffer(GL_DRAW_INDIRECT_BUFFER, 0)
+            return
+        base_instance_supported = bool(glDrawElementsInstancedBaseVertexBaseInstance)
+        stride = self.instances.dtype.itemsize
+        for count, instance_count, first_index, base_vertex, base_instance in self.commands.tolist():
+            if base_instance_supported:
+                glDrawElementsInstancedBaseVertexBaseInstance(mode, count, GL_UNSIGNED_INT,
+                                                              ctypes.c_void_p(first_index * 4), instance_count,
+                                                              base_vertex, base_instance)
+                continue
+            # GL 3.3: instance attributes always start at instance 0, so offset their pointers instead
+            self.instance_layout.bind_attributes(self.instance_buffer, base_instance * stride, divisor=1)
+            glDrawElementsInstancedBaseVertex(mode, count, GL_UNSIGNED_INT, ctypes.c_void_p(first_index * 4),
+                                              instance_count, base_vertex)
+
+    def delete(self):
+        """
+        Deletes the VAO and the command and instance buffers. The arena is left alone.
+        """
+        if self.vao is not None:
+            gl_state.delete_vertex_arrays([self.vao])
+        glDeleteBuffers(2, [self.command_buffer, self.instance_buffer])
@@ -0,0 +1,171 @@
+from typing import Optional
+
+import numpy as np
+from OpenGL.GL import *
+
+from gl_state import gl_state
+from vertex_layout import VertexLayout
+
+# Per instance data: model matrix, tint and texture array layer. A mat4 attribute reads each row of the (4, 4) field
+# as one column, so the field holds the transposed model matrix.
+INSTANCE_DTYPE = np.dtype([("transform", np.float32, (4, 4)), ("tint", np.float32, 4), ("layer", np.float32)])
+
+# Dirty runs closer than this many instances are uploaded as one glBufferSubData call
+_MERGE_GAP = 64
+
+
+class InstancedRenderer:
+    """
+    Draws many instances of one mesh with a single glDrawElementsInstanced call.
+
+    Per instance attributes live in a numpy structured array (`instances`) mirrored to an instance VBO with an
+    attribute divisor of 1. Writes are tracked per instance, and draw() only uploads the dirty runs with
+    glBufferSubData. Instance attributes start at the location after the mesh attributes, in dtype field order
+    (with INSTANCE_DTYPE: transform at 4 locations, then tint, then layer).
+    """
+
+    def __init__(self, vertices: np.ndarray, indices: np.ndarray, vertex_layout: VertexLayout, capacity: int = 1024,
+                 instance_dtype: np.dtype = INSTANCE_DTYPE, first_instance_location: Optional[int] = None):
+        """
+        Args:
+        vertices (np.ndarray): Vertices of the mesh drawn for every instance.
+        indices (np.ndarray): uint16 or uint32 element indices of the mesh.
+        vertex_layout (VertexLayout): Layout of the mesh vertices.
+        capacity (int): Initial number of instances, the buffers grow as needed.
+        instance_dtype (np.dtype): Structured dtype of the per instance attributes.
+        first_instance_location (Optional[int]): Location of the first instance attribute, defaults to the one after
+        the last mesh attribute.
+        """
+        self.indices = np.ascontiguousarray(indices)
+        self.index_count = len(self.indices)
+        self.index_type = GL_UNSIGNED_SHORT if self.indices.dtype.itemsize == 2 else GL_UNSIGNED_INT
+        self.vao, self.vertex_buffer, self.index_buffer = vertex_layout.create_vao(vertices, self.indices)
+
+        if first_instance_location is None:
+            first_instance_location = max(attribute.location for attribute in vertex_layout.attributes) + 1
+        self.instance_layout = VertexLayout(instance_dtype,
+                                            locations={instance_dtype.names[0]: first_instance_location})
+        self.instances = np.zeros(capacity, dtype=instance_dtype)
+        self.dirty = np.zeros(capacity, dtype=bool)
+        self.count = 0
+        self.uploads = 0
+
+        self.instance_buffer = glGenBuffers(1)
+        self._allocate_instance_buffer()
+
+    def _allocate_instance_buffer(self):
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_buffer)
+        glBufferData(GL_ARRAY_BUFFER, self.instances.nbytes, None, GL_DYNAMIC_DRAW)
+        gl_state.bind_vertex_array(self.vao)
+        self.instance_layout.bind_attributes(self.instance_buffer, divisor=1)
+        gl_state.bind_vertex_array(0)
+        self.dirty[:self.count] = True
+
+    @property
+    def capacity(self) -> int:
+        return len(self.instances)
+
+    def reserve(self, capacity: int):
+        """
+        Grows the instance array and buffer to hold at least capacity instances.
+
+        Args:
+        capacity (int): Number of instances needed.
+        """
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, self.capacity * 2)
+        instances = np.zeros(capacity, dtype=self.instances.dtype)
+        instances[:self.count] = self.instances[:self.count]
+        self.instances = instances
+        self.dirty = np.zeros(capacity, dtype=bool)
+        self._allocate_instance_buffer()
+
+    def add(self, count: int = 1) -> np.ndarray:
+        """
+        Appends instances, initialized to an identity transform, white tint and layer 0.
+
+        Args:
+        count (int): Number of instances to add.
+
+        Returns:
+        np.ndarray: View of the new instances, already marked dirty. Fill it in before the next draw().
+        """
+        self.reserve(self.count + count)
+        start, self.count = self.count, self.count + count
+        new = self.instances[start:self.count]
+        if "transform" in new.dtype.names:
+            new["transform"] = np.eye(4, dtype=np.float32)
+        if "tint" in new.dtype.names:
+            new["tint"] = 1.0
+        self.dirty[start:self.count] = True
+        return new
+
+    def remove(self, index: int):
+        """
+        Removes an instance by moving the last instance into its slot, so indices of other instances but the last
+        stay valid.
+
+        Args:
+        index (int): The instance to remove.
+        """
+        self.count -= 1
+        if index != self.count:
+            self.instances[index] = self.instances[self.count]
+            self.dirty[index] = True
+        self.dirty[self.count] = False
+
+    def clear(self):
+        """
+        Removes every instance.
+        """
+        self.count = 0
+        self.dirty[:] = False
+
+    def mark_dirty(self, start: int = 0, stop: Optional[int] = None):
+        """
+        Marks instances for upload after writing to `instances` directly.
+
+        Args:
+        start (int): First changed instance.
+        stop (Optional[int]): One past the last changed instance, defaults to the instance count.
+        """
+        self.dirty[start:self.count if stop is None else stop] = True
+
+    def flush(self):
+        """
+        Uploads the dirty runs of instances with glBufferSubData.
+        """
+        dirty = np.flatnonzero(self.dirty[:self.count])
+        if not len(dirty):
+            return
+        # Split into runs wherever the gap to the next dirty instance is too large to be worth uploading
+        breaks = np.flatnonzero(np.diff(dirty) > _MERGE_GAP)
+        starts = np.concatenate([dirty[:1], dirty[breaks + 1]])
+        stops = np.concatenate([dirty[breaks], dirty[-1:]]) + 1
+
+        itemsize = self.instances.dtype.itemsize
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_buffer)
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            glBufferSubData(GL_ARRAY_BUFFER, start * itemsize, (stop - start) * itemsize,
+                            self.instances[start:stop])
+            self.uploads += 1
+        self.dirty[:self.count] = False
+
+    def draw(self):
+        """
+        Uploads pending changes and draws every instance with the bound program. One draw call regardless of the
+        instance count.
+        """
+        if self.count == 0:
+            return
+        self.flush()
+        gl_state.bind_vertex_array(self.vao)
+        glDrawElementsInstanced(GL_TRIANGLES, self.index_count, self.index_type, None, self.count)
+
+    def delete(self):
+        """
+        Deletes the VAO and buffers.
+        """
+        gl_state.delete_vertex_arrays([self.vao])
+        glDeleteBuffers(3, [self.vertex_buffer, self.index_buffer, self.instance_buffer])
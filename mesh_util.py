@@ -0,0 +1,147 @@
+import json
+import os
+import struct
+from typing import NamedTuple, Tuple
+
+import numpy as np
+from OpenGL.GL import *
+
+from vertex_layout import VertexLayout
+
+MESH_SUFFIX = ".glmesh"
+# File header: magic, version, vertex count, index count, index size in bytes, layout descriptor size,
+# vertex blob offset, index blob offset
+HEADER = struct.Struct("<4sIQQIIQQ")
+MAGIC = b"GLMS"
+VERSION = 1
+# Blobs are aligned so they can be viewed straight from the memory map with their own dtype
+ALIGNMENT = 16
+
+INDEX_TYPES = {2: GL_UNSIGNED_SHORT, 4: GL_UNSIGNED_INT}
+
+
+class MeshData(NamedTuple):
+    """
+    Mesh geometry, usually views into a memory mapped mesh file.
+
+    vertices is a structured array with one field per vertex attribute (interleaved), indices a uint16 or uint32
+    array of triangle indices and layout describes how the vertex fields map to attributes.
+    """
+    vertices: np.ndarray
+    indices: np.ndarray
+    layout: VertexLayout
+
+    @property
+    def index_type(self) -> int:
+        return INDEX_TYPES[self.indices.dtype.itemsize]
+
+
+def _align(offset: int) -> int:
+    return offset + -offset % ALIGNMENT
+
+
+def write_mesh(path: str, vertices: np.ndarray, indices: np.ndarray, layout: VertexLayout = None):
+    """
+    Writes a mesh file: header, layout descriptor (the vertex dtype and VertexLayout options as JSON), interleaved
+    vertex blob, index blob.
+
+    Args:
+    path (str): Destination file, conventionally ending in MESH_SUFFIX.
+    vertices (np.ndarray): Structured array with one field per vertex attribute.
+    indices (np.ndarray): Triangle indices, stored as uint16 when they fit and uint32 otherwise.
+    layout (VertexLayout): Layout of the vertices, by default every field is a plain attribute.
+    """
+    if vertices.dtype.names is None:
+        raise ValueError("vertices must be a structured array with one field per attribute")
+    index_dtype = np.uint16 if len(vertices) <= 0xFFFF else np.uint32
+    indices = np.ascontiguousarray(indices, dtype=index_dtype).reshape(-1)
+    vertices = np.ascontiguousarray(vertices)
+
+    if layout is None:
+        layout = VertexLayout(vertices.dtype)
+    elif layout.dtype != vertices.dtype:
+        raise ValueError(f"vertices have dtype {vertices.dtype}, the layout expects {layout.dtype}")
+    descriptor = json.dumps({
+        **_dtype_to_json(vertices.dtype),
+        "normalized": sorted(layout.normalized),
+        "packed": sorted(layout.packed),
+        "locations": layout.locations,
+    }).encode()
+    vertex_offset = _align(HEADER.size + len(descriptor))
+    index_offset = _align(vertex_offset + vertices.nbytes)
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as mesh_file:
+        mesh_file.write(HEADER.pack(MAGIC, VERSION, len(vertices), len(indices), indices.itemsize, len(descriptor),
+                                    vertex_offset, index_offset))
+        mesh_file.write(descriptor)
+        mesh_file.write(b"\0" * (vertex_offset - mesh_file.tell()))
+        mesh_file.write(vertices.tobytes())
+        mesh_file.write(b"\0" * (index_offset - mesh_file.tell()))
+        mesh_file.write(indices.tobytes())
+    os.replace(temp_path, path)
+
+
+def _dtype_to_json(dtype: np.dtype) -> dict:
+    """
+    Describes a structured dtype by its fields, offsets and itemsize. Unlike dtype.descr this keeps padding and
+    explicit offsets out of the field list.
+    """
+    formats = []
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        # Subarray fields, e.g. ("<f4", [3]) for a vec3
+        formats.append([field.base.str, list(field.shape)] if field.shape else field.str)
+    return {"names": list(dtype.names), "formats": formats,
+            "offsets": [dtype.fields[name][1] for name in dtype.names], "itemsize": dtype.itemsize}
+
+
+def _json_to_dtype(descriptor: dict) -> np.dtype:
+    if "names" not in descriptor:
+        # Files written before offsets were stored, JSON turns the tuples of dtype.descr into lists
+        return np.dtype([tuple(tuple(item) if isinstance(item, list) else item for item in field)
+                         for field in descriptor["descr"]])
+    formats = [(field[0], tuple(field[1])) if isinstance(field, list) else field for field in descriptor["formats"]]
+    return np.dtype({"names": descriptor["names"], "formats": formats, "offsets": descriptor["offsets"],
+                     "itemsize": descriptor["itemsize"]})
+
+
+def read_mesh(path: str) -> MeshData:
+    """
+    Memory maps a mesh file. Nothing but the header and layout is read until the arrays are accessed.
+
+    Args:
+    path (str): The mesh file.
+
+    Returns:
+    MeshData: Views of the vertex and index blobs in the memory map.
+    """
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    magic, version, vertex_count, index_count, index_size, layout_size, vertex_offset, index_offset = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"'{path}' is not a version {VERSION} {MESH_SUFFIX} file")
+
+    descriptor = json.loads(bytes(data[HEADER.size:HEADER.size + layout_size]))
+    vertex_dtype = _json_to_dtype(descriptor)
+    layout = VertexLayout(vertex_dtype, descriptor.get("normalized", ()), descriptor.get("packed", ()),
+                          descriptor.get("locations"))
+    vertices = data[vertex_offset:vertex_offset + vertex_count * vertex_dtype.itemsize].view(vertex_dtype)
+    index_dtype = np.uint16 if index_size == 2 else np.uint32
+    indices = data[index_offset:index_offset + index_count * index_size].view(index_dtype)
+    return MeshData(vertices, indices, layout)
+
+
+def upload_mesh(mesh: MeshData, usage: int = GL_STATIC_DRAW) -> Tuple[int, int, int]:
+    """
+    Creates a VAO with a VBO and EBO holding the mesh. The arrays are passed to glBufferData as they are, so a
+    memory mapped mesh is copied from the page cache straight into the buffers.
+
+    Args:
+    mesh (MeshData): The mesh to upload.
+    usage (int): Buffer usage hint.
+
+    Returns:
+    Tuple[int, int, int]: The VAO, VBO and EBO.
+    """
+    return mesh.layout.create_vao(mesh.vertices, mesh.indices, usage)
@@ -0,0 +1,279 @@
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from OpenGL.GL import *
+from loguru import logger
+
+FRAME = "frame"
+
+
+class _Scope:
+    """One timed scope of a frame: CPU times in perf_counter_ns, GPU times from timestamp queries."""
+
+    __slots__ = ("name", "cpu_start", "cpu_end", "start_query", "end_query")
+
+    def __init__(self, name: str, cpu_start: int, start_query: Optional[int], end_query: Optional[int]):
+        self.name = name
+        self.cpu_start = cpu_start
+        self.cpu_end = cpu_start
+        self.start_query = start_query
+        self.end_query = end_query
+
+
+class _Frame:
+    """The scopes of a frame whose GPU results may still be pending."""
+
+    __slots__ = ("number", "scopes", "elapsed_query")
+
+    def __init__(self, number: int, elapsed_query: Optional[int]):
+        self.number = number
+        self.scopes: List[_Scope] = []
+        self.elapsed_query = elapsed_query
+
+
+class FrameProfiler:
+    """
+    Measures every frame and named scopes within it on the CPU (time.perf_counter_ns) and on the GPU (timer
+    queries), to tell whether a frame is bound by the Python side issuing GL calls or by the GPU executing them.
+
+    The GPU time of the whole frame comes from a GL_TIME_ELAPSED query, scopes are bracketed by glQueryCounter
+    GL_TIMESTAMP queries since those, unlike elapsed queries, can nest. Query results are only read once
+    GL_QUERY_RESULT_AVAILABLE reports them, usually a frame or two later, so profiling never waits for the GPU.
+    The last `history` samples of every scope are kept for percentiles, and the last `trace_frames` frames can be
+    exported as a Chrome trace (chrome://tracing or https://ui.perfetto.dev) with a CPU and a GPU track.
+
+    Usage, with the GL context current:
+
+        profiler.begin_frame()
+        try:
+            with profiler.scope("draw"):
+                ...
+        finally:
+            profiler.end_frame()
+    """
+
+    def __init__(self, history: int = 300, gpu: bool = True, trace_frames: int = 600, max_pending: int = 8):
+        """
+        Args:
+        history (int): Samples per scope kept for the percentiles.
+        gpu (bool): Issue timer queries, requires GL 3.3 or ARB_timer_query.
+        trace_frames (int): Frames kept for export_chrome_trace().
+        max_pending (int): Frames whose GPU results may be outstanding, older results are dropped.
+        """
+        self.history = history
+        self.gpu = gpu
+        self.max_pending = max_pending
+        # Scope name -> rolling samples in nanoseconds
+        self.cpu_samples: Dict[str, Deque[int]] = {}
+        self.gpu_samples: Dict[str, Deque[int]] = {}
+        # Complete ("X") trace events of the last frames, (frame, event)
+        self.trace: Deque[Tuple[int, dict]] = deque()
+        self.trace_frames = trace_frames
+        self.frame = 0
+        self.current: Optional[_Frame] = None
+        self.pending: Deque[_Frame] = deque()
+        # Unused query names by target: a query object keeps the target of its first use, GL_TIME_ELAPSED queries
+        # and GL_TIMESTAMP counters cannot share names
+        self.query_pool: List[int] = []
+        self.elapsed_pool: List[int] = []
+        self.queries: List[int] = []
+        # perf_counter_ns - GL_TIMESTAMP, to put the GPU events on the CPU clock of the trace
+        self.gpu_offset = None
+        self.gpu_dropped = 0
+
+    def _query(self, elapsed: bool = False) -> int:
+        pool = self.elapsed_pool if elapsed else self.query_pool
+        if not pool:
+            new = [int(query) for query in np.ravel(glGenQueries(32))]
+            self.queries.extend(new)
+            pool.extend(new)
+        return pool.pop()
+
+    def _release(self, frame: _Frame):
+        if frame.elapsed_query is not None:
+            self.elapsed_pool.append(frame.elapsed_query)
+        for scope in frame.scopes:
+            if scope.start_query is not None:
+                self.query_pool.extend((scope.start_query, scope.end_query))
+
+    def _add_sample(self, samples: Dict[str, Deque[int]], name: str, nanoseconds: int):
+        history = samples.get(name)
+        if history is None:
+            history = samples[name] = deque(maxlen=self.history)
+        history.append(nanoseconds)
+
+    def _add_event(self, frame: int, name: str, track: int, start: int, duration: int):
+        self.trace.append((frame, {"name": name, "cat": "gpu" if track else "cpu", "ph": "X", "pid": 0,
+                                   "tid": track, "ts": start / 1000, "dur": duration / 1000,
+                                   "args": {"frame": frame}}))
+
+    def begin_frame(self):
+        """
+        Starts timing a frame. Call at the start of paintGL, and end_frame() in a finally block.
+
+        A frame that was never ended, because paintGL raised before end_frame(), is closed and dropped, so one
+        failing frame does not break profiling for the rest of the session.
+        """
+        if self.current is not None:
+            logger.warning(f"Frame {self.current.number} was not ended, dropping its timings")
+            if self.current.elapsed_query is not None:
+                # Only one elapsed query can be active, glBeginQuery below would fail otherwise
+                glEndQuery(GL_TIME_ELAPSED)
+            self._release(self.current)
+            self.current = None
+        elapsed_query = None
+        if self.gpu:
+            if self.gpu_offset is None:
+                self.gpu_offset = time.perf_counter_ns() - int(np.ravel(glGetInteger64v(GL_TIMESTAMP))[0])
+            elapsed_query = self._query(elapsed=True)
+            glBeginQuery(GL_TIME_ELAPSED, elapsed_query)
+        self.current = _Frame(self.frame, elapsed_query)
+        self.current.scopes.append(_Scope(FRAME, time.perf_counter_ns(), None, None))
+
+    @contextmanager
+    def scope(self, name: str) -> Iterator[None]:
+        """
+        Times the GL calls and Python code of a with block. Scopes nest.
+
+        Args:
+        name (str): Name of the scope, the statistics of scopes with the same name are combined.
+        """
+        if self.current is None:
+            raise RuntimeError(f"Scope '{name}' outside of begin_frame() and end_frame()")
+        start_query = end_query = None
+        if self.gpu:
+            start_query, end_query = self._query(), self._query()
+            glQueryCounter(start_query, GL_TIMESTAMP)
+        scope = _Scope(name, time.perf_counter_ns(), start_query, end_query)
+        self.current.scopes.append(scope)
+        try:
+            yield
+        finally:
+            scope.cpu_end = time.perf_counter_ns()
+            if end_query is not None:
+                glQueryCounter(end_query, GL_TIMESTAMP)
+
+    def end_frame(self):
+        """
+        Finishes the frame and collects the GPU results of earlier frames that became available. Call at the end
+        of paintGL.
+        """
+        frame = self.current
+        if frame is None:
+            raise RuntimeError("end_frame() called without begin_frame()")
+        frame.scopes[0].cpu_end = time.perf_counter_ns()
+        if frame.elapsed_query is not None:
+            glEndQuery(GL_TIME_ELAPSED)
+        self.current = None
+
+        for scope in frame.scopes:
+            self._add_sample(self.cpu_samples, scope.name, scope.cpu_end - scope.cpu_start)
+            self._add_event(frame.number, scope.name, 0, scope.cpu_start, scope.cpu_end - scope.cpu_start)
+        while self.trace and self.trace[0][0] <= frame.number - self.trace_frames:
+            self.trace.popleft()
+        self.frame += 1
+
+        if not self.gpu:
+            return
+        self.pending.append(frame)
+        self.collect()
+        while len(self.pending) > self.max_pending:
+            self._release(self.pending.popleft())
+            self.gpu_dropped += 1
+
+    def collect(self):
+        """
+        Reads the GPU results of the pending frames that are available, oldest first, without waiting.
+        """
+        available = np.zeros(1, dtype=np.int32)
+        # The signed variant: PyOpenGL has no array type for glGetQueryObjectui64v's GL_UNSIGNED_INT64, and
+        # nanosecond timestamps fit in 63 bits
+        result = np.zeros(1, dtype=np.int64)
+        while self.pending:
+            frame = self.pending[0]
+            # Queries complete in order and the elapsed query ends after every timestamp of its frame
+            glGetQueryObjectiv(frame.elapsed_query, GL_QUERY_RESULT_AVAILABLE, available)
+            if not available[0]:
+                return
+            self.pending.popleft()
+            glGetQueryObjecti64v(frame.elapsed_query, GL_QUERY_RESULT, result)
+            self._add_sample(self.gpu_samples, FRAME, int(result[0]))
+            for scope in frame.scopes[1:]:
+                glGetQueryObjecti64v(scope.start_query, GL_QUERY_RESULT, result)
+                start = int(result[0])
+                glGetQueryObjecti64v(scope.end_query, GL_QUERY_RESULT, result)
+                duration = int(result[0]) - start
+                self._add_sample(self.gpu_samples, scope.name, duration)
+                self._add_event(frame.number, scope.name, 1, start + self.gpu_offset, duration)
+            self._release(frame)
+
+    def percentiles(self, name: str = FRAME, gpu: bool = False,
+                    q: Sequence[float] = (50, 95, 99)) -> Optional[Tuple[float, ...]]:
+        """
+        Returns percentiles of the recent samples of a scope in milliseconds.
+
+        Args:
+        name (str): The scope, "frame" for whole frames.
+        gpu (bool): GPU instead of CPU time.
+        q (Sequence[float]): The percentiles.
+
+        Returns:
+        Optional[Tuple[float, ...]]: The percentiles, None without samples.
+        """
+        samples = (self.gpu_samples if gpu else self.cpu_samples).get(name)
+        if not samples:
+            return None
+        return tuple(float(value) / 1e6 for value in np.percentile(np.fromiter(samples, dtype=np.int64), q))
+
+    def bound(self) -> Optional[str]:
+        """
+        Returns "CPU" or "GPU", whichever takes longer for the median frame, None without GPU samples.
+        """
+        cpu, gpu = self.percentiles(q=(50,)), self.percentiles(gpu=True, q=(50,))
+        if cpu is None or gpu is None:
+            return None
+        return "GPU" if gpu[0] > cpu[0] else "CPU"
+
+    def report(self) -> str:
+        """
+        Returns a table of the p50/p95/p99 CPU and GPU times of every scope in milliseconds.
+        """
+        def columns(values: Optional[Tuple[float, ...]]) -> str:
+            return " ".join(f"{value:8.3f}" for value in values) if values else f"{'-':>8} " * 2 + f"{'-':>8}"
+
+        lines = [f"{'scope':<24} {'cpu p50':>8} {'cpu p95':>8} {'cpu p99':>8} {'gpu p50':>8} {'gpu p95':>8} "
+                 f"{'gpu p99':>8}"]
+        for name in self.cpu_samples:
+            lines.append(f"{name:<24} {columns(self.percentiles(name))} {columns(self.percentiles(name, True))}")
+        bound = self.bound()
+        if bound is not None:
+            lines.append(f"{bound}-bound over the last {len(self.cpu_samples[FRAME])} frames")
+        return "\n".join(lines)
+
+    def export_chrome_trace(self, path: str):
+        """
+        Writes the recent frames as a Chrome trace event JSON file.
+
+        Args:
+        path (str): The output file.
+        """
+        metadata = [{"name": "thread_name", "ph": "M", "pid": 0, "tid": track, "args": {"name": name}}
+                    for track, name in ((0, "CPU"), (1, "GPU"))]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": metadata + [event for _, event in self.trace], "displayTimeUnit": "ms"}, file)
+        logger.info(f"Wrote a trace of {len(self.trace)} events to '{path}'")
+
+    def delete(self):
+        """
+        Deletes the queries, dropping pending results.
+        """
+        if self.queries:
+            glDeleteQueries(len(self.queries), self.queries)
+        self.queries = []
+        self.query_pool = []
+        self.elapsed_pool = []
+        self.pending.clear()
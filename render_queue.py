@@ -0,0 +1,191 @@
+import ctypes
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+from OpenGL.GL import *
+
+from gl_state import gl_state
+from shader_util import Shader
+
+# Bit widths of the sort key fields. Opaque passes sort by pass, program, texture, VAO and then front to back by
+# depth. Translucent passes sort by pass and back to front by depth first, as blending needs that order.
+PASS_BITS = 4
+PROGRAM_BITS = 10
+TEXTURE_BITS = 14
+VAO_BITS = 12
+DEPTH_BITS = 24
+
+_DEPTH_MAX = (1 << DEPTH_BITS) - 1
+# Radix sort digit, numpy sorts 16-bit integers with a stable radix sort
+_DIGIT_BITS = 16
+
+
+class DrawCommand(NamedTuple):
+    """A glDrawElements call and the state it needs."""
+    shader: Shader
+    texture: int
+    texture_target: int
+    vao: int
+    count: int
+    index_type: int
+    offset: int
+    mode: int
+    # Sets the per draw uniforms, called with the shader in use
+    uniforms: Optional[Callable[[Shader], None]]
+
+
+class RenderPass(NamedTuple):
+    """Settings shared by the draws of one pass."""
+    setup: Optional[Callable[[], None]]
+    translucent: bool
+
+
+def radix_argsort(keys: np.ndarray) -> np.ndarray:
+    """
+    Stable least significant digit radix sort of uint64 keys, 16 bits per pass. Passes whose digit is the same for
+    every key are skipped, so keys that only use their upper bits take few passes.
+
+    Args:
+    keys (np.ndarray): uint64 keys.
+
+    Returns:
+    np.ndarray: The indices sorting the keys.
+    """
+    order = np.arange(len(keys))
+    for shift in range(0, 64, _DIGIT_BITS):
+        digits = ((keys >> np.uint64(shift)) & np.uint64(0xFFFF)).astype(np.uint16)
+        if digits.min() == digits.max():
+            continue
+        order = order[np.argsort(digits[order], kind="stable")]
+    return order
+
+
+class RenderQueue:
+    """
+    Collects draw submissions for a frame and executes them sorted by a 64-bit key, so draws sharing a program,
+    texture and VAO run back to back and state changes are minimized.
+
+    Submit draws in any order between begin() and execute(). Programs, textures and VAOs are mapped to small slot
+    numbers in the order they are first submitted in a frame. Slots are handed out again every frame, so objects
+    that were deleted or replaced (evicted textures, hot reloaded shaders) never use one up, and the order stays
+    stable as long as the submission order does.
+    Passes run in ascending number, each pass may have a setup callable (e.g. switching the polygon mode) that runs
+    before its first draw.
+    """
+
+    def __init__(self):
+        self.passes: Dict[int, RenderPass] = {}
+        self.commands: List[DrawCommand] = []
+        self.keys: List[int] = []
+        # Object -> slot, reset every frame
+        self.program_slots: Dict[Shader, int] = {}
+        self.texture_slots: Dict[tuple, int] = {}
+        self.vao_slots: Dict[int, int] = {}
+        self.draw_calls = 0
+        self.program_switches = 0
+        self.texture_switches = 0
+
+    def add_pass(self, index: int, setup: Optional[Callable[[], None]] = None, translucent: bool = False):
+        """
+        Configures a pass. Passes that are not configured have no setup and are opaque.
+
+        Args:
+        index (int): The pass number, lower passes run first.
+        setup (Optional[Callable[[], None]]): Called before the first draw of the pass.
+        translucent (bool): Sort the draws back to front by depth instead of by state.
+        """
+        if not 0 <= index < 1 << PASS_BITS:
+            raise ValueError(f"Pass {index} out of range, at most {1 << PASS_BITS} passes are supported")
+        self.passes[index] = RenderPass(setup, translucent)
+
+    @staticmethod
+    def _slot(slots: dict, key, bits: int, name: str) -> int:
+        slot = slots.get(key)
+        if slot is None:
+            if len(slots) >= 1 << bits:
+                raise ValueError(f"More than {1 << bits} {name}s submitted to the render queue in one frame")
+            slot = slots[key] = len(slots)
+        return slot
+
+    def begin(self):
+        """
+        Starts a frame, dropping the submissions and slots of the previous one.
+        """
+        self.commands = []
+        self.keys = []
+        self.program_slots.clear()
+        self.texture_slots.clear()
+        self.vao_slots.clear()
+
+    def submit(self, shader: Shader, vao: int, count: int, texture: int = 0, texture_target: int = GL_TEXTURE_2D,
+               render_pass: int = 0, depth: float = 0.0, index_type: int = GL_UNSIGNED_INT, offset: int = 0,
+               mode: int = GL_TRIANGLES, uniforms: Optional[Callable[[Shader], None]] = None):
+        """
+        Queues a glDrawElements call.
+
+        Args:
+        shader (Shader): The shader to draw with.
+        vao (int): The VAO, including its element buffer.
+        count (int): Number of indices.
+        texture (int): Texture bound to unit 0, 0 for none.
+        texture_target (int): Target of the texture.
+        render_pass (int): The pass to draw in.
+        depth (float): View depth in [0, 1], 0 is nearest.
+        index_type (int): Type of the indices.
+        offset (int): Byte offset of the first index in the element buffer.
+        mode (int): Primitive type.
+        uniforms (Optional[Callable[[Shader], None]]): Sets the per draw uniforms on the shader, which is in use.
+        """
+        if not 0 <= render_pass < 1 << PASS_BITS:
+            raise ValueError(f"Pass {render_pass} out of range, at most {1 << PASS_BITS} passes are supported")
+        program = self._slot(self.program_slots, shader, PROGRAM_BITS, "program")
+        texture_slot = self._slot(self.texture_slots, (int(texture_target), int(texture)), TEXTURE_BITS, "texture")
+        vao_slot = self._slot(self.vao_slots, int(vao), VAO_BITS, "VAO")
+        quantized = int(min(max(depth, 0.0), 1.0) * _DEPTH_MAX)
+
+        state = (((program << TEXTURE_BITS) | texture_slot) << VAO_BITS) | vao_slot
+        render_settings = self.passes.get(render_pass)
+        if render_settings is not None and render_settings.translucent:
+            # Farthest first
+            key = ((_DEPTH_MAX - quantized) << (PROGRAM_BITS + TEXTURE_BITS + VAO_BITS)) | state
+        else:
+            key = (state << DEPTH_BITS) | quantized
+        self.keys.append((render_pass << (64 - PASS_BITS)) | key)
+        self.commands.append(DrawCommand(shader, texture, texture_target, vao, count, index_type, offset, mode,
+                                         uniforms))
+
+    def execute(self):
+        """
+        Sorts the submitted draws and issues them, only switching the program, texture and VAO when they change.
+        """
+        self.draw_calls = 0
+        self.program_switches = 0
+        self.texture_switches = 0
+        if not self.commands:
+            return
+
+        keys = np.array(self.keys, dtype=np.uint64)
+        current_pass = current_shader = current_texture = current_vao = None
+        for index in radix_argsort(keys).tolist():
+            command = self.commands[index]
+            render_pass = self.keys[index] >> (64 - PASS_BITS)
+            if render_pass != current_pass:
+                current_pass = render_pass
+                render_settings = self.passes.get(render_pass)
+                if render_settings is not None and render_settings.setup is not None:
+                    render_settings.setup()
+            if command.shader is not current_shader:
+                current_shader = command.shader
+                current_shader.use()
+                self.program_switches += 1
+            if (command.texture_target, command.texture) != current_texture:
+                current_texture = (command.texture_target, command.texture)
+                gl_state.bind_texture(command.texture_target, command.texture)
+                self.texture_switches += 1
+            if command.vao != current_vao:
+                current_vao = command.vao
+                gl_state.bind_vertex_array(command.vao)
+            if command.uniforms is not None:
+                command.uniforms(command.shader)
+            glDrawElements(command.mode, command.count, command.index_type, ctypes.c_void_p(command.offset))
+            self.draw_calls += 1
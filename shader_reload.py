@@ -0,0 +1,126 @@
+import os
+from typing import Dict, List, Set
+
+from PySide6.QtCore import QFileSystemWatcher, QObject
+from loguru import logger
+
+from shader_util import Shader
+from util import shader_dependencies
+
+
+class ShaderReloader(QObject):
+    """
+    Watches the GLSL files of shaders and rebuilds the affected programs when one of them changes.
+
+    File change notifications only mark shaders as stale. The rebuild is submitted from update(), which has to be
+    called with the GL context current (e.g. at the start of paintGL). With parallel shader compile support the new
+    program compiles in the background and is swapped in on a later frame once it is done. A program that fails to
+    compile or link is discarded and the old one is kept.
+    """
+
+    def __init__(self, parent: QObject = None):
+        super().__init__(parent)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.on_file_changed)
+        # Absolute file path -> shaders built from it (directly or through an #include)
+        self.dependents: Dict[str, List[Shader]] = {}
+        self.stale: Set[Shader] = set()
+        # Shader -> replacement still being compiled
+        self.pending: Dict[Shader, Shader] = {}
+
+    def watch(self, shader: Shader):
+        """
+        Starts watching the files a shader was built from. Watching an already watched shader again replaces its
+        files with the current ones, so includes removed from the source stop triggering reloads.
+
+        Args:
+        shader (Shader): The shader to rebuild when one of its files changes.
+        """
+        files = self._files(shader)
+        if not files:
+            # The files could not be resolved, keep watching the previous ones until they can
+            return
+        for path, shaders in list(self.dependents.items()):
+            if path not in files and shader in shaders:
+                shaders.remove(shader)
+                if not shaders:
+                    del self.dependents[path]
+                    self.watcher.removePath(path)
+        for path in files:
+            shaders = self.dependents.setdefault(path, [])
+            if shader not in shaders:
+                shaders.append(shader)
+            if path not in self.watcher.files():
+                self.watcher.addPath(path)
+
+    def unwatch(self, shader: Shader):
+        """
+        Stops rebuilding a shader, e.g. before deleting it.
+
+        Args:
+        shader (Shader): A shader passed to watch().
+        """
+        for path, shaders in list(self.dependents.items()):
+            if shader in shaders:
+                shaders.remove(shader)
+            if not shaders:
+                del self.dependents[path]
+                self.watcher.removePath(path)
+        self.stale.discard(shader)
+        replacement = self.pending.pop(shader, None)
+        if replacement is not None:
+            replacement.delete()
+
+    @staticmethod
+    def _files(shader: Shader) -> List[str]:
+        try:
+            return (shader_dependencies(shader.module_path, shader.vertex_path)
+                    + shader_dependencies(shader.module_path, shader.frag_path))
+        except OSError as error:
+            # A file may briefly be missing while an editor replaces it
+            logger.warning(f"Could not resolve the files of shader '{shader.frag_path}': {error}")
+            return []
+
+    def on_file_changed(self, path: str):
+        """
+        Marks every shader built from the changed file as stale.
+
+        Args:
+        path (str): The changed file.
+        """
+        # Editors that save by replacing the file make the watcher drop it, so add it back
+        if os.path.exists(path) and path not in self.watcher.files():
+            self.watcher.addPath(path)
+        for shader in self.dependents.get(os.path.abspath(path), []):
+            self.stale.add(shader)
+
+    def update(self):
+        """
+        Submits rebuilds of stale shaders and swaps in replacements that finished compiling. Call with the GL context
+        current, once per frame.
+        """
+        for shader in self.stale:
+            replacement = self.pending.pop(shader, None)
+            if replacement is not None:
+                # The file changed again before the previous rebuild finished
+                replacement.delete()
+            try:
+                self.pending[shader] = Shader(shader.vertex_path, shader.frag_path, shader.module_path,
+                                              deferred=True, defines=shader.defines)
+            except OSError as error:
+                logger.warning(f"Could not reload shader '{shader.frag_path}': {error}")
+        self.stale.clear()
+
+        for shader, replacement in list(self.pending.items()):
+            if not replacement.done():
+                continue
+            del self.pending[shader]
+            replacement.finalize()
+            if not replacement.linked:
+                logger.warning(f"Reloading shader '{shader.frag_path}' failed, keeping the previous program")
+                replacement.delete()
+                continue
+            shader.swap(replacement)
+            # An #include may have been added or removed
+            self.watch(shader)
+            logger.info(f"Reloaded shader (Vertex: '{shader.vertex_path}' Frag: '{shader.frag_path}')")
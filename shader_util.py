@@ -1,15 +1,382 @@
-from typing import Tuple
+import hashlib
+import os
+import struct
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
 
 import numpy as np
 from OpenGL.GL import *
+from OpenGL.error import GLError
 from loguru import logger
 
-from util import read_shader
+from gl_state import gl_state
+from util import preprocess_shader
+
+# GL types each family of setters is allowed to write to. glUniform1i is also how samplers and images are bound to
+# texture and image units, so every opaque sampler and image type of GL 4.6 is int settable.
+_OPAQUE_DIMENSIONS = ("1D", "2D", "3D", "CUBE", "2D_RECT", "BUFFER", "1D_ARRAY", "2D_ARRAY", "CUBE_MAP_ARRAY",
+                      "2D_MULTISAMPLE", "2D_MULTISAMPLE_ARRAY")
+SAMPLER_TYPES = frozenset(
+    globals()[f"GL_{component}{kind}_{dimension}"]
+    for component in ("", "INT_", "UNSIGNED_INT_") for kind in ("SAMPLER", "IMAGE") for dimension in _OPAQUE_DIMENSIONS
+) | frozenset({
+    GL_SAMPLER_1D_SHADOW, GL_SAMPLER_2D_SHADOW, GL_SAMPLER_CUBE_SHADOW, GL_SAMPLER_2D_RECT_SHADOW,
+    GL_SAMPLER_1D_ARRAY_SHADOW, GL_SAMPLER_2D_ARRAY_SHADOW, GL_SAMPLER_CUBE_MAP_ARRAY_SHADOW,
+})
+INT_TYPES = frozenset({GL_INT, GL_BOOL}) | SAMPLER_TYPES
+FLOAT_TYPES = frozenset({GL_FLOAT, GL_BOOL})
+VEC2_TYPES = frozenset({GL_FLOAT_VEC2, GL_BOOL_VEC2})
+VEC3_TYPES = frozenset({GL_FLOAT_VEC3, GL_BOOL_VEC3})
+VEC4_TYPES = frozenset({GL_FLOAT_VEC4, GL_BOOL_VEC4})
+MAT2_TYPES = frozenset({GL_FLOAT_MAT2})
+MAT3_TYPES = frozenset({GL_FLOAT_MAT3})
+MAT4_TYPES = frozenset({GL_FLOAT_MAT4})
+
+
+def compile_shader(shader_type: int, source: str) -> int:
+    """
+    Submits a single shader stage for compilation. The compile status is not queried here, as that would block
+    until the driver is done; see check_shader.
+
+    Args:
+    shader_type (int): GL_VERTEX_SHADER or GL_FRAGMENT_SHADER.
+    source (str): The GLSL source code.
+
+    Returns:
+    int: The shader object.
+    """
+    shader = glCreateShader(shader_type)
+    glShaderSource(shader, source)
+    glCompileShader(shader)
+    return shader
+
+
+def check_shader(shader: int) -> bool:
+    """
+    Waits for a shader stage to compile, logging the info log on failure.
+
+    Args:
+    shader (int): The shader object.
+
+    Returns:
+    bool: Whether the shader compiled successfully.
+    """
+    success = glGetShaderiv(shader, GL_COMPILE_STATUS)
+    if not success:
+        infoLog = glGetShaderInfoLog(shader)
+        stage = "VERTEX" if glGetShaderiv(shader, GL_SHADER_TYPE) == GL_VERTEX_SHADER else "FRAGMENT"
+        logger.error("ERROR::SHADER::{}::COMPILATION_FAILED\n{}", stage, infoLog)
+    return bool(success)
+
+
+def link_program(program: int, *shaders: int):
+    """
+    Attaches the shader stages to the program and submits it for linking. See check_program for the link status.
+
+    Args:
+    program (int): The shader program.
+    *shaders (int): The compiled shader objects.
+    """
+    for shader in shaders:
+        glAttachShader(program, shader)
+    glLinkProgram(program)
+
+
+def check_program(program: int, *shaders: int) -> bool:
+    """
+    Waits for a program to link and detaches its shader stages. On failure the compile logs of the stages and the
+    link log are reported.
+
+    Args:
+    program (int): The shader program.
+    *shaders (int): The shader objects attached by link_program.
+
+    Returns:
+    bool: Whether the program linked successfully.
+    """
+    success = glGetProgramiv(program, GL_LINK_STATUS)
+    if not success:
+        for shader in shaders:
+            check_shader(shader)
+        infoLog = glGetProgramInfoLog(program)
+        logger.error("ERROR::SHADER::PROGRAM::LINKING_FAILED\n{}", infoLog)
+    for shader in shaders:
+        glDetachShader(program, shader)
+    return bool(success)
+
+
+def parallel_compile_supported() -> bool:
+    """
+    Returns whether the current context supports GL_KHR_parallel_shader_compile (or the ARB variant), enabling the
+    driver's compiler threads the first time it is asked.
+    """
+    global _parallel_compile
+    if _parallel_compile is None:
+        extensions = {glGetStringi(GL_EXTENSIONS, index) for index in range(glGetIntegerv(GL_NUM_EXTENSIONS))}
+        _parallel_compile = bool(extensions & {b"GL_KHR_parallel_shader_compile", b"GL_ARB_parallel_shader_compile"})
+        if _parallel_compile:
+            # Drivers may expose only one of the two extensions, the other entry point is then null (falsy).
+            # 0xFFFFFFFF lets the driver pick the number of threads
+            for set_threads in (glMaxShaderCompilerThreadsKHR, glMaxShaderCompilerThreadsARB):
+                if set_threads:
+                    set_threads(0xFFFFFFFF)
+                    break
+    return _parallel_compile
+
+
+try:
+    from OpenGL.GL.KHR.parallel_shader_compile import glMaxShaderCompilerThreadsKHR
+except ImportError:
+    glMaxShaderCompilerThreadsKHR = None
+try:
+    from OpenGL.GL.ARB.parallel_shader_compile import glMaxShaderCompilerThreadsARB
+except ImportError:
+    glMaxShaderCompilerThreadsARB = None
+
+GL_COMPLETION_STATUS_KHR = 0x91B1
+_parallel_compile = None
+
+
+class ShaderObjectPool:
+    """
+    Hands out compiled shader objects keyed by stage type and source hash, so programs sharing a stage compile it once.
+
+    Shader objects are reference counted and deleted when the last program using them releases them. GL objects
+    belong to a context (share group), so the pool keeps the objects of every context apart, keyed by the context
+    last passed to gl_state.make_current(). A recreated context never gets objects of the one it replaced.
+    """
+
+    def __init__(self):
+        # (context, shader type, source hash) -> [shader object, reference count]
+        self._entries = {}
+        # (context, shader object) -> key in _entries, object names repeat across contexts
+        self._keys = {}
+        self.compiles = 0
+        self.hits = 0
+
+    def acquire(self, shader_type: int, source: str) -> int:
+        """
+        Returns a compiled shader object for the source, compiling it only if the pool does not hold it yet.
+
+        Args:
+        shader_type (int): GL_VERTEX_SHADER or GL_FRAGMENT_SHADER.
+        source (str): The GLSL source code.
+
+        Returns:
+        int: The shader object, to be handed back with release().
+        """
+        key = (gl_state.context, int(shader_type), hashlib.sha256(source.encode()).hexdigest())
+        entry = self._entries.get(key)
+        if entry is None:
+            shader = compile_shader(shader_type, source)
+            entry = self._entries[key] = [shader, 0]
+            self._keys[(gl_state.context, shader)] = key
+            self.compiles += 1
+        else:
+            self.hits += 1
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, shader: int, context=None):
+        """
+        Drops one reference to a pooled shader object and deletes it when no program uses it anymore. Call with the
+        shader's context current.
+
+        Args:
+        shader (int): A shader object returned by acquire().
+        context: The context the shader was acquired in, defaults to the current one.
+        """
+        if context is None:
+            context = gl_state.context
+        key = self._keys.get((context, shader))
+        if key is None:
+            return
+        entry = self._entries[key]
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._entries[key]
+            del self._keys[(context, shader)]
+            glDeleteShader(shader)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+shader_pool = ShaderObjectPool()
+
+
+# Cache files start with the GLenum binary format, followed by the raw program binary
+_BINARY_HEADER = struct.Struct("<I")
+
+
+class ProgramBinaryCache:
+    """
+    Persists linked programs with glGetProgramBinary so later launches can skip compiling and linking.
+
+    Binaries are keyed by a hash of the shader sources and the driver vendor/renderer/version, since a driver only
+    accepts binaries it produced itself. A rejected binary is deleted and the caller falls back to compiling.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Args:
+        directory (str): Directory the program binaries are written to, created on first store.
+        """
+        self.directory = directory
+        self.enabled = os.environ.get("SHADER_CACHE_DISABLE", "") == ""
+        self._driver = None
+
+    def supported(self) -> bool:
+        """
+        Returns whether the cache is enabled and the current context supports at least one program binary format.
+        """
+        if not self.enabled:
+            return False
+        if self._driver is None:
+            self._driver = "\0".join(
+                (glGetString(name) or b"").decode(errors="replace")
+                for name in (GL_VENDOR, GL_RENDERER, GL_VERSION))
+            if glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS) < 1:
+                logger.info("Program binaries are not supported by this driver, the program cache is disabled")
+                self.enabled = False
+                return False
+        return True
+
+    def key(self, *sources: str) -> str:
+        """
+        Hashes the shader sources together with the driver identification.
+
+        Args:
+        *sources (str): The source code of every stage of the program.
+
+        Returns:
+        str: The hex digest used as the cache file name.
+        """
+        digest = hashlib.sha256(self._driver.encode())
+        for source in sources:
+            digest.update(b"\0")
+            digest.update(source.encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def load(self, program: int, key: str) -> bool:
+        """
+        Loads a cached binary into the program.
+
+        Args:
+        program (int): The (empty) shader program to load into.
+        key (str): The cache key from ProgramBinaryCache.key.
+
+        Returns:
+        bool: True if the program is now linked from the cached binary.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as binary_file:
+                data = binary_file.read()
+        except OSError:
+            return False
+        if len(data) <= _BINARY_HEADER.size:
+            return False
+
+        binary_format, = _BINARY_HEADER.unpack_from(data)
+        binary = np.frombuffer(data, dtype=np.uint8, offset=_BINARY_HEADER.size)
+        try:
+            glProgramBinary(program, binary_format, binary, binary.nbytes)
+            loaded = glGetProgramiv(program, GL_LINK_STATUS)
+        except GLError:
+            loaded = False
+        if loaded:
+            logger.debug(f"Loaded program binary {key[:12]}")
+            return True
+
+        logger.info(f"Program binary {key[:12]} was rejected by the driver, recompiling")
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return False
+
+    def store(self, program: int, key: str):
+        """
+        Writes the binary of a linked program to the cache.
+
+        Args:
+        program (int): The linked shader program.
+        key (str): The cache key from ProgramBinaryCache.key.
+        """
+        length = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+        if length <= 0:
+            return
+        written = np.zeros(1, dtype=np.int32)
+        binary_format = np.zeros(1, dtype=np.uint32)
+        binary = np.empty(length, dtype=np.uint8)
+        glGetProgramBinary(program, length, written, binary_format, binary)
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        # Write to a temporary file first so a crash never leaves a truncated binary behind
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as binary_file:
+                binary_file.write(_BINARY_HEADER.pack(int(binary_format[0])))
+                binary_file.write(binary[:int(written[0])].tobytes())
+            os.replace(temp_path, path)
+        except OSError as error:
+            logger.warning(f"Could not write program binary {key[:12]}: {error}")
+
+
+program_cache = ProgramBinaryCache(os.environ.get(
+    "SHADER_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".shader_cache")))
+
+
+class Uniform(NamedTuple):
+    """An active uniform of a linked program, as reported by glGetActiveUniform."""
+    name: str
+    location: int
+    gl_type: int
+    size: int
+
+
+def introspect_uniforms(program: int) -> Dict[str, Uniform]:
+    """
+    Queries every active uniform of a linked program once.
+
+    Array uniforms are registered under their base name, the driver's "name[0]" form and every "name[i]" element,
+    so the setters never have to call glGetUniformLocation.
+
+    Args:
+    program (int): The linked shader program.
+
+    Returns:
+    Dict[str, Uniform]: The uniform table keyed by uniform name.
+    """
+    uniforms = {}
+    for index in range(glGetProgramiv(program, GL_ACTIVE_UNIFORMS)):
+        name, size, gl_type = glGetActiveUniform(program, index)
+        name = name.decode() if isinstance(name, bytes) else name
+        gl_type, size = int(gl_type), int(size)
+        location = glGetUniformLocation(program, name)
+        if location < 0:
+            # Uniforms inside uniform blocks have no location
+            continue
+
+        if name.endswith("[0]"):
+            base_name = name[:-3]
+            uniforms[base_name] = Uniform(base_name, location, gl_type, size)
+            for element in range(1, size):
+                element_name = f"{base_name}[{element}]"
+                uniforms[element_name] = Uniform(element_name, glGetUniformLocation(program, element_name),
+                                                 gl_type, size - element)
+        uniforms[name] = Uniform(name, location, gl_type, size)
+    return uniforms
 
 
 class Shader:
 
-    def __init__(self, vertex_path: str, frag_path: str, module_path: str):
+    def __init__(self, vertex_path: str, frag_path: str, module_path: str, deferred: bool = False,
+                 defines: Optional[Dict[str, object]] = None):
         """
         Initializes and compiles the vertex and fragment shaders.
 
@@ -17,52 +384,175 @@ class Shader:
         vertex_path (str): Path to the vertex shader file.
         shader_path (str): Path to the fragment shader file.
         module_path (str): Module path used to read shader files.
+        deferred (bool): Only submit the compile and link, querying their status when the shader is first used.
+        defines (Optional[Dict[str, object]]): Macros injected into both stages, selecting a shader permutation.
+        """
+        vert_code = preprocess_shader(module_path, vertex_path, defines)
+        frag_code = preprocess_shader(module_path, frag_path, defines)
+        self.vertex_path = vertex_path
+        self.frag_path = frag_path
+        self.module_path = module_path
+        self.defines = defines
+        self.linked = False
+
+        # Shader Program, owned by the current context
+        self.context = gl_state.context
+        self.shader_program = glCreateProgram()
+        self.cache_key = program_cache.key(vert_code, frag_code) if program_cache.supported() else None
+        # Pooled shader stages this program was linked from, released in delete()
+        self.stages = ()
+        if self.cache_key is None or not program_cache.load(self.shader_program, self.cache_key):
+            vertex_shader = shader_pool.acquire(GL_VERTEX_SHADER, vert_code)
+            frag_shader = shader_pool.acquire(GL_FRAGMENT_SHADER, frag_code)
+            self.stages = (vertex_shader, frag_shader)
+
+            if self.cache_key is not None:
+                glProgramParameteri(self.shader_program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+            link_program(self.shader_program, vertex_shader, frag_shader)
+
+        self.uniforms = {}
+        # Shadow copy of the last value uploaded to each uniform location
+        self.uniform_values = {}
+        self.uniform_calls_issued = 0
+        self.uniform_calls_skipped = 0
+
+        self.pending = True
+        if not deferred:
+            self.finalize()
+
+    def done(self) -> bool:
+        """
+        Returns whether the program can be finalized without blocking. Without parallel shader compile support the
+        driver cannot be polled, so the program is always reported as done and finalize() may block.
+        """
+        if not self.pending or not self.stages or not parallel_compile_supported():
+            return True
+        # PyOpenGL does not know the result size of this extension query, so pass the output array explicitly
+        status = np.zeros(1, dtype=np.int32)
+        glGetProgramiv(self.shader_program, GL_COMPLETION_STATUS_KHR, status)
+        return bool(status[0])
+
+    def finalize(self):
         """
-        vert_code = read_shader(module_path, vertex_path)
-        frag_code = read_shader(module_path, frag_path)
+        Queries the link status, stores the program binary and builds the uniform table. Called by use() and the
+        setters when the shader was created deferred, so the status queries happen as late as possible.
+        """
+        if not self.pending:
+            return
+        self.pending = False
+        # A program loaded from the binary cache is already known to be linked
+        self.linked = check_program(self.shader_program, *self.stages) if self.stages else True
+        if self.linked and self.stages and self.cache_key is not None:
+            program_cache.store(self.shader_program, self.cache_key)
+
+        self.uniforms = introspect_uniforms(self.shader_program)
+        logger.info(f"Shader (Vertex: '{self.vertex_path}' Frag: '{self.frag_path}') Initialized"
+                    + (f" with defines {self.defines}" if self.defines else ""))
 
-        # Vertex shader
-        vertex_shader = glCreateShader(GL_VERTEX_SHADER)
-        glShaderSource(vertex_shader, vert_code)
-        glCompileShader(vertex_shader)
+    def use(self):
+        """
+        Activates the shader program.
+        """
+        if self.pending:
+            self.finalize()
+        gl_state.use_program(self.shader_program)
 
-        success = glGetShaderiv(vertex_shader, GL_COMPILE_STATUS)
-        if not success:
-            infoLog = glGetShaderInfoLog(vertex_shader)
-            logger.error("ERROR::SHADER::VERTEX::COMPILATION_FAILED\n", infoLog)
+    def delete(self):
+        """
+        Deletes the shader program and releases its shader stages back to the pool.
+        """
+        for stage in self.stages:
+            shader_pool.release(stage, self.context)
+        self.stages = ()
+        glDeleteProgram(self.shader_program)
 
-        # Fragment shader
-        frag_shader = glCreateShader(GL_FRAGMENT_SHADER)
-        glShaderSource(frag_shader, frag_code)
-        glCompileShader(frag_shader)
+    def swap(self, other: "Shader"):
+        """
+        Takes over the program of another shader and deletes the current one. References to this shader stay valid,
+        which is how hot reloading replaces a program in place.
 
-        success = glGetShaderiv(frag_shader, GL_COMPILE_STATUS)
-        if not success:
-            infoLog = glGetShaderInfoLog(frag_shader)
-            logger.error("ERROR::SHADER::VERTEX::COMPILATION_FAILED\n", infoLog)
+        Args:
+        other (Shader): The replacement shader, which must not be used afterwards.
+        """
+        other.finalize()
+        self.delete()
+        self.shader_program = other.shader_program
+        self.context = other.context
+        self.stages = other.stages
+        self.cache_key = other.cache_key
+        self.uniforms = other.uniforms
+        self.linked = other.linked
+        self.uniform_values = {}
+        other.stages = ()
+
+    def get_location(self, uniform_name: str, accepted_types: frozenset) -> int:
+        """
+        Looks up a uniform location in the uniform table.
 
-        # Shader Program
-        self.shader_program = glCreateProgram()
-        glAttachShader(self.shader_program, vertex_shader)
-        glAttachShader(self.shader_program, frag_shader)
-        glLinkProgram(self.shader_program)
+        Args:
+        uniform_name (str): The name of the uniform variable in the shader.
+        accepted_types (frozenset): The GL types the calling setter can write.
 
-        success = glGetProgramiv(self.shader_program, GL_LINK_STATUS)
-        if not success:
-            infoLog = glGetProgramInfoLog(self.shader_program)
-            logger.error("ERROR::SHADER::PROGRAM::LINKING_FAILED\n", infoLog)
+        Returns:
+        int: The uniform location, or -1 if the uniform is not active (GL ignores sets to -1).
 
-        # Delete the shaders as they are no longer required
-        glDeleteShader(vertex_shader)
-        glDeleteShader(frag_shader)
+        Raises:
+        TypeError: If the uniform is declared with a type the setter cannot write.
+        """
+        if self.pending:
+            self.finalize()
+        uniform = self.uniforms.get(uniform_name)
+        if uniform is None:
+            return -1
+        if uniform.gl_type not in accepted_types:
+            raise TypeError(f"Uniform '{uniform_name}' has GL type {uniform.gl_type:#06x}, "
+                            f"which cannot be set with this setter")
+        return uniform.location
+
+    def dirty_location(self, uniform_name: str, accepted_types: frozenset, value) -> int:
+        """
+        Looks up a uniform location and records the value as uploaded, unless the program already holds it.
 
-        logger.info(f"Shader (Vertex: '{vertex_path}' Frag: '{frag_path}') Initialized")
+        Args:
+        uniform_name (str): The name of the uniform variable in the shader.
+        accepted_types (frozenset): The GL types the calling setter can write.
+        value: The value about to be uploaded.
 
-    def use(self):
+        Returns:
+        int: The uniform location, or -1 if the glUniform* call can be skipped.
         """
-        Activates the shader program.
+        location = self.get_location(uniform_name, accepted_types)
+        if location < 0:
+            return -1
+
+        cached = self.uniform_values.get(location)
+        if isinstance(value, np.ndarray) or isinstance(cached, np.ndarray):
+            unchanged = cached is not None and np.array_equal(cached, value)
+            shadow = np.array(value, copy=True)
+        else:
+            shadow = tuple(value) if isinstance(value, (list, tuple)) else value
+            unchanged = cached == shadow
+
+        if unchanged:
+            self.uniform_calls_skipped += 1
+            return -1
+        self.uniform_values[location] = shadow
+        self.uniform_calls_issued += 1
+        return location
+
+    def invalidate_uniform_values(self):
+        """
+        Forgets the shadow copies so the next set of every uniform is uploaded.
+        Call this after writing uniforms of this program without going through the setters.
+        """
+        self.uniform_values.clear()
+
+    def reset_uniform_counters(self):
+        """
+        Resets the issued/skipped glUniform* call counters, e.g. at the start of a frame.
         """
-        glUseProgram(self.shader_program)
+        self.uniform_calls_issued = 0
+        self.uniform_calls_skipped = 0
 
     def set_bool(self, uniform_name: str, value: bool):
         """
@@ -72,7 +562,10 @@ class Shader:
         uniform_name (str): The name of the uniform variable in the shader.
         value (bool): The boolean value to set.
         """
-        glUniform1i(glGetUniformLocation(self.shader_program, uniform_name), int(value))
+        value = int(value)
+        location = self.dirty_location(uniform_name, INT_TYPES, value)
+        if location >= 0:
+            glUniform1i(location, value)
 
     def set_int(self, uniform_name: str, value: int):
         """
@@ -82,7 +575,9 @@ class Shader:
         uniform_name (str): The name of the uniform variable in the shader.
         value (int): The integer value to set.
         """
-        glUniform1i(glGetUniformLocation(self.shader_program, uniform_name), value)
+        location = self.dirty_location(uniform_name, INT_TYPES, value)
+        if location >= 0:
+            glUniform1i(location, value)
 
     def set_float(self, uniform_name: str, value: float):
         """
@@ -92,7 +587,9 @@ class Shader:
         uniform_name (str): The name of the uniform variable in the shader.
         value (float): The float value to set.
         """
-        glUniform1f(glGetUniformLocation(self.shader_program, uniform_name), value)
+        location = self.dirty_location(uniform_name, FLOAT_TYPES, value)
+        if location >= 0:
+            glUniform1f(location, value)
 
     def set_vec2f(self, uniform_name: str, value: Tuple[float, float]):
         """
@@ -102,7 +599,9 @@ class Shader:
         uniform_name (str): The name of the uniform variable in the shader.
         value (Tuple[float, float]): The tuple of two float values to set.
         """
-        glUniform2f(glGetUniformLocation(self.shader_program, uniform_name), *value)
+        location = self.dirty_location(uniform_name, VEC2_TYPES, value)
+        if location >= 0:
+            glUniform2f(location, *value)
 
     def set_vec3f(self, uniform_name: str, value: Tuple[float, float, float]):
         """
@@ -112,7 +611,9 @@ class Shader:
         uniform_name (str): The name of the uniform variable in the shader.
         value (Tuple[float, float, float]): The tuple of three float values to set.
         """
-        glUniform3f(glGetUniformLocation(self.shader_program, uniform_name), *value)
+        location = self.dirty_location(uniform_name, VEC3_TYPES, value)
+        if location >= 0:
+            glUniform3f(location, *value)
 
     def set_vec4f(self, uniform_name: str, value: Tuple[float, float, float, float]):
         """
@@ -122,7 +623,9 @@ class Shader:
         uniform_name (str): The name of the uniform variable in the shader.
         value (Tuple[float, float, float, float]): The tuple of four float values to set.
         """
-        glUniform4f(glGetUniformLocation(self.shader_program, uniform_name), *value)
+        location = self.dirty_location(uniform_name, VEC4_TYPES, value)
+        if location >= 0:
+            glUniform4f(location, *value)
 
     def set_mat2fv(self, uniform_name: str, matrix: np.ndarray):
         """
@@ -132,7 +635,9 @@ class Shader:
         uniform_name (str): The name of the uniform variable in the shader.
         matrix (np.ndarray): The 2x2 numpy array representing the matrix.
         """
-        glUniformMatrix2fv(glGetUniformLocation(self.shader_program, uniform_name), 1, GL_FALSE, matrix)
+        location = self.dirty_location(uniform_name, MAT2_TYPES, matrix)
+        if location >= 0:
+            glUniformMatrix2fv(location, 1, GL_FALSE, matrix)
 
     def set_mat3fv(self, uniform_name: str, matrix: np.ndarray):
         """
@@ -142,7 +647,9 @@ class Shader:
         uniform_name (str): The name of the uniform variable in the shader.
         matrix (np.ndarray): The 3x3 numpy array representing the matrix.
         """
-        glUniformMatrix3fv(glGetUniformLocation(self.shader_program, uniform_name), 1, GL_FALSE, matrix)
+        location = self.dirty_location(uniform_name, MAT3_TYPES, matrix)
+        if location >= 0:
+            glUniformMatrix3fv(location, 1, GL_FALSE, matrix)
 
     def set_mat4fv(self, uniform_name: str, matrix: np.ndarray):
         """
@@ -152,4 +659,47 @@ class Shader:
         uniform_name (str): The name of the uniform variable in the shader.
         matrix (np.ndarray): The 4x4 numpy array representing the matrix.
         """
-        glUniformMatrix4fv(glGetUniformLocation(self.shader_program, uniform_name), 1, GL_FALSE, matrix)
+        location = self.dirty_location(uniform_name, MAT4_TYPES, matrix)
+        if location >= 0:
+            glUniformMatrix4fv(location, 1, GL_FALSE, matrix)
+
+
+class ShaderFuture:
+    """
+    Future-like handle for a Shader submitted by compile_shaders.
+    """
+
+    def __init__(self, shader: Shader):
+        self.shader = shader
+
+    def done(self) -> bool:
+        """
+        Returns whether the result is available without blocking on the driver.
+        """
+        return self.shader.done()
+
+    def result(self) -> Shader:
+        """
+        Waits for the program to link and returns the finalized shader.
+        """
+        self.shader.finalize()
+        return self.shader
+
+
+def compile_shaders(shader_paths: Iterable[Tuple[str, str]], module_path: str,
+                    defines: Optional[Dict[str, object]] = None) -> List[ShaderFuture]:
+    """
+    Submits a batch of programs for compilation before querying the status of any of them, so the driver can
+    compile them in parallel (GL_KHR_parallel_shader_compile) instead of stalling on each one.
+
+    Args:
+    shader_paths (Iterable[Tuple[str, str]]): (vertex path, fragment path) pairs.
+    module_path (str): Module path used to read shader files.
+    defines (Optional[Dict[str, object]]): Macros injected into every program, see Shader.
+
+    Returns:
+    List[ShaderFuture]: A handle per program, in submission order.
+    """
+    parallel_compile_supported()
+    return [ShaderFuture(Shader(vertex_path, frag_path, module_path, deferred=True, defines=defines))
+            for vertex_path, frag_path in shader_paths]
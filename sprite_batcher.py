@@ -0,0 +1,405 @@
+import ctypes
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+from OpenGL.GL import *
+from PySide6.QtGui import QImage
+
+from buffer_util import StreamingBuffer
+from gl_state import gl_state
+from shader_util import Shader
+from util import q_image_to_numpy
+from vertex_layout import VertexLayout
+
+# One sprite corner: position, atlas texture coordinates and an 8-bit tint
+SPRITE_VERTEX_LAYOUT = VertexLayout(np.dtype([("aPos", np.float32, 2), ("aTexCoord", np.float32, 2),
+                                              ("aColor", np.uint8, 4)]), normalized=("aColor",))
+
+# Per sprite record of a frame, expanded to four vertices when the batch is flushed
+_SPRITE_DTYPE = np.dtype([("rect", np.float32, 4), ("uv", np.float32, 4), ("color", np.uint8, 4),
+                          ("group", np.int32)])
+
+# Corners of a quad as (x, y) picks from a (x0, y0, x1, y1) rectangle, counter clockwise from the bottom left
+_CORNERS = np.array([[0, 1], [2, 1], [2, 3], [0, 3]])
+
+
+class SkylinePacker:
+    """
+    Packs rectangles into a fixed size area with the skyline bottom-left heuristic.
+
+    The skyline is the list of (x, y, width) segments forming the top edge of the packed rectangles. A rectangle is
+    placed on the segment where its top edge ends up lowest (ties go to the narrowest fit), which keeps the wasted
+    area under the skyline small for the mostly similar sized images of a sprite atlas.
+    """
+
+    def __init__(self, width: int, height: int):
+        """
+        Args:
+        width (int): Width of the area.
+        height (int): Height of the area.
+        """
+        self.width = width
+        self.height = height
+        self.skyline: List[List[int]] = [[0, 0, width]]
+        self.used_area = 0
+
+    def _fit(self, index: int, width: int, height: int) -> Optional[int]:
+        """
+        Returns the y a rectangle would rest at when its left edge is on the segment at index, or None if it
+        does not fit there.
+        """
+        x = self.skyline[index][0]
+        if x + width > self.width:
+            return None
+        y = 0
+        remaining = width
+        while remaining > 0:
+            _, segment_y, segment_width = self.skyline[index]
+            y = max(y, segment_y)
+            if y + height > self.height:
+                return None
+            remaining -= segment_width
+            index += 1
+        return y
+
+    def insert(self, width: int, height: int) -> Optional[Tuple[int, int]]:
+        """
+        Places a rectangle.
+
+        Args:
+        width (int): Width of the rectangle.
+        height (int): Height of the rectangle.
+
+        Returns:
+        Optional[Tuple[int, int]]: The bottom left corner of the placed rectangle, or None if it does not fit.
+        """
+        best = None
+        for index, (_, _, segment_width) in enumerate(self.skyline):
+            y = self._fit(index, width, height)
+            if y is not None and (best is None or (y + height, segment_width) < best[0]):
+                best = ((y + height, segment_width), index, y)
+        if best is None:
+            return None
+        _, index, y = best
+        x = self.skyline[index][0]
+
+        # Raise the skyline under the rectangle and cut the segments it now covers
+        self.skyline.insert(index, [x, y + height, width])
+        right = x + width
+        while index + 1 < len(self.skyline) and self.skyline[index + 1][0] < right:
+            segment = self.skyline[index + 1]
+            segment_right = segment[0] + segment[2]
+            if segment_right <= right:
+                del self.skyline[index + 1]
+            else:
+                segment[2] = segment_right - right
+                segment[0] = right
+                break
+        # Merge neighbours at the same height
+        merged = [self.skyline[0]]
+        for segment in self.skyline[1:]:
+            if segment[1] == merged[-1][1]:
+                merged[-1][2] += segment[2]
+            else:
+                merged.append(segment)
+        self.skyline = merged
+
+        self.used_area += width * height
+        return x, y
+
+    @property
+    def occupancy(self) -> float:
+        """
+        Fraction of the area covered by packed rectangles.
+        """
+        return self.used_area / (self.width * self.height)
+
+
+class AtlasRegion(NamedTuple):
+    """An image packed into a TextureAtlas page."""
+    page: int
+    texture: int
+    x: int
+    y: int
+    width: int
+    height: int
+    # (u0, v0, u1, v1), v0 is the bottom row of the image
+    uv: Tuple[float, float, float, float]
+
+
+class TextureAtlas:
+    """
+    Packs many small images into a few large RGBA textures (pages), so sprites using different images can be drawn
+    without rebinding textures in between.
+
+    Images are stored bottom row first (see util.q_image_to_numpy), so a region's uv rectangle maps to the image
+    upright. Each image is surrounded by `padding` pixels repeating its edge, which keeps linear filtering from
+    picking up its neighbours. Pages have no mipmaps, as the mip levels would blend neighbouring images anyway.
+    """
+
+    def __init__(self, page_size: int = 2048, padding: int = 1, filter: int = GL_LINEAR):
+        """
+        Args:
+        page_size (int): Width and height of every page in pixels.
+        padding (int): Edge pixels repeated around every image.
+        filter (int): Minifying and magnifying filter of the pages.
+        """
+        self.page_size = page_size
+        self.padding = padding
+        self.filter = filter
+        self.pages: List[int] = []
+        self.packers: List[SkylinePacker] = []
+        self.regions: Dict[object, AtlasRegion] = {}
+        # Pixels of the images themselves, without padding
+        self.image_area = 0
+
+    def _add_page(self) -> int:
+        texture = glGenTextures(1)
+        gl_state.bind_texture(GL_TEXTURE_2D, texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA8, self.page_size, self.page_size, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, self.filter)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, self.filter)
+        self.pages.append(texture)
+        self.packers.append(SkylinePacker(self.page_size, self.page_size))
+        return len(self.pages) - 1
+
+    def add(self, key, image: Union[QImage, str, np.ndarray, None] = None) -> AtlasRegion:
+        """
+        Packs an image into the atlas, unless an image was already added under key. Call with the GL context current.
+
+        Args:
+        key: Name of the image, the file path when image is omitted.
+        image (Union[QImage, str, np.ndarray, None]): A QImage, an image file path or a (height, width, 4) uint8
+        array with the bottom row first. Loaded from key when None.
+
+        Returns:
+        AtlasRegion: Where the image was packed.
+        """
+        region = self.regions.get(key)
+        if region is not None:
+            return region
+
+        if image is None:
+            image = key
+        if isinstance(image, str):
+            path, image = image, QImage(image)
+            if image.isNull():
+                raise OSError(f"Could not decode image '{path}'")
+        pixels = q_image_to_numpy(image) if isinstance(image, QImage) else np.ascontiguousarray(image, np.uint8)
+        height, width = pixels.shape[:2]
+        padded_width, padded_height = width + 2 * self.padding, height + 2 * self.padding
+        if padded_width > self.page_size or padded_height > self.page_size:
+            raise ValueError(f"Image '{key}' ({width}x{height}) does not fit into a {self.page_size} atlas page")
+
+        for page, packer in enumerate(self.packers):
+            position = packer.insert(padded_width, padded_height)
+            if position is not None:
+                break
+        else:
+            page = self._add_page()
+            position = self.packers[page].insert(padded_width, padded_height)
+
+        if self.padding:
+            pixels = np.pad(pixels, ((self.padding, self.padding), (self.padding, self.padding), (0, 0)), mode="edge")
+        gl_state.bind_texture(GL_TEXTURE_2D, self.pages[page])
+        glTexSubImage2D(GL_TEXTURE_2D, 0, position[0], position[1], padded_width, padded_height, GL_RGBA,
+                        GL_UNSIGNED_BYTE, pixels)
+
+        x, y = position[0] + self.padding, position[1] + self.padding
+        uv = (x / self.page_size, y / self.page_size, (x + width) / self.page_size, (y + height) / self.page_size)
+        region = self.regions[key] = AtlasRegion(page, self.pages[page], x, y, width, height, uv)
+        self.image_area += width * height
+        return region
+
+    @property
+    def efficiency(self) -> float:
+        """
+        Fraction of the page pixels holding image pixels, padding and unused space count as waste.
+        """
+        if not self.pages:
+            return 1.0
+        return self.image_area / (len(self.pages) * self.page_size * self.page_size)
+
+    def delete(self):
+        """
+        Deletes the page textures.
+        """
+        if self.pages:
+            gl_state.delete_textures(self.pages)
+        self.pages = []
+        self.packers = []
+        self.regions = {}
+        self.image_area = 0
+
+
+class SpriteBatcher:
+    """
+    Collects textured quads between begin() and end() and draws them with one glDrawElements call per atlas page
+    and shader.
+
+    end() groups the sprites by shader (in the order the shaders were first used) and then by page, so overlapping
+    sprites are only drawn in submission order when they share a group.
+
+    When glBufferStorage is available the vertices of a frame are written straight into a StreamingBuffer and drawn
+    with a base vertex, otherwise they are uploaded into an orphaned vertex buffer with a single glBufferData call.
+    """
+
+    def __init__(self, atlas: TextureAtlas, shader: Shader, capacity: int = 1024):
+        """
+        Args:
+        atlas (TextureAtlas): The atlas the drawn regions come from.
+        shader (Shader): Shader used when draw() is not given one. It is used as is, so set its uniforms (e.g. a
+        projection matrix and the sampler unit) before end().
+        capacity (int): Initial number of sprites per frame, the buffers grow as needed.
+        """
+        self.atlas = atlas
+        self.shader = shader
+        self.sprites = np.zeros(capacity, dtype=_SPRITE_DTYPE)
+        self.count = 0
+        self.shaders: List[Shader] = []
+        # Shader -> index in shaders, for the current frame
+        self.shader_indices: Dict[int, int] = {}
+        self.draw_calls = 0
+        self.sprite_count = 0
+
+        self.vao, self.vertex_buffer, self.index_buffer = SPRITE_VERTEX_LAYOUT.create_vao(
+            np.zeros(capacity * 4, dtype=SPRITE_VERTEX_LAYOUT.dtype), self._quad_indices(capacity), GL_DYNAMIC_DRAW)
+        self.stream = None
+        if StreamingBuffer.supported():
+            glDeleteBuffers(1, [self.vertex_buffer])
+            # Room for three frames at the initial capacity
+            self._create_stream(3 * capacity * 4 * SPRITE_VERTEX_LAYOUT.stride)
+
+    def _create_stream(self, size: int):
+        """
+        Replaces the streaming buffer and points the VAO at it. The old buffer is only freed by the driver once the
+        GPU is done with it.
+        """
+        if self.stream is not None:
+            self.stream.delete()
+        self.stream = StreamingBuffer(GL_ARRAY_BUFFER, size)
+        self.vertex_buffer = self.stream.buffer
+        gl_state.bind_vertex_array(self.vao)
+        SPRITE_VERTEX_LAYOUT.bind_attributes(self.vertex_buffer)
+        gl_state.bind_vertex_array(0)
+
+    @staticmethod
+    def _quad_indices(capacity: int) -> np.ndarray:
+        return (np.arange(capacity, dtype=np.uint32)[:, None] * 4
+                + np.array([0, 1, 2, 2, 3, 0], dtype=np.uint32)).reshape(-1)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.sprites)
+
+    def _reserve(self, capacity: int):
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, self.capacity * 2)
+        sprites = np.zeros(capacity, dtype=_SPRITE_DTYPE)
+        sprites[:self.count] = self.sprites[:self.count]
+        self.sprites = sprites
+        indices = self._quad_indices(capacity)
+        # The VAO keeps referencing the same element buffer, only its storage is replaced
+        gl_state.bind_vertex_array(self.vao)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+        gl_state.bind_vertex_array(0)
+
+    def begin(self):
+        """
+        Starts a frame, dropping the sprites of the previous one.
+        """
+        self.count = 0
+        self.shaders = []
+        self.shader_indices = {}
+
+    def draw(self, region: AtlasRegion, x: float, y: float, width: Optional[float] = None,
+             height: Optional[float] = None, color: Tuple[int, int, int, int] = (255, 255, 255, 255),
+             shader: Optional[Shader] = None):
+        """
+        Queues a sprite.
+
+        Args:
+        region (AtlasRegion): The image to draw.
+        x (float): Left edge.
+        y (float): Bottom edge.
+        width (Optional[float]): Width, defaults to the image width.
+        height (Optional[float]): Height, defaults to the image height.
+        color (Tuple[int, int, int, int]): RGBA tint, 0 to 255.
+        shader (Optional[Shader]): Shader for this sprite, defaults to the batcher's shader.
+        """
+        shader = shader or self.shader
+        shader_index = self.shader_indices.get(id(shader))
+        if shader_index is None:
+            shader_index = self.shader_indices[id(shader)] = len(self.shaders)
+            self.shaders.append(shader)
+
+        self._reserve(self.count + 1)
+        sprite = self.sprites[self.count]
+        sprite["rect"] = (x, y, x + (region.width if width is None else width),
+                          y + (region.height if height is None else height))
+        sprite["uv"] = region.uv
+        sprite["color"] = color
+        # Pages stay well below 65536, so this orders by shader first and page second
+        sprite["group"] = (shader_index << 16) | region.page
+        self.count += 1
+
+    def end(self):
+        """
+        Uploads the queued sprites and draws them, one draw call per (shader, page) group.
+        """
+        self.sprite_count = self.count
+        self.draw_calls = 0
+        if self.count == 0:
+            return
+
+        sprites = self.sprites[:self.count]
+        sprites = sprites[np.argsort(sprites["group"], kind="stable")]
+        base_vertex = 0
+        if self.stream is not None:
+            frame_bytes = self.count * 4 * SPRITE_VERTEX_LAYOUT.stride
+            if 3 * frame_bytes > self.stream.size:
+                self._create_stream(max(3 * frame_bytes, 2 * self.stream.size))
+            # Aligned to whole vertices, so the offset is a base vertex
+            offset, vertices = self.stream.allocate(self.count * 4, SPRITE_VERTEX_LAYOUT.dtype,
+                                                    SPRITE_VERTEX_LAYOUT.stride)
+            base_vertex = offset // SPRITE_VERTEX_LAYOUT.stride
+            vertices = vertices.reshape(self.count, 4)
+        else:
+            vertices = np.empty((self.count, 4), dtype=SPRITE_VERTEX_LAYOUT.dtype)
+        vertices["aPos"] = sprites["rect"][:, _CORNERS]
+        vertices["aTexCoord"] = sprites["uv"][:, _CORNERS]
+        vertices["aColor"] = sprites["color"][:, None]
+
+        if self.stream is None:
+            glBindBuffer(GL_ARRAY_BUFFER, self.vertex_buffer)
+            # Orphan the previous frame's storage instead of waiting for the GPU to finish reading it
+            glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_DYNAMIC_DRAW)
+        gl_state.bind_vertex_array(self.vao)
+
+        groups = sprites["group"]
+        starts = np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]]))
+        stops = np.append(starts[1:], self.count)
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            group = int(groups[start])
+            self.shaders[group >> 16].use()
+            gl_state.bind_texture(GL_TEXTURE_2D, self.atlas.pages[group & 0xFFFF])
+            glDrawElementsBaseVertex(GL_TRIANGLES, (stop - start) * 6, GL_UNSIGNED_INT, ctypes.c_void_p(start * 6 * 4),
+                                     base_vertex)
+            self.draw_calls += 1
+        gl_state.bind_vertex_array(0)
+        if self.stream is not None:
+            self.stream.end_frame()
+
+    def delete(self):
+        """
+        Deletes the VAO and buffers.
+        """
+        gl_state.delete_vertex_arrays([self.vao])
+        if self.stream is not None:
+            self.stream.delete()
+            glDeleteBuffers(1, [self.index_buffer])
+        else:
+            glDeleteBuffers(2, [self.vertex_buffer, self.index_buffer])
@@ -0,0 +1,34 @@
+import ctypes.util
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# The GL tests render on Mesa's surfaceless EGL platform, see headless.py. PyOpenGL picks its platform on first
+# import, so this has to happen before any test module imports OpenGL.
+if not os.environ.get("DISPLAY") and ctypes.util.find_library("EGL"):
+    os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+    os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+
+@pytest.fixture(scope="session")
+def gl_context():
+    """
+    A current OpenGL 3.3 core context rendering into a 64x64 framebuffer object, the tests using it are skipped
+    where no surfaceless EGL context can be created.
+    """
+    if os.environ.get("PYOPENGL_PLATFORM") != "egl":
+        pytest.skip("Needs PyOpenGL on surfaceless EGL (libEGL without $DISPLAY)")
+    from gl_state import gl_state
+    from headless import SurfacelessContext
+
+    try:
+        context = SurfacelessContext(64, 64)
+    except Exception as error:
+        pytest.skip(f"No surfaceless EGL context: {error}")
+    gl_state.make_current(context)
+    yield context
+    context.delete()
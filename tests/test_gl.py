@@ -0,0 +1,187 @@
+import numpy as np
+import pytest
+from OpenGL.GL import *
+from OpenGL.GL.shaders import compileProgram, compileShader
+
+import indirect_renderer
+import vertex_layout
+from gl_state import gl_state
+from indirect_renderer import IndirectRenderer, MeshArena
+from mesh_util import read_mesh, upload_mesh, write_mesh
+from vertex_layout import VertexLayout, release_vaos
+
+MESH_LAYOUT = VertexLayout(np.dtype([("aPos", np.float32, 2), ("aColor", np.uint8, 4)]), normalized=("aColor",))
+ARENA_LAYOUT = VertexLayout(np.dtype([("aPos", np.float32, 2)]))
+
+MESH_VERTEX_SHADER = """
+#version 330 core
+layout (location = 0) in vec2 aPos;
+layout (location = 1) in vec4 aColor;
+out vec4 Color;
+void main()
+{
+    gl_Position = vec4(aPos, 0.0, 1.0);
+    Color = aColor;
+}
+"""
+
+# INSTANCE_DTYPE after the single vertex attribute: transform at locations 1 to 4, tint at 5, layer at 6
+INSTANCE_VERTEX_SHADER = """
+#version 330 core
+layout (location = 0) in vec2 aPos;
+layout (location = 1) in mat4 aTransform;
+layout (location = 5) in vec4 aTint;
+out vec4 Color;
+void main()
+{
+    gl_Position = aTransform * vec4(aPos, 0.0, 1.0);
+    Color = aTint;
+}
+"""
+
+FRAGMENT_SHADER = """
+#version 330 core
+in vec4 Color;
+out vec4 FragColor;
+void main()
+{
+    FragColor = Color;
+}
+"""
+
+RED, GREEN, BLUE, BLACK = (255, 0, 0, 255), (0, 255, 0, 255), (0, 0, 255, 255), (0, 0, 0, 0)
+
+
+def _quad(left: float, bottom: float, right: float, top: float):
+    positions = np.array([[left, bottom], [right, bottom], [right, top], [left, top]], dtype=np.float32)
+    return positions, np.array([0, 1, 2, 2, 3, 0], dtype=np.uint32)
+
+
+def _program(vertex_source: str) -> int:
+    return compileProgram(compileShader(vertex_source, GL_VERTEX_SHADER), compileShader(FRAGMENT_SHADER,
+                                                                                        GL_FRAGMENT_SHADER))
+
+
+def _clear():
+    glViewport(0, 0, 64, 64)
+    gl_state.clear_color(0.0, 0.0, 0.0, 0.0)
+    glClear(GL_COLOR_BUFFER_BIT)
+
+
+def _pixel(x: int, y: int):
+    """The color at a pixel of the 64x64 framebuffer, y up."""
+    return tuple(np.frombuffer(glReadPixels(x, y, 1, 1, GL_RGBA, GL_UNSIGNED_BYTE), dtype=np.uint8).tolist())
+
+
+@pytest.fixture
+def mesh_program(gl_context):
+    program = _program(MESH_VERTEX_SHADER)
+    yield program
+    gl_state.use_program(0)
+    glDeleteProgram(program)
+
+
+@pytest.fixture
+def instance_program(gl_context):
+    program = _program(INSTANCE_VERTEX_SHADER)
+    yield program
+    gl_state.use_program(0)
+    glDeleteProgram(program)
+
+
+def test_uploaded_mesh_file_and_cached_vao_draw_it(tmp_path, mesh_program):
+    positions, indices = _quad(-1.0, -1.0, 0.0, 1.0)
+    vertices = np.zeros(4, dtype=MESH_LAYOUT.dtype)
+    vertices["aPos"] = positions
+    vertices["aColor"] = RED
+    path = str(tmp_path / "quad.glmesh")
+    write_mesh(path, vertices, indices, MESH_LAYOUT)
+    mesh = read_mesh(path)
+    vao, vbo, ebo = upload_mesh(mesh)
+
+    _clear()
+    gl_state.use_program(mesh_program)
+    gl_state.bind_vertex_array(vao)
+    glDrawElements(GL_TRIANGLES, len(mesh.indices), mesh.index_type, None)
+    assert _pixel(16, 32) == RED
+    assert _pixel(48, 32) == BLACK
+
+    # A second VAO over the same buffers, created once per (layout, buffers)
+    cached = mesh.layout.cached_vao(vbo, ebo)
+    assert cached != vao
+    assert mesh.layout.cached_vao(vbo, ebo) == cached
+    _clear()
+    gl_state.bind_vertex_array(cached)
+    glDrawElements(GL_TRIANGLES, len(mesh.indices), mesh.index_type, None)
+    assert _pixel(16, 32) == RED
+
+    release_vaos(vbo)
+    assert not [key for key in vertex_layout._vao_cache if key[1] == int(vbo)]
+    gl_state.delete_vertex_arrays([vao])
+    glDeleteBuffers(2, [vbo, ebo])
+
+
+@pytest.fixture(params=["multi_draw_indirect", "base_instance", "gl33"])
+def draw_path(request, monkeypatch):
+    """Forces each of IndirectRenderer.draw()'s code paths, as on contexts without the newer entry points."""
+    if request.param != "multi_draw_indirect":
+        monkeypatch.setattr(IndirectRenderer, "supported", staticmethod(lambda: False))
+    if request.param == "gl33":
+        monkeypatch.setattr(indirect_renderer, "glDrawElementsInstancedBaseVertexBaseInstance", None)
+    return request.param
+
+
+def test_indirect_renderer_draws_every_object(instance_program, draw_path):
+    # Capacities of one quad, so the second mesh grows both buffers
+    arena = MeshArena(ARENA_LAYOUT, vertex_capacity=4, index_capacity=6)
+    renderer = IndirectRenderer(arena)
+    unused = arena.add(*_quad(-1.0, -1.0, -0.9, -0.9))
+    small = arena.add(*_quad(-0.25, -0.25, 0.25, 0.25))
+    large = arena.add(*_quad(-0.5, -0.25, 0.5, 0.25))
+    assert arena.generation > 0
+    assert small.base_vertex == 4 and large.first_index == 12
+
+    pair = renderer.add(small, count=2)
+    instances = renderer.instances_of(pair)
+    instances["transform"][:, 3, :2] = [[-0.5, 0.5], [0.5, 0.5]]
+    instances["tint"] = [[1, 0, 0, 1], [0, 1, 0, 1]]
+    single = renderer.add(large)
+    renderer.instances_of(single)["transform"][:, 3, :2] = [0.0, -0.5]
+    renderer.instances_of(single)["tint"] = [0, 0, 1, 1]
+    renderer.mark_dirty()
+
+    def check():
+        _clear()
+        gl_state.use_program(instance_program)
+        renderer.draw()
+        assert _pixel(16, 48) == RED
+        assert _pixel(48, 48) == GREEN
+        # The large quad, wider than the small ones
+        assert _pixel(20, 16) == _pixel(44, 16) == BLUE
+        assert _pixel(8, 16) == BLACK
+        assert _pixel(32, 32) == BLACK
+        assert _pixel(1, 1) == BLACK
+
+    check()
+    assert renderer.command_uploads == 1
+    check()
+    assert renderer.command_uploads == 1
+
+    # Compacting moves both meshes and replaces the buffers, the renderer follows
+    arena.free(unused)
+    generation = arena.generation
+    arena.compact()
+    assert arena.generation != generation
+    assert (small.base_vertex, small.first_index, large.base_vertex, large.first_index) == (0, 0, 4, 6)
+    assert arena.fragmentation == 0.0
+    check()
+    assert renderer.command_uploads == 2
+
+    renderer.remove(pair)
+    _clear()
+    renderer.draw()
+    assert _pixel(16, 48) == BLACK
+    assert _pixel(32, 16) == BLUE
+
+    renderer.delete()
+    arena.delete()
@@ -0,0 +1,63 @@
+import json
+
+import numpy as np
+import pytest
+
+from mesh_util import HEADER, read_mesh, write_mesh
+from vertex_layout import VertexLayout, pack_int_2_10_10_10_rev
+
+
+def test_round_trip_keeps_dtype_layout_and_data(tmp_path):
+    # Explicit offsets and itemsize with padding, which dtype.descr would turn into void fields
+    dtype = np.dtype({"names": ["position", "normal", "color"], "formats": [(np.float16, 3), np.uint32, (np.uint8, 4)],
+                      "offsets": [0, 8, 12], "itemsize": 20})
+    vertices = np.zeros(5, dtype=dtype)
+    vertices["position"] = np.arange(15).reshape(5, 3)
+    vertices["normal"] = pack_int_2_10_10_10_rev(np.tile([[0.0, 1.0, 0.0]], (5, 1)))
+    vertices["color"] = 255
+    indices = np.array([0, 1, 2, 2, 3, 4])
+    layout = VertexLayout(dtype, normalized=("color",), packed=("normal",), locations={"color": 5})
+    path = str(tmp_path / "mesh.glmesh")
+    write_mesh(path, vertices, indices, layout)
+
+    mesh = read_mesh(path)
+    assert mesh.vertices.dtype == dtype
+    assert mesh.vertices.dtype.itemsize == 20
+    assert mesh.layout == layout
+    assert [attribute.offset for attribute in mesh.layout.attributes] == [0, 8, 12]
+    np.testing.assert_array_equal(mesh.vertices, vertices)
+    assert mesh.indices.dtype == np.uint16
+    np.testing.assert_array_equal(mesh.indices, indices)
+
+
+def test_large_meshes_use_uint32_indices(tmp_path):
+    vertices = np.zeros(0x10000, dtype=[("position", np.float32, 3)])
+    path = str(tmp_path / "mesh.glmesh")
+    write_mesh(path, vertices, [0, 0xFFFF, 1])
+    mesh = read_mesh(path)
+    assert mesh.indices.dtype == np.uint32
+    np.testing.assert_array_equal(mesh.indices, [0, 0xFFFF, 1])
+
+
+def test_reads_legacy_descr_descriptors(tmp_path):
+    dtype = np.dtype([("position", np.float32, 3), ("uv", np.float32, 2)])
+    path = str(tmp_path / "mesh.glmesh")
+    write_mesh(path, np.ones(3, dtype=dtype), [0, 1, 2])
+    # Rewrite the descriptor the way earlier versions stored it, padded with spaces to keep the blob offsets
+    with open(path, "r+b") as mesh_file:
+        header = HEADER.unpack(mesh_file.read(HEADER.size))
+        descriptor = json.dumps({"descr": dtype.descr}).encode()
+        assert len(descriptor) <= header[5]
+        mesh_file.write(descriptor.ljust(header[5]))
+    mesh = read_mesh(path)
+    assert mesh.vertices.dtype == dtype
+    np.testing.assert_array_equal(mesh.vertices["uv"], 1.0)
+
+
+def test_rejects_unstructured_vertices_and_other_files(tmp_path):
+    path = tmp_path / "mesh.glmesh"
+    with pytest.raises(ValueError):
+        write_mesh(str(path), np.zeros((3, 3), dtype=np.float32), [0, 1, 2])
+    path.write_bytes(b"\0" * HEADER.size)
+    with pytest.raises(ValueError):
+        read_mesh(str(path))
@@ -0,0 +1,21 @@
+import numpy as np
+
+from render_queue import radix_argsort
+
+
+def test_radix_argsort_matches_stable_argsort():
+    rng = np.random.default_rng(1)
+    # Few distinct values, so the stability of equal keys matters
+    keys = rng.integers(0, 1 << 64, size=64, dtype=np.uint64)[rng.integers(0, 64, size=5000)]
+    np.testing.assert_array_equal(radix_argsort(keys), np.argsort(keys, kind="stable"))
+
+
+def test_radix_argsort_keys_in_one_digit():
+    # Only the top 16 bits differ, the three lower passes are skipped
+    keys = np.array([3, 1, 2, 1, 0], dtype=np.uint64) << np.uint64(48)
+    np.testing.assert_array_equal(radix_argsort(keys), [4, 1, 3, 2, 0])
+
+
+def test_radix_argsort_equal_keys_keep_their_order():
+    keys = np.full(10, 12345, dtype=np.uint64)
+    np.testing.assert_array_equal(radix_argsort(keys), np.arange(10))
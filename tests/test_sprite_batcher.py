@@ -0,0 +1,38 @@
+import numpy as np
+
+from sprite_batcher import SkylinePacker
+
+
+def test_skyline_packer_places_rectangles_without_overlap():
+    rng = np.random.default_rng(2)
+    packer = SkylinePacker(256, 256)
+    coverage = np.zeros((256, 256), dtype=np.int32)
+    placed_area = 0
+    for width, height in rng.integers(4, 40, size=(200, 2)).tolist():
+        position = packer.insert(width, height)
+        if position is None:
+            continue
+        x, y = position
+        assert 0 <= x and x + width <= 256 and 0 <= y and y + height <= 256
+        coverage[y:y + height, x:x + width] += 1
+        placed_area += width * height
+    assert coverage.max() == 1
+    assert packer.used_area == placed_area == coverage.sum()
+    assert packer.occupancy == placed_area / (256 * 256)
+
+
+def test_skyline_packer_fills_rows_bottom_left_first():
+    packer = SkylinePacker(100, 100)
+    assert packer.insert(50, 10) == (0, 0)
+    assert packer.insert(50, 20) == (50, 0)
+    # Lowest top edge: on the 10 high rectangle
+    assert packer.insert(50, 10) == (0, 10)
+    assert packer.skyline == [[0, 20, 100]]
+
+
+def test_skyline_packer_rejects_what_does_not_fit():
+    packer = SkylinePacker(64, 64)
+    assert packer.insert(65, 1) is None
+    assert packer.insert(64, 64) == (0, 0)
+    assert packer.insert(1, 1) is None
+    assert packer.occupancy == 1.0
@@ -0,0 +1,100 @@
+import numpy as np
+
+from texture_compression import (GL_COMPRESSED_RGB_S3TC_DXT1_EXT, GL_COMPRESSED_RGBA_S3TC_DXT5_EXT, compress_image,
+                                 mip_chain, read_compressed_texture, write_compressed_texture)
+
+
+def _expand_565(packed: int) -> np.ndarray:
+    r, g, b = (packed >> 11) & 31, (packed >> 5) & 63, packed & 31
+    return np.array([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], dtype=np.float32)
+
+
+def _decode_bc1(block: np.ndarray) -> np.ndarray:
+    """Decodes an 8 byte BC1 block into (16, 3) texels, as the S3TC specification defines them."""
+    color0, color1 = int(block[:2].view("<u2")[0]), int(block[2:4].view("<u2")[0])
+    end0, end1 = _expand_565(color0), _expand_565(color1)
+    if color0 > color1:
+        palette = [end0, end1, (2 * end0 + end1) / 3, (end0 + 2 * end1) / 3]
+    else:
+        palette = [end0, end1, (end0 + end1) / 2, np.zeros(3, dtype=np.float32)]
+    indices = int(block[4:8].view("<u4")[0])
+    return np.array([palette[(indices >> (2 * texel)) & 3] for texel in range(16)])
+
+
+def _decode_bc3_alpha(block: np.ndarray) -> np.ndarray:
+    alpha0, alpha1 = int(block[0]), int(block[1])
+    if alpha0 > alpha1:
+        palette = [alpha0, alpha1] + [((7 - i) * alpha0 + i * alpha1) / 7 for i in range(1, 7)]
+    else:
+        palette = [alpha0, alpha1] + [((5 - i) * alpha0 + i * alpha1) / 5 for i in range(1, 5)] + [0, 255]
+    indices = int.from_bytes(block[2:8].tobytes(), "little")
+    return np.array([palette[(indices >> (3 * texel)) & 7] for texel in range(16)])
+
+
+def _gradient(height: int, width: int) -> np.ndarray:
+    y, x = np.mgrid[0:height, 0:width]
+    return np.stack([x * 255 // max(width - 1, 1), y * 255 // max(height - 1, 1), (x + y) * 8 % 256,
+                     255 - x * 255 // max(width - 1, 1)], axis=-1).astype(np.uint8)
+
+
+def test_mip_chain_sizes_round_down():
+    levels = mip_chain(np.zeros((5, 12, 4), dtype=np.uint8))
+    assert [level.shape[:2] for level in levels] == [(5, 12), (2, 6), (1, 3), (1, 1)]
+    assert all(level.dtype == np.uint8 for level in levels)
+
+
+def test_mip_chain_box_filter():
+    pixels = np.array([[[0, 0, 0, 255], [255, 0, 0, 255]],
+                       [[0, 255, 0, 255], [0, 0, 255, 0]]], dtype=np.uint8)
+    levels = mip_chain(pixels)
+    assert levels[0] is pixels
+    # (0 + 255 + 0 + 0) / 4 = 63.75 rounds to 64
+    np.testing.assert_array_equal(levels[1], [[[64, 64, 64, 191]]])
+
+
+def test_bc1_solid_block_is_exact_in_565():
+    pixels = np.zeros((4, 4, 4), dtype=np.uint8)
+    pixels[...] = (200, 100, 50, 255)
+    block = compress_image(pixels, GL_COMPRESSED_RGB_S3TC_DXT1_EXT)
+    assert block.shape == (8,)
+    # Equal endpoints select index 0 everywhere, the 565 quantization is the only error
+    expected = _expand_565((round(200 * 31 / 255) << 11) | (round(100 * 63 / 255) << 5) | round(50 * 31 / 255))
+    np.testing.assert_array_equal(_decode_bc1(block), np.repeat(expected[None], 16, axis=0))
+
+
+def test_bc1_color_ramp_error_is_small():
+    # The colors of every block lie on the diagonal of their bounding box, which the encoder uses as endpoints
+    y, x = np.mgrid[0:9, 0:13]
+    t = (x + y)[..., None] / 20
+    pixels = np.concatenate([np.rint((1 - t) * (10, 40, 20) + t * (240, 200, 160)), np.full((9, 13, 1), 255)],
+                            axis=-1).astype(np.uint8)
+    encoded = compress_image(pixels, GL_COMPRESSED_RGB_S3TC_DXT1_EXT).reshape(-1, 8)
+    # 13x9 pads to 4x3 blocks
+    assert len(encoded) == 12
+    padded = np.pad(pixels, ((0, 3), (0, 3), (0, 0)), mode="edge")
+    blocks = padded.reshape(3, 4, 4, 4, 4).swapaxes(1, 2).reshape(12, 16, 4)
+    for block, texels in zip(encoded, blocks):
+        assert np.abs(_decode_bc1(block) - texels[:, :3]).max() <= 16
+
+
+def test_bc3_alpha_round_trip():
+    pixels = _gradient(4, 4)
+    block = compress_image(pixels, GL_COMPRESSED_RGBA_S3TC_DXT5_EXT)
+    assert block.shape == (16,)
+    alpha = pixels[..., 3].reshape(16)
+    decoded = _decode_bc3_alpha(block[:8])
+    # Eight values between the block's extremes, at most half a step (255 / 7 / 2) away
+    assert np.abs(decoded - alpha).max() <= 255 / 14 + 1
+    assert decoded.max() == alpha.max() and decoded.min() == alpha.min()
+
+
+def test_container_round_trip(tmp_path):
+    pixels = _gradient(16, 8)
+    path = str(tmp_path / "image.gltx")
+    write_compressed_texture(path, pixels, GL_COMPRESSED_RGBA_S3TC_DXT5_EXT)
+    gl_format, width, height, levels = read_compressed_texture(path)
+    assert (gl_format, width, height) == (GL_COMPRESSED_RGBA_S3TC_DXT5_EXT, 8, 16)
+    assert [(level_width, level_height) for level_width, level_height, _ in levels] == \
+        [(8, 16), (4, 8), (2, 4), (1, 2), (1, 1)]
+    for (_, _, blocks), level in zip(levels, mip_chain(pixels)):
+        np.testing.assert_array_equal(blocks, compress_image(level, GL_COMPRESSED_RGBA_S3TC_DXT5_EXT))
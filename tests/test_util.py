@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from util import preprocess_shader, shader_dependencies
+
+
+@pytest.fixture
+def shader_dir(tmp_path):
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "main.glsl").write_text('#version 330 core\n#include "lib/common.glsl"\nvoid main() {}\n')
+    (tmp_path / "lib" / "common.glsl").write_text('#include "../shared.glsl"\nfloat common;\n')
+    (tmp_path / "shared.glsl").write_text("float shared;\n")
+    # Lookups are relative to the directory of the "module" path
+    return str(tmp_path / "module.py")
+
+
+def test_includes_are_expanded_with_line_mapping(shader_dir):
+    assert preprocess_shader(shader_dir, "main.glsl") == (
+        "#version 330 core\n"
+        "#line 1 1\n"
+        "#line 1 2\nfloat shared;\n\n#line 2 1\nfloat common;\n\n"
+        "#line 3 0\n"
+        "void main() {}\n")
+
+
+def test_defines_follow_the_version_line(shader_dir):
+    source = preprocess_shader(shader_dir, "main.glsl", {"SHADOWS": None, "LIGHTS": 4})
+    lines = source.split("\n")
+    assert lines[:4] == ["#version 330 core", "#define SHADOWS", "#define LIGHTS 4", "#line 2 0"]
+
+
+def test_each_file_is_included_once(shader_dir):
+    directory = os.path.dirname(shader_dir)
+    with open(os.path.join(directory, "twice.glsl"), "w") as shader_file:
+        shader_file.write('#include "shared.glsl"\n#include "lib/common.glsl"\n')
+    source = preprocess_shader(shader_dir, "twice.glsl")
+    assert source.count("float shared;") == 1
+    assert shader_dependencies(shader_dir, "twice.glsl") == [
+        os.path.join(directory, name) for name in ("twice.glsl", "shared.glsl", os.path.join("lib", "common.glsl"))]
+
+
+def test_edits_to_includes_invalidate_the_cache(shader_dir):
+    preprocess_shader(shader_dir, "main.glsl")
+    shared = os.path.join(os.path.dirname(shader_dir), "shared.glsl")
+    with open(shared, "w") as shader_file:
+        shader_file.write("float edited;\n")
+    mtime = os.path.getmtime(shared) + 10
+    os.utime(shared, (mtime, mtime))
+    assert "float edited;" in preprocess_shader(shader_dir, "main.glsl")
+
+
+def test_missing_include_names_the_including_file(shader_dir):
+    directory = os.path.dirname(shader_dir)
+    with open(os.path.join(directory, "broken.glsl"), "w") as shader_file:
+        shader_file.write('#include "missing.glsl"\n')
+    with pytest.raises(FileNotFoundError, match="broken.glsl"):
+        preprocess_shader(shader_dir, "broken.glsl")
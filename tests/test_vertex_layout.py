@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from OpenGL.GL import GL_FLOAT, GL_HALF_FLOAT, GL_INT_2_10_10_10_REV, GL_UNSIGNED_BYTE, GL_UNSIGNED_INT
+
+from vertex_layout import VertexLayout, pack_int_2_10_10_10_rev
+
+
+def _unpack(packed: np.ndarray) -> np.ndarray:
+    """Sign extends the three 10-bit and the 2-bit fields."""
+    fields = [(packed >> shift) & mask for shift, mask in ((0, 0x3FF), (10, 0x3FF), (20, 0x3FF), (30, 0x3))]
+    bits = [10, 10, 10, 2]
+    return np.stack([np.where(field >= 1 << (width - 1), field.astype(np.int64) - (1 << width), field)
+                     for field, width in zip(fields, bits)], axis=-1)
+
+
+def test_pack_int_2_10_10_10_rev():
+    packed = pack_int_2_10_10_10_rev(np.array([[1.0, 0.0, -1.0], [0.5, -0.5, 2.0]]))
+    assert packed.dtype == np.uint32
+    # 1.0 -> 511, -1.0 -> -511, 0.5 -> 256 (rounded), values beyond [-1, 1] are clamped
+    np.testing.assert_array_equal(_unpack(packed)[:, :3], [[511, 0, -511], [256, -256, 511]])
+    assert packed[0] == 511 | (0x201 << 20)
+
+
+def test_pack_int_2_10_10_10_rev_w():
+    packed = pack_int_2_10_10_10_rev(np.array([[0.0, 0.0, 0.0, -1.0], [0.0, 0.0, 0.0, 1.0]]))
+    np.testing.assert_array_equal(_unpack(packed)[:, 3], [-1, 1])
+
+
+def test_layout_offsets_types_and_locations():
+    dtype = np.dtype([("position", np.float16, 3), ("normal", np.uint32), ("color", np.uint8, 4),
+                      ("model", np.float32, (4, 4)), ("id", np.uint32)])
+    layout = VertexLayout(dtype, normalized=("color",), packed=("normal",), locations={"model": 4})
+    assert layout.stride == dtype.itemsize == 6 + 4 + 4 + 64 + 4
+    assert [(attribute.name, attribute.location, attribute.size, attribute.gl_type, attribute.normalized,
+             attribute.integer, attribute.offset) for attribute in layout.attributes] == [
+        ("position", 0, 3, GL_HALF_FLOAT, False, False, 0),
+        ("normal", 1, 4, GL_INT_2_10_10_10_REV, True, False, 6),
+        ("color", 2, 4, GL_UNSIGNED_BYTE, True, False, 10),
+        # One location per matrix row
+        ("model", 4, 4, GL_FLOAT, False, False, 14),
+        ("model", 5, 4, GL_FLOAT, False, False, 30),
+        ("model", 6, 4, GL_FLOAT, False, False, 46),
+        ("model", 7, 4, GL_FLOAT, False, False, 62),
+        ("id", 8, 1, GL_UNSIGNED_INT, False, True, 78),
+    ]
+
+
+def test_layouts_compare_by_value():
+    dtype = np.dtype([("position", np.float32, 3), ("color", np.uint8, 4)])
+    assert VertexLayout(dtype, normalized=["color"]) == VertexLayout(dtype, normalized=("color",))
+    assert hash(VertexLayout(dtype, normalized=["color"])) == hash(VertexLayout(dtype, normalized=("color",)))
+    assert VertexLayout(dtype) != VertexLayout(dtype, normalized=("color",))
+
+
+@pytest.mark.parametrize("dtype, options", [
+    (np.dtype(np.float32), {}),
+    (np.dtype([("position", np.float32, 5)]), {}),
+    (np.dtype([("position", np.complex64)]), {}),
+    (np.dtype([("normal", np.uint16)]), {"packed": ("normal",)}),
+    (np.dtype([("position", np.float32, 3)]), {"normalized": ("missing",)}),
+])
+def test_layout_rejects_invalid_fields(dtype, options):
+    with pytest.raises(ValueError):
+        VertexLayout(dtype, **options)
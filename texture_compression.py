@@ -0,0 +1,261 @@
+import argparse
+import os
+import struct
+import sys
+from typing import List, Tuple
+
+import numpy as np
+from OpenGL.GL import *
+from PySide6.QtGui import QImage
+from loguru import logger
+
+from util import q_image_view
+
+# Block compressed formats (EXT_texture_compression_s3tc), BC1 for opaque images and BC3 for images with alpha
+GL_COMPRESSED_RGB_S3TC_DXT1_EXT = 0x83F0
+GL_COMPRESSED_RGBA_S3TC_DXT5_EXT = 0x83F3
+BLOCK_BYTES = {GL_COMPRESSED_RGB_S3TC_DXT1_EXT: 8, GL_COMPRESSED_RGBA_S3TC_DXT5_EXT: 16}
+FORMAT_NAMES = {"bc1": GL_COMPRESSED_RGB_S3TC_DXT1_EXT, "bc3": GL_COMPRESSED_RGBA_S3TC_DXT5_EXT}
+
+COMPRESSED_SUFFIX = ".gltx"
+# File header: magic, version, GL internal format, width, height, mip level count
+HEADER = struct.Struct("<4sIIIII")
+# One entry per mip level: byte offset, byte size, width, height
+LEVEL = struct.Struct("<QQII")
+MAGIC = b"GLTX"
+VERSION = 1
+# Level data is aligned so every level can be viewed straight from the memory map
+ALIGNMENT = 16
+
+# Number of block rows encoded at once, bounds the temporary arrays for large images
+_BLOCK_ROWS_PER_CHUNK = 64
+
+
+def mip_chain(pixels: np.ndarray) -> List[np.ndarray]:
+    """
+    Builds the full mip chain with a 2x2 box filter, like glGenerateMipmap.
+
+    Args:
+    pixels (np.ndarray): (height, width, 4) uint8 image.
+
+    Returns:
+    List[np.ndarray]: Level 0 (the image itself) down to 1x1.
+    """
+    levels = [pixels]
+    level = pixels.astype(np.float32)
+    while level.shape[0] > 1 or level.shape[1] > 1:
+        # GL rounds odd level sizes down, so the box filter drops the last row/column of those
+        level = level[:level.shape[0] // 2 * 2 or 1, :level.shape[1] // 2 * 2 or 1]
+        if level.shape[0] > 1:
+            level = (level[0::2] + level[1::2]) * 0.5
+        if level.shape[1] > 1:
+            level = (level[:, 0::2] + level[:, 1::2]) * 0.5
+        levels.append(np.clip(level + 0.5, 0, 255).astype(np.uint8))
+    return levels
+
+
+def _blocks(pixels: np.ndarray) -> np.ndarray:
+    """
+    Splits an image into 4x4 blocks, padding the edges by repetition.
+
+    Returns:
+    np.ndarray: (block rows, block columns, 16, 4) texels in row major order within each block.
+    """
+    height, width, _ = pixels.shape
+    padded = np.pad(pixels, ((0, -height % 4), (0, -width % 4), (0, 0)), mode="edge")
+    block_rows, block_cols = padded.shape[0] // 4, padded.shape[1] // 4
+    return padded.reshape(block_rows, 4, block_cols, 4, 4).swapaxes(1, 2).reshape(block_rows, block_cols, 16, 4)
+
+
+def _encode_color(texels: np.ndarray) -> np.ndarray:
+    """
+    Encodes BC1 color blocks in four color mode, using the inset bounding box of the block as endpoints.
+
+    Args:
+    texels (np.ndarray): (..., 16, 4) uint8 texels.
+
+    Returns:
+    np.ndarray: (..., 8) uint8 encoded blocks.
+    """
+    rgb = texels[..., :3].astype(np.float32)
+    low, high = rgb.min(axis=-2), rgb.max(axis=-2)
+    inset = (high - low) / 16
+    low, high = low + inset, high - inset
+
+    def to_565(color):
+        scale = np.array([31, 63, 31], dtype=np.float32) / 255
+        r, g, b = np.moveaxis(np.clip(np.rint(color * scale), 0, [31, 63, 31]).astype(np.uint16), -1, 0)
+        return (r << 11) | (g << 5) | b
+
+    def from_565(packed):
+        r, g, b = (packed >> 11) & 31, (packed >> 5) & 63, packed & 31
+        return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1).astype(np.float32)
+
+    color0, color1 = to_565(high), to_565(low)
+    # Four color mode requires color0 > color1
+    swap = color0 < color1
+    color0, color1 = np.where(swap, color1, color0), np.where(swap, color0, color1)
+
+    end0, end1 = from_565(color0), from_565(color1)
+    palette = np.stack([end0, end1, (2 * end0 + end1) / 3, (end0 + 2 * end1) / 3], axis=-2)
+    distances = ((rgb[..., :, None, :] - palette[..., None, :, :]) ** 2).sum(axis=-1)
+    indices = distances.argmin(axis=-1).astype(np.uint32)
+    # Equal endpoints would select three color mode, where index 3 means transparent black
+    indices[color0 == color1] = 0
+
+    packed = (indices << (2 * np.arange(16, dtype=np.uint32))).sum(axis=-1, dtype=np.uint32)
+    out = np.empty(texels.shape[:-2] + (8,), dtype=np.uint8)
+    out[..., 0:2] = color0[..., None].astype("<u2").view(np.uint8)
+    out[..., 2:4] = color1[..., None].astype("<u2").view(np.uint8)
+    out[..., 4:8] = packed[..., None].astype("<u4").view(np.uint8)
+    return out
+
+
+def _encode_alpha(texels: np.ndarray) -> np.ndarray:
+    """
+    Encodes BC3 alpha blocks in eight value mode, using the alpha range of the block as endpoints.
+
+    Args:
+    texels (np.ndarray): (..., 16, 4) uint8 texels.
+
+    Returns:
+    np.ndarray: (..., 8) uint8 encoded blocks.
+    """
+    alpha = texels[..., 3].astype(np.float32)
+    alpha0, alpha1 = alpha.max(axis=-1), alpha.min(axis=-1)
+    weights = np.array([0, 7, 1, 2, 3, 4, 5, 6], dtype=np.float32) / 7
+    # Index 0 is alpha0, index 1 alpha1 and 2-7 interpolate from alpha0 towards alpha1
+    palette = np.rint(alpha0[..., None] * (1 - weights) + alpha1[..., None] * weights)
+    indices = np.abs(alpha[..., :, None] - palette[..., None, :]).argmin(axis=-1).astype(np.uint64)
+
+    packed = (indices << (3 * np.arange(16, dtype=np.uint64))).sum(axis=-1, dtype=np.uint64)
+    out = np.empty(texels.shape[:-2] + (8,), dtype=np.uint8)
+    out[..., 0] = alpha0.astype(np.uint8)
+    out[..., 1] = alpha1.astype(np.uint8)
+    out[..., 2:8] = packed[..., None].astype("<u8").view(np.uint8)[..., :6]
+    return out
+
+
+def compress_image(pixels: np.ndarray, gl_format: int) -> np.ndarray:
+    """
+    Block compresses one image.
+
+    Args:
+    pixels (np.ndarray): (height, width, 4) uint8 image.
+    gl_format (int): GL_COMPRESSED_RGB_S3TC_DXT1_EXT or GL_COMPRESSED_RGBA_S3TC_DXT5_EXT.
+
+    Returns:
+    np.ndarray: The encoded blocks as a flat uint8 array, in the order glCompressedTexImage2D expects.
+    """
+    blocks = _blocks(pixels)
+    encoded = []
+    for start in range(0, blocks.shape[0], _BLOCK_ROWS_PER_CHUNK):
+        chunk = blocks[start:start + _BLOCK_ROWS_PER_CHUNK]
+        if gl_format == GL_COMPRESSED_RGBA_S3TC_DXT5_EXT:
+            encoded.append(np.concatenate([_encode_alpha(chunk), _encode_color(chunk)], axis=-1))
+        else:
+            encoded.append(_encode_color(chunk))
+    return np.concatenate(encoded).reshape(-1)
+
+
+def write_compressed_texture(path: str, pixels: np.ndarray, gl_format: int):
+    """
+    Compresses an image with its mip chain and writes it to a container file.
+
+    Args:
+    path (str): Destination file, conventionally ending in COMPRESSED_SUFFIX.
+    pixels (np.ndarray): (height, width, 4) uint8 image, top row first like TextureStreamer uploads.
+    gl_format (int): GL_COMPRESSED_RGB_S3TC_DXT1_EXT or GL_COMPRESSED_RGBA_S3TC_DXT5_EXT.
+    """
+    levels = [compress_image(level, gl_format) for level in mip_chain(pixels)]
+    offset = HEADER.size + LEVEL.size * len(levels)
+    table = []
+    for level, data in enumerate(levels):
+        offset += -offset % ALIGNMENT
+        table.append((offset, data.nbytes, max(pixels.shape[1] >> level, 1), max(pixels.shape[0] >> level, 1)))
+        offset += data.nbytes
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as texture_file:
+        texture_file.write(HEADER.pack(MAGIC, VERSION, gl_format, pixels.shape[1], pixels.shape[0], len(levels)))
+        for entry in table:
+            texture_file.write(LEVEL.pack(*entry))
+        for (level_offset, _, _, _), data in zip(table, levels):
+            texture_file.write(b"\0" * (level_offset - texture_file.tell()))
+            texture_file.write(data.tobytes())
+    os.replace(temp_path, path)
+
+
+def read_compressed_texture(path: str) -> Tuple[int, int, int, List[Tuple[int, int, np.ndarray]]]:
+    """
+    Memory maps a container file without reading the level data.
+
+    Args:
+    path (str): The container file.
+
+    Returns:
+    Tuple[int, int, int, List[Tuple[int, int, np.ndarray]]]: GL format, width, height and per mip level its width,
+    height and a view of its blocks in the memory map.
+    """
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    magic, version, gl_format, width, height, level_count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"'{path}' is not a version {VERSION} {COMPRESSED_SUFFIX} file")
+    levels = []
+    for level in range(level_count):
+        offset, size, level_width, level_height = LEVEL.unpack_from(data, HEADER.size + LEVEL.size * level)
+        levels.append((level_width, level_height, data[offset:offset + size]))
+    return gl_format, width, height, levels
+
+
+def upload_compressed_texture(path: str, target: int = GL_TEXTURE_2D) -> Tuple[int, int, int]:
+    """
+    Uploads every mip level of a container file to the texture bound to target, straight from the memory map.
+
+    Args:
+    path (str): The container file.
+    target (int): The texture target, e.g. GL_TEXTURE_2D.
+
+    Returns:
+    Tuple[int, int, int]: Width, height and the GPU bytes of all levels.
+    """
+    gl_format, width, height, levels = read_compressed_texture(path)
+    for level, (level_width, level_height, blocks) in enumerate(levels):
+        # PyOpenGL derives imageSize from the array
+        glCompressedTexImage2D(target, level, gl_format, level_width, level_height, 0, blocks)
+    glTexParameteri(target, GL_TEXTURE_MAX_LEVEL, len(levels) - 1)
+    return width, height, sum(blocks.nbytes for _, _, blocks in levels)
+
+
+def main(argv: List[str] = None):
+    """
+    Offline tool converting images into block compressed container files.
+    """
+    parser = argparse.ArgumentParser(description="Bake images into block compressed textures with mipmaps")
+    parser.add_argument("images", nargs="+", help="Source images, in any format QImage can read")
+    parser.add_argument("--format", choices=["auto", *FORMAT_NAMES], default="auto",
+                        help="bc1 (opaque), bc3 (with alpha) or auto to pick by the alpha channel")
+    parser.add_argument("--output", help="Output directory, defaults to next to each image")
+    args = parser.parse_args(argv)
+
+    for image_path in args.images:
+        image = QImage(image_path)
+        if image.isNull():
+            logger.error(f"Could not decode image '{image_path}'")
+            continue
+        image = image.convertToFormat(QImage.Format.Format_RGBA8888)
+        pixels = q_image_view(image)
+        if args.format == "auto":
+            gl_format = FORMAT_NAMES["bc3" if (pixels[..., 3] < 255).any() else "bc1"]
+        else:
+            gl_format = FORMAT_NAMES[args.format]
+
+        name = os.path.splitext(os.path.basename(image_path))[0] + COMPRESSED_SUFFIX
+        output_path = os.path.join(args.output or os.path.dirname(image_path), name)
+        write_compressed_texture(output_path, pixels, gl_format)
+        logger.info(f"Baked '{image_path}' -> '{output_path}' ({os.path.getsize(output_path)} bytes, "
+                    f"{pixels.nbytes} bytes uncompressed)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
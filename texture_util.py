@@ -0,0 +1,409 @@
+import ctypes
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+import numpy as np
+from OpenGL.GL import *
+from PySide6.QtGui import QImage
+from loguru import logger
+
+from buffer_util import PersistentRingBuffer
+from gl_state import gl_state
+from texture_compression import COMPRESSED_SUFFIX, upload_compressed_texture
+from util import q_image_view
+
+MIPMAP_FILTERS = frozenset({GL_NEAREST_MIPMAP_NEAREST, GL_LINEAR_MIPMAP_NEAREST,
+                            GL_NEAREST_MIPMAP_LINEAR, GL_LINEAR_MIPMAP_LINEAR})
+
+
+def decode_image(path: str) -> Tuple[QImage, np.ndarray]:
+    """
+    Decodes an image file into RGBA8888. QImage is reentrant, so this is safe to run on worker threads.
+
+    Args:
+    path (str): Path of the image file.
+
+    Returns:
+    Tuple[QImage, np.ndarray]: The image and a view of its pixels (see q_image_view), top row first.
+    The image has to be kept alive as long as the view is used.
+    """
+    image = QImage(path)
+    if image.isNull():
+        raise OSError(f"Could not decode image '{path}'")
+    image = image.convertToFormat(QImage.Format.Format_RGBA8888)
+    return image, q_image_view(image)
+
+
+class StreamedTexture:
+    """
+    Handle for a texture loaded by TextureStreamer. Bind `texture`, which is a placeholder until the image is
+    fully uploaded.
+    """
+
+    def __init__(self, path: str, placeholder: int, wrap: int, min_filter: int, mag_filter: int):
+        self.path = path
+        self.placeholder = placeholder
+        self.wrap = wrap
+        self.min_filter = min_filter
+        self.mag_filter = mag_filter
+        self.loaded_texture = None
+        self.width = 0
+        self.height = 0
+        # Exact GPU bytes, known for pre-baked compressed textures
+        self.byte_size = None
+        self.error = None
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded_texture is not None
+
+    @property
+    def texture(self) -> int:
+        return self.placeholder if self.loaded_texture is None else self.loaded_texture
+
+    @property
+    def mipmapped(self) -> bool:
+        return self.min_filter in MIPMAP_FILTERS
+
+    @property
+    def gpu_bytes(self) -> int:
+        """
+        Estimated GPU memory of the texture, a full mip chain adds a third.
+        """
+        if self.byte_size is not None:
+            return self.byte_size
+        size = self.width * self.height * 4
+        return size * 4 // 3 if self.mipmapped else size
+
+
+class TextureStreamer:
+    """
+    Loads textures without blocking frames: images are decoded on a thread pool and uploaded from paintGL in row
+    bands, never more than bytes_per_frame per frame.
+
+    When glBufferStorage is available the bands are staged in a persistently mapped pixel unpack buffer ring, so
+    glTexSubImage2D reads from GPU visible memory and returns immediately. Otherwise the bands are uploaded from the
+    decoded images directly. Textures are uploaded top row first, as QImage stores them, which needs no copy:
+    users flip the t texture coordinate (t = 1 - t) instead.
+    """
+
+    def __init__(self, bytes_per_frame: int = 8 << 20, workers: int = 4):
+        """
+        Args:
+        bytes_per_frame (int): Upload budget per update() call.
+        workers (int): Number of decoding threads.
+        """
+        self.bytes_per_frame = bytes_per_frame
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="texture-decode")
+        # (handle, future) in request order
+        self.requests = deque()
+        # (handle, image, pixels, next row) of the texture being uploaded
+        self.current = None
+        self.staging = None
+        self.placeholder = None
+
+    def load(self, path: str, wrap: int = GL_REPEAT, min_filter: int = GL_LINEAR_MIPMAP_LINEAR,
+             mag_filter: int = GL_LINEAR) -> StreamedTexture:
+        """
+        Starts loading a texture. Call with the GL context current.
+
+        Pre-baked compressed textures (COMPRESSED_SUFFIX files, see texture_compression) are uploaded right away
+        from a memory map, as they need no decoding and are a fraction of the size.
+
+        Args:
+        path (str): Path of the image file.
+        wrap (int): Wrapping mode for both the S and T axis.
+        min_filter (int): Minifying filter, mipmaps are generated if it samples them.
+        mag_filter (int): Magnifying filter.
+
+        Returns:
+        StreamedTexture: The handle, showing a placeholder until the texture is ready.
+        """
+        if self.placeholder is None:
+            self.placeholder = glGenTextures(1)
+            gl_state.bind_texture(GL_TEXTURE_2D, self.placeholder)
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, 1, 1, 0, GL_RGBA, GL_UNSIGNED_BYTE,
+                         np.array([128, 128, 128, 255], dtype=np.uint8))
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        handle = StreamedTexture(path, self.placeholder, wrap, min_filter, mag_filter)
+        if path.endswith(COMPRESSED_SUFFIX):
+            self._load_compressed(handle)
+        else:
+            self.requests.append((handle, self.executor.submit(decode_image, path)))
+        return handle
+
+    @staticmethod
+    def _load_compressed(handle: StreamedTexture):
+        texture = glGenTextures(1)
+        gl_state.bind_texture(GL_TEXTURE_2D, texture)
+        try:
+            handle.width, handle.height, handle.byte_size = upload_compressed_texture(handle.path)
+        except (OSError, ValueError) as error:
+            gl_state.delete_textures([texture])
+            handle.error = error
+            logger.error(f"Could not load texture '{handle.path}': {error}")
+            return
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, handle.wrap)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, handle.wrap)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, handle.min_filter)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, handle.mag_filter)
+        handle.loaded_texture = texture
+
+    @property
+    def busy(self) -> bool:
+        return self.current is not None or bool(self.requests)
+
+    def cancel(self, handle: StreamedTexture):
+        """
+        Stops loading a texture that is not ready yet, deleting its partly uploaded texture. The handle keeps
+        showing the placeholder. Call with the GL context current.
+
+        Args:
+        handle (StreamedTexture): A handle returned by load().
+        """
+        for index, (request, future) in enumerate(self.requests):
+            if request is handle:
+                future.cancel()
+                del self.requests[index]
+                break
+        if self.current is not None and self.current[0] is handle:
+            gl_state.delete_textures([self.current[1]])
+            self.current = None
+
+    def _next_image(self):
+        """
+        Takes the first decoded image off the request queue and allocates its texture.
+        """
+        for index, (handle, future) in enumerate(self.requests):
+            if not future.done():
+                continue
+            del self.requests[index]
+            try:
+                image, pixels = future.result()
+            except Exception as error:
+                handle.error = error
+                logger.error(f"Could not load texture '{handle.path}': {error}")
+                return self._next_image()
+
+            handle.height, handle.width, _ = pixels.shape
+            texture = glGenTextures(1)
+            gl_state.bind_texture(GL_TEXTURE_2D, texture)
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, handle.width, handle.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, handle.wrap)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, handle.wrap)
+            self.current = (handle, texture, image, pixels, 0)
+            return
+        self.current = None
+
+    def update(self):
+        """
+        Uploads up to bytes_per_frame of decoded images. Call once per frame with the GL context current.
+        """
+        if self.staging is None and PersistentRingBuffer.supported():
+            self.staging = PersistentRingBuffer(GL_PIXEL_UNPACK_BUFFER, self.bytes_per_frame)
+
+        segment = None
+        if self.staging is not None:
+            segment = self.staging.begin()
+            if segment is None:
+                # The GPU has not consumed the bands staged a few frames ago yet
+                return
+
+        budget = self.bytes_per_frame
+        while budget > 0:
+            if self.current is None:
+                self._next_image()
+                if self.current is None:
+                    break
+            handle, texture, image, pixels, row = self.current
+            row_bytes = handle.width * 4
+            # Always make progress, even when a single row exceeds the budget
+            rows = min(handle.height - row, max(budget // row_bytes, 1 if budget == self.bytes_per_frame else 0))
+            if rows == 0:
+                break
+            band = pixels[row:row + rows]
+
+            gl_state.bind_texture(GL_TEXTURE_2D, texture)
+            used = self.bytes_per_frame - budget
+            if segment is not None and band.nbytes <= segment.nbytes - used:
+                segment[used:used + band.nbytes] = band.reshape(-1)
+                # Only bind the unpack buffer around the upload, allocations with NULL data must not see it
+                glBindBuffer(GL_PIXEL_UNPACK_BUFFER, self.staging.buffer)
+                glTexSubImage2D(GL_TEXTURE_2D, 0, 0, row, handle.width, rows, GL_RGBA, GL_UNSIGNED_BYTE,
+                                ctypes.c_void_p(self.staging.offset + used))
+                glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+            else:
+                glTexSubImage2D(GL_TEXTURE_2D, 0, 0, row, handle.width, rows, GL_RGBA, GL_UNSIGNED_BYTE,
+                                np.ascontiguousarray(band))
+            budget -= band.nbytes
+
+            row += rows
+            if row < handle.height:
+                self.current = (handle, texture, image, pixels, row)
+                continue
+            if handle.mipmapped:
+                glGenerateMipmap(GL_TEXTURE_2D)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, handle.min_filter)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, handle.mag_filter)
+            handle.loaded_texture = texture
+            self.current = None
+            logger.debug(f"Streamed texture '{handle.path}' ({handle.width}x{handle.height})")
+
+        if self.staging is not None:
+            self.staging.end()
+
+    def shutdown(self):
+        """
+        Stops the decoding threads and frees the staging buffer and the placeholder. Call with the GL context
+        current.
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.requests.clear()
+        if self.current is not None:
+            gl_state.delete_textures([self.current[1]])
+            self.current = None
+        if self.staging is not None:
+            self.staging.delete()
+            self.staging = None
+        if self.placeholder is not None:
+            gl_state.delete_textures([self.placeholder])
+            self.placeholder = None
+
+
+class TextureCache:
+    """
+    Shares textures between their users, keyed by file path, file mtime and sampler parameters, and keeps the
+    estimated GPU memory under a budget by deleting the least recently used textures.
+
+    Call get() whenever a texture is used (it is a dictionary lookup and a stat), as that is what keeps it recently
+    used, and update() once per frame. Evicted textures show the placeholder again until they are requested and
+    reloaded. A file that fails to load keeps showing the placeholder and is only retried once its mtime changes.
+
+    The GL objects belong to the context (share group) they were created in. Sharing between widgets requires their
+    contexts to be in one share group (Qt.ApplicationAttribute.AA_ShareOpenGLContexts), and release() has to be
+    called when that context is about to be destroyed, so a recreated context starts from an empty cache.
+    """
+
+    def __init__(self, budget_bytes: int = 1 << 30, streamer: TextureStreamer = None):
+        """
+        Args:
+        budget_bytes (int): GPU memory the cached textures may use, including mipmaps.
+        streamer (TextureStreamer): Loader for missing textures, created on first use if not given.
+        """
+        self.budget_bytes = budget_bytes
+        self.streamer = streamer
+        # Key -> handle, least recently used first
+        self.entries: OrderedDict = OrderedDict()
+        self.loading = []
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path: str, wrap: int = GL_REPEAT, min_filter: int = GL_LINEAR_MIPMAP_LINEAR,
+            mag_filter: int = GL_LINEAR) -> StreamedTexture:
+        """
+        Returns the cached texture, starting to load it if it is not cached (or its file changed). Call with the GL
+        context current.
+
+        Args:
+        path (str): Path of the image file.
+        wrap (int): Wrapping mode for both the S and T axis.
+        min_filter (int): Minifying filter, mipmaps are generated if it samples them.
+        mag_filter (int): Magnifying filter.
+
+        Returns:
+        StreamedTexture: The shared handle, bind its `texture`.
+        """
+        path = os.path.abspath(path)
+        key = (path, os.path.getmtime(path), int(wrap), int(min_filter), int(mag_filter))
+        handle = self.entries.get(key)
+        if handle is not None:
+            # Includes failed loads, which are not retried until the file changes
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return handle
+
+        self.misses += 1
+        # The file changed: the texture of its previous version is never requested again, free it right away
+        for stale in [entry for entry in self.entries if entry[0] == path and entry[2:] == key[2:]]:
+            self.evict(stale)
+        if self.streamer is None:
+            self.streamer = TextureStreamer()
+        handle = self.streamer.load(path, wrap, min_filter, mag_filter)
+        self.entries[key] = handle
+        self.loading.append(handle)
+        return handle
+
+    def update(self):
+        """
+        Advances the streaming uploads and evicts textures once the budget is exceeded. Call once per frame with
+        the GL context current.
+        """
+        if self.streamer is not None:
+            self.streamer.update()
+
+        still_loading = []
+        for handle in self.loading:
+            if handle.ready:
+                self.used_bytes += handle.gpu_bytes
+            elif handle.error is None:
+                still_loading.append(handle)
+        self.loading = still_loading
+
+        if self.used_bytes > self.budget_bytes:
+            # The most recently used texture is kept even if it exceeds the budget on its own
+            resident = [key for key, handle in self.entries.items() if handle.ready]
+            for key in resident[:-1]:
+                if self.used_bytes <= self.budget_bytes:
+                    break
+                self.evict(key)
+
+    def evict(self, key):
+        """
+        Deletes a cached texture, cancelling its load if it is still streaming. Call with the GL context current.
+
+        Args:
+        key: The cache key of the entry.
+        """
+        handle = self.entries.pop(key)
+        # Handles still in `loading` are not counted in used_bytes yet
+        counted = handle not in self.loading
+        if not counted:
+            self.loading.remove(handle)
+        if not handle.ready and handle.error is None:
+            # Otherwise the streamer would finish the upload into a texture nothing tracks or deletes
+            if self.streamer is not None:
+                self.streamer.cancel(handle)
+        elif handle.ready:
+            if counted:
+                self.used_bytes -= handle.gpu_bytes
+            gl_state.delete_textures([handle.loaded_texture])
+            handle.loaded_texture = None
+            self.evictions += 1
+            logger.debug(f"Evicted texture '{handle.path}' ({handle.gpu_bytes} bytes)")
+
+    def clear(self):
+        """
+        Deletes every cached texture. Call with the GL context current.
+        """
+        for key in list(self.entries):
+            self.evict(key)
+        self.loading.clear()
+
+    def release(self):
+        """
+        Deletes every cached texture and shuts the streamer down, freeing all GL objects of the cache. Call with the
+        GL context current when it is about to be destroyed. The cache can be used again afterwards, in a new
+        context.
+        """
+        self.clear()
+        if self.streamer is not None:
+            self.streamer.shutdown()
+            self.streamer = None
+
+
+texture_cache = TextureCache()
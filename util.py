@@ -1,4 +1,7 @@
+import itertools
 import os
+import re
+from typing import Dict, List, Optional, Sequence
 
 import numpy as np
 from PySide6.QtGui import QImage
@@ -17,13 +20,149 @@ def read_shader(mod_file_path: str, filepath: str) -> str:
         return shader_file.read()
 
 
+_INCLUDE_PATTERN = re.compile(r'^[ \t]*#[ \t]*include[ \t]+"([^"]+)"[ \t]*$', re.MULTILINE)
+_VERSION_PATTERN = re.compile(r'^[ \t]*#[ \t]*version\b.*$', re.MULTILINE)
+
+# Raw file contents keyed by absolute path -> (mtime, source), shared by every include of the file
+_source_cache = {}
+# Expanded sources keyed by (absolute path, defines) -> (((dependency path, mtime), ...), source)
+_preprocess_cache = {}
+
+
+def _read_source(path: str) -> str:
+    """
+    Reads a shader file, reusing the previous read while its mtime is unchanged
+    :param path: Absolute path of the shader file
+    :return: the code in the shader file in string format
+    """
+    mtime = os.path.getmtime(path)
+    cached = _source_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'r') as shader_file:
+        source = shader_file.read()
+    _source_cache[path] = (mtime, source)
+    return source
+
+
+def _expand_includes(path: str, dependencies: Dict[str, float]) -> str:
+    """
+    Recursively replaces #include "file" directives, resolved relative to the including file. Every file is included
+    at most once, so include cycles and diamonds are harmless.
+    :param path: Absolute path of the shader file to expand
+    :param dependencies: Collects the path and mtime of every file the expansion read
+    :return: the expanded code
+    """
+    source = _read_source(path)
+    dependencies[path] = os.path.getmtime(path)
+    file_index = len(dependencies) - 1
+
+    def replace(match: re.Match) -> str:
+        include_path = os.path.normpath(os.path.join(os.path.dirname(path), match.group(1)))
+        if include_path in dependencies:
+            return ""
+        if not os.path.isfile(include_path):
+            raise FileNotFoundError(f"{path}: cannot find include '{match.group(1)}'")
+        include_index = len(dependencies)
+        included = _expand_includes(include_path, dependencies)
+        # Keep compiler error line numbers pointing at the original files
+        next_line = source.count("\n", 0, match.end()) + 2
+        return f"#line 1 {include_index}\n{included}\n#line {next_line} {file_index}"
+
+    return _INCLUDE_PATTERN.sub(replace, source)
+
+
+def _inject_defines(source: str, defines: Dict[str, object]) -> str:
+    """
+    Inserts #define lines after the #version directive, which has to stay the first statement
+    :param source: Shader code
+    :param defines: Macro names mapped to their values, None defines the macro without a value
+    :return: the code with the defines injected
+    """
+    if not defines:
+        return source
+    lines = "".join(f"#define {name}\n" if value is None else f"#define {name} {value}\n"
+                    for name, value in defines.items())
+    version = _VERSION_PATTERN.search(source)
+    if version is None:
+        return f"{lines}#line 1 0\n{source}"
+    # Restore the line numbering of the code following the #version line
+    next_line = source.count("\n", 0, version.end()) + 2
+    return f"{source[:version.end()]}\n{lines}#line {next_line} 0{source[version.end():]}"
+
+
+def preprocess_shader(mod_file_path: str, filepath: str, defines: Optional[Dict[str, object]] = None) -> str:
+    """
+    Reads a shader file like read_shader, resolving #include directives and injecting #defines. The expanded code is
+    memoized by (path, defines) and reused until the mtime of the file or any of its includes changes
+    :param mod_file_path: File path of the module that is calling this function
+    :param filepath: Relative File path of the shader file with respect to the module calling this function
+    :param defines: Macro names mapped to their values, None defines the macro without a value
+    :return: the preprocessed code in string format
+    """
+    path = os.path.abspath(os.path.join(os.path.dirname(mod_file_path), filepath))
+    key = (path, tuple(sorted((defines or {}).items())))
+    cached = _preprocess_cache.get(key)
+    if cached is not None and all(os.path.getmtime(dep) == mtime for dep, mtime in cached[0]):
+        return cached[1]
+
+    dependencies = {}
+    source = _inject_defines(_expand_includes(path, dependencies), defines)
+    _preprocess_cache[key] = (tuple(dependencies.items()), source)
+    return source
+
+
+def shader_dependencies(mod_file_path: str, filepath: str) -> List[str]:
+    """
+    Lists the shader file and every file it includes
+    :param mod_file_path: File path of the module that is calling this function
+    :param filepath: Relative File path of the shader file with respect to the module calling this function
+    :return: absolute paths, the shader file itself first
+    """
+    dependencies = {}
+    _expand_includes(os.path.abspath(os.path.join(os.path.dirname(mod_file_path), filepath)), dependencies)
+    return list(dependencies)
+
+
+def shader_permutations(keywords: Sequence[str]) -> List[Dict[str, object]]:
+    """
+    Generates the define sets for every on/off combination of the keywords of a material
+    :param keywords: Macro names that can each be enabled or disabled
+    :return: one defines dict per permutation, containing only the enabled keywords (2 ** len(keywords) entries)
+    """
+    return [{keyword: None for keyword, enabled in zip(keywords, combination) if enabled}
+            for combination in itertools.product((False, True), repeat=len(keywords))]
+
+
+def q_image_view(image: QImage) -> np.ndarray:
+    """
+    Wraps the pixels of an RGBA8888 QImage in a (height, width, 4) array without copying them. Rows are in QImage
+    order, top row first. The array is only valid while the image is alive and unmodified
+    :param image: QImage in Format_RGBA8888
+    :return: a read only view of the image memory
+    """
+    width = image.width()
+    height = image.height()
+    arr = np.frombuffer(image.constBits(), dtype=np.uint8, count=height * image.bytesPerLine())
+    # Drop any scanline padding, this stays a view
+    return arr.reshape(height, image.bytesPerLine())[:, :width * 4].reshape(height, width, 4)
+
+
 def q_image_to_numpy(incoming_image: QImage):
     """Converts a QImage into an opencv MAT format"""
     incoming_image = incoming_image.convertToFormat(QImage.Format.Format_RGBA8888)
 
-    width = incoming_image.width()
-    height = incoming_image.height()
+    # A single copy that also flips the rows, leaving a contiguous array OpenGL can read directly
+    return np.ascontiguousarray(q_image_view(incoming_image)[::-1])
+
 
-    ptr = incoming_image.constBits()
-    arr = np.array(ptr).reshape(height, width, 4)  # Copies the data
-    return arr[::-1]
+def numpy_to_q_image(pixels: np.ndarray) -> QImage:
+    """
+    Converts pixels back into a QImage, the inverse of q_image_to_numpy
+    :param pixels: (height, width, 4) RGBA array with the bottom row first, as glReadPixels writes them
+    :return: an RGBA8888 image, top row first, owning a copy of the pixels
+    """
+    height, width, _ = pixels.shape
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+    # Mirroring is the single copy, and the resulting image owns its memory instead of referencing the array
+    return QImage(pixels.data, width, height, width * 4, QImage.Format.Format_RGBA8888).mirrored(False, True)
@@ -0,0 +1,216 @@
+import ctypes
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+import numpy as np
+from OpenGL.GL import *
+
+from gl_state import gl_state
+
+# numpy base type -> GL component type
+GL_TYPES = {
+    np.dtype(np.float32): GL_FLOAT,
+    np.dtype(np.float16): GL_HALF_FLOAT,
+    np.dtype(np.float64): GL_DOUBLE,
+    np.dtype(np.int8): GL_BYTE,
+    np.dtype(np.uint8): GL_UNSIGNED_BYTE,
+    np.dtype(np.int16): GL_SHORT,
+    np.dtype(np.uint16): GL_UNSIGNED_SHORT,
+    np.dtype(np.int32): GL_INT,
+    np.dtype(np.uint32): GL_UNSIGNED_INT,
+}
+
+
+class Attribute(NamedTuple):
+    """A single glVertexAttrib*Pointer call derived from a dtype field."""
+    name: str
+    location: int
+    size: int
+    gl_type: int
+    normalized: bool
+    integer: bool
+    offset: int
+
+
+def pack_int_2_10_10_10_rev(vectors: np.ndarray) -> np.ndarray:
+    """
+    Packs unit vectors (e.g. normals) into the GL_INT_2_10_10_10_REV format, 4 bytes instead of 12.
+
+    Args:
+    vectors (np.ndarray): (n, 3) or (n, 4) floats in [-1, 1], the optional w uses the 2 high bits.
+
+    Returns:
+    np.ndarray: (n,) uint32, x in the low bits.
+    """
+    vectors = np.clip(np.asarray(vectors, dtype=np.float32), -1.0, 1.0)
+    xyz = np.rint(vectors[:, :3] * 511).astype(np.int32) & 0x3FF
+    packed = xyz[:, 0] | (xyz[:, 1] << 10) | (xyz[:, 2] << 20)
+    if vectors.shape[1] > 3:
+        packed |= (np.rint(vectors[:, 3]).astype(np.int32) & 0x3) << 30
+    return packed.astype(np.uint32)
+
+
+class VertexLayout:
+    """
+    Vertex attribute layout derived from a numpy structured dtype, one field per attribute.
+
+    Stride and offsets come from the dtype, component counts from the field shapes and component types from the
+    field types, so compact types work as they are declared:
+
+    - float16 fields become GL_HALF_FLOAT attributes
+    - integer fields listed in `normalized` (e.g. uint8 colors) are normalized to [0, 1] / [-1, 1] floats, other
+      integer fields are integer attributes (ivec/uvec in GLSL)
+    - uint32/int32 fields listed in `packed` are signed normalized GL_INT_2_10_10_10_REV vec4s
+      (see pack_int_2_10_10_10_rev)
+    - 2D fields, e.g. (4, 4) float32 matrices, take one location per row
+
+    Layouts are hashable, so they can key VAO caches.
+    """
+
+    def __init__(self, dtype: np.dtype, normalized: Iterable[str] = (), packed: Iterable[str] = (),
+                 locations: Optional[Dict[str, int]] = None):
+        """
+        Args:
+        dtype (np.dtype): Structured dtype of one vertex.
+        normalized (Iterable[str]): Integer fields read as normalized floats.
+        packed (Iterable[str]): 32-bit fields holding GL_INT_2_10_10_10_REV vectors.
+        locations (Optional[Dict[str, int]]): Attribute locations by field name. Fields not listed get the next
+        location after the previous field.
+        """
+        self.dtype = np.dtype(dtype)
+        if self.dtype.names is None:
+            raise ValueError("VertexLayout needs a structured dtype with one field per attribute")
+        self.normalized = frozenset(normalized)
+        self.packed = frozenset(packed)
+        self.locations = dict(locations or {})
+        unknown = (self.normalized | self.packed | set(self.locations)) - set(self.dtype.names)
+        if unknown:
+            raise ValueError(f"Unknown vertex fields: {sorted(unknown)}")
+
+        self.attributes = []
+        location = 0
+        for name in self.dtype.names:
+            field_dtype, offset = self.dtype.fields[name][:2]
+            location = self.locations.get(name, location)
+            base = field_dtype.base
+            if name in self.packed:
+                if base.itemsize != 4 or base.kind not in "iu" or field_dtype.shape:
+                    raise ValueError(f"Packed field '{name}' must be a scalar 32-bit integer")
+                self.attributes.append(Attribute(name, location, 4, GL_INT_2_10_10_10_REV, True, False, offset))
+                location += 1
+                continue
+            if base not in GL_TYPES:
+                raise ValueError(f"Field '{name}' has unsupported type {base}")
+
+            shape = field_dtype.shape or (1,)
+            rows, size = (1, shape[0]) if len(shape) == 1 else shape
+            if not 1 <= size <= 4 or len(shape) > 2:
+                raise ValueError(f"Field '{name}' must have 1 to 4 components per location, got shape {shape}")
+            integer = base.kind in "iu" and name not in self.normalized
+            for row in range(rows):
+                self.attributes.append(Attribute(name, location, size, GL_TYPES[base], name in self.normalized,
+                                                 integer, offset + row * size * base.itemsize))
+                location += 1
+
+    @property
+    def stride(self) -> int:
+        return self.dtype.itemsize
+
+    def _key(self):
+        return repr(self.dtype.descr), self.normalized, self.packed, tuple(sorted(self.locations.items()))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, VertexLayout) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def __repr__(self) -> str:
+        return f"VertexLayout({self.dtype}, stride={self.stride})"
+
+    def bind_attributes(self, vertex_buffer: int, base_offset: int = 0, divisor: int = 0):
+        """
+        Points the attributes of the bound VAO at a vertex buffer.
+
+        Args:
+        vertex_buffer (int): Buffer holding vertices of this layout.
+        base_offset (int): Byte offset of the first vertex in the buffer.
+        divisor (int): Attribute divisor, 1 for per instance attributes.
+        """
+        glBindBuffer(GL_ARRAY_BUFFER, vertex_buffer)
+        for attribute in self.attributes:
+            pointer = ctypes.c_void_p(base_offset + attribute.offset)
+            if attribute.integer:
+                glVertexAttribIPointer(attribute.location, attribute.size, attribute.gl_type, self.stride, pointer)
+            else:
+                glVertexAttribPointer(attribute.location, attribute.size, attribute.gl_type,
+                                      GL_TRUE if attribute.normalized else GL_FALSE, self.stride, pointer)
+            glEnableVertexAttribArray(attribute.location)
+            if divisor:
+                glVertexAttribDivisor(attribute.location, divisor)
+
+    def create_vao(self, vertices: np.ndarray, indices: np.ndarray = None,
+                   usage: int = GL_STATIC_DRAW) -> Tuple[int, int, Optional[int]]:
+        """
+        Uploads vertices (and indices) into new buffers and creates a VAO using them with this layout.
+
+        Args:
+        vertices (np.ndarray): Vertex data, a structured array of this dtype or any array with the same bytes.
+        indices (np.ndarray): Optional element indices.
+        usage (int): Buffer usage hint.
+
+        Returns:
+        Tuple[int, int, Optional[int]]: The VAO, VBO and EBO (None without indices).
+        """
+        vao = glGenVertexArrays(1)
+        gl_state.bind_vertex_array(vao)
+
+        vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, usage)
+        self.bind_attributes(vbo)
+
+        ebo = None
+        if indices is not None:
+            ebo = glGenBuffers(1)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, ebo)
+            glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, usage)
+
+        gl_state.bind_vertex_array(0)
+        return vao, vbo, ebo
+
+    def cached_vao(self, vertex_buffer: int, index_buffer: int = None) -> int:
+        """
+        Returns a VAO binding existing buffers with this layout, creating it on first use.
+
+        Args:
+        vertex_buffer (int): Buffer holding vertices of this layout.
+        index_buffer (int): Optional element buffer.
+
+        Returns:
+        int: The shared VAO.
+        """
+        key = (self, int(vertex_buffer), None if index_buffer is None else int(index_buffer))
+        vao = _vao_cache.get(key)
+        if vao is None:
+            vao = _vao_cache[key] = glGenVertexArrays(1)
+            gl_state.bind_vertex_array(vao)
+            self.bind_attributes(vertex_buffer)
+            if index_buffer is not None:
+                glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, index_buffer)
+            gl_state.bind_vertex_array(0)
+        return vao
+
+
+# (layout, vertex buffer, index buffer) -> VAO
+_vao_cache = {}
+
+
+def release_vaos(vertex_buffer: int):
+    """
+    Deletes the cached VAOs that use a vertex buffer, call before deleting the buffer.
+
+    Args:
+    vertex_buffer (int): The vertex buffer.
+    """
+    for key in [key for key in _vao_cache if key[1] == int(vertex_buffer)]:
+        gl_state.delete_vertex_arrays([_vao_cache.pop(key)])